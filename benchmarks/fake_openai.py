@@ -0,0 +1,219 @@
+"""
+Local stand-in for the OpenAI chat-completions and embeddings endpoints.
+
+FakeOpenAIBackend is an httpx transport: pass it to ClientFactory(transport=...) and every
+engine, RAG system and embeddings client built from that factory talks to it instead of the
+network. Each request waits for a latency drawn from a log-normal distribution and is
+answered in the shape the engine expects for its stage (JSON labels for the user turn and
+batched bias calls, maxim scores, free text for replies and summaries), with a completion
+length drawn from a second log-normal distribution. Prompt caching is simulated the way the
+provider does it: a prompt of at least 1024 tokens reports the longest prefix it shares with
+an earlier prompt, in steps of 128 tokens, as cached. Embeddings are deterministic hashed
+bag-of-words vectors, so retrieval over a FAISS index still returns related chunks.
+"""
+import array
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Tuple
+
+import httpx
+
+from EchoMind.engines.llm import (
+    CONTENT_BIAS_BATCH_SYSTEM_MESSAGE, CONTENT_BIAS_SYSTEM_MESSAGE, GRICE_MAXIMS_SYSTEM_MESSAGE, NO_BIAS_LABEL,
+    RESPONSE_EVALUATION_SYSTEM_MESSAGE, SUMMARY_SYSTEM_MESSAGE, USER_TURN_SYSTEM_MESSAGE
+)
+from EchoMind.engines.mental_state import MENTAL_STATES
+
+VOCABULARY = (
+    "model data layer network training token attention gradient protein cell enzyme gene "
+    "sequence memory context example result method analysis signal pattern structure value "
+    "question answer concept detail process system function evidence research experiment"
+).split()
+
+_USER_TURN_PREFIX = USER_TURN_SYSTEM_MESSAGE.split("{fields}")[0]
+_FIELD_PATTERN = re.compile(r'^- "(\w+)":', re.MULTILINE)
+_NUMBERED_PATTERN = re.compile(r"^(\d+)\. ", re.MULTILINE)
+_MAXIMS = ("quantity", "quality", "relevance", "manner")
+
+# Shortest cacheable prompt and the granularity of cache hits, in tokens
+CACHE_MIN_TOKENS = 1024
+CACHE_INCREMENT = 128
+
+
+class FakeOpenAIBackend(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """httpx transport answering /chat/completions and /embeddings locally."""
+    def __init__(self, latency_ms: float = 300.0, latency_sigma: float = 0.4, embedding_latency_ms: float = 50.0,
+                 completion_tokens: float = 120.0, completion_sigma: float = 0.5, dimensions: int = 256,
+                 seed: int = 0, cached_prefixes: int = 100000):
+        """
+        Args:
+            latency_ms: Median latency of a chat completion.
+            latency_sigma: Spread (sigma of the underlying normal) of the latencies; 0 makes them constant.
+            embedding_latency_ms: Median latency of an embeddings request.
+            completion_tokens: Median length of a free-text completion, capped by the request's max_tokens.
+            completion_sigma: Spread of the completion lengths.
+            dimensions: Size of the embedding vectors.
+            seed: Seed of the latency and length draws.
+            cached_prefixes: Prompt prefixes the simulated prompt cache remembers.
+        """
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.embedding_latency_ms = embedding_latency_ms
+        self.completion_tokens = completion_tokens
+        self.completion_sigma = completion_sigma
+        self.dimensions = dimensions
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens_sent = 0
+        self.simulated_latency = 0.0
+        self.cached_prefixes = cached_prefixes
+        self._prefixes = OrderedDict()
+
+    def _draw(self, median: float, sigma: float) -> float:
+        with self._lock:
+            return median * math.exp(self._random.gauss(0.0, sigma)) if sigma else median
+
+    def _text(self, max_tokens: int) -> str:
+        length = max(1, min(max_tokens, int(self._draw(self.completion_tokens, self.completion_sigma))))
+        with self._lock:
+            return " ".join(self._random.choice(VOCABULARY) for _ in range(length))
+
+    def _embed(self, text) -> List[float]:
+        vector = [0.0] * self.dimensions
+        words = text.lower().split() if isinstance(text, str) else [str(token) for token in text]
+        for word in words:
+            digest = hashlib.md5(word.encode()).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimensions] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def _cached_tokens(self, body: Dict) -> int:
+        """Tokens of the request's prompt served from the simulated prompt cache; remembers its prefixes."""
+        text = "".join(f"{message.get('role')}\n{message.get('content', '')}\n" for message in body.get("messages", []))
+        digests = [hashlib.md5(f"{body.get('model')}\n{text[:4 * tokens]}".encode()).digest()
+                   for tokens in range(CACHE_MIN_TOKENS, len(text) // 4 + 1, CACHE_INCREMENT)]
+        cached = 0
+        with self._lock:
+            for number, digest in enumerate(digests):
+                if digest not in self._prefixes:
+                    break
+                cached = CACHE_MIN_TOKENS + number * CACHE_INCREMENT
+            for digest in digests:
+                self._prefixes[digest] = True
+                self._prefixes.move_to_end(digest)
+            while len(self._prefixes) > self.cached_prefixes:
+                self._prefixes.popitem(last=False)
+        return cached
+
+    def _completion_content(self, body: Dict) -> Tuple[str, str]:
+        """The stage of a chat request, recognised by its system message, and the content to answer."""
+        messages = body.get("messages", [])
+        system = messages[0]["content"] if messages else ""
+        user = messages[-1]["content"] if messages else ""
+        with self._lock:
+            state = self._random.choice(MENTAL_STATES)
+        if system.startswith(_USER_TURN_PREFIX):
+            fields = {"mental_state": state, "dialogue_bias": NO_BIAS_LABEL}
+            return "user_turn", json.dumps({name: fields.get(name, NO_BIAS_LABEL)
+                                            for name in _FIELD_PATTERN.findall(system)})
+        if system == CONTENT_BIAS_BATCH_SYSTEM_MESSAGE:
+            return "content_bias_batch", json.dumps({"labels": {number: NO_BIAS_LABEL
+                                                                for number in _NUMBERED_PATTERN.findall(user)}})
+        if system == CONTENT_BIAS_SYSTEM_MESSAGE:
+            return "content_bias", NO_BIAS_LABEL
+        if system in (GRICE_MAXIMS_SYSTEM_MESSAGE, RESPONSE_EVALUATION_SYSTEM_MESSAGE):
+            with self._lock:
+                scores = {maxim: {"score": self._random.randint(3, 5), "explanation": "Fake evaluation."}
+                          for maxim in _MAXIMS}
+            stage = "maxim_evaluation" if system == GRICE_MAXIMS_SYSTEM_MESSAGE else "response_evaluation"
+            return stage, json.dumps(scores)
+        if system == SUMMARY_SYSTEM_MESSAGE:
+            return "summary", self._text(body.get("max_tokens") or 250)
+        return "generation", self._text(body.get("max_tokens") or 500)
+
+    def _respond(self, request: httpx.Request) -> Tuple[httpx.Response, float]:
+        """Build the response and draw its latency, without waiting."""
+        body = json.loads(request.content or b"{}")
+        if request.url.path.endswith("/embeddings"):
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            if inputs and isinstance(inputs[0], int):
+                inputs = [inputs]  # A single tokenized input
+            with self._lock:
+                self.requests["embeddings"] += 1
+            vectors = [self._embed(text) for text in inputs]
+            if body.get("encoding_format") == "base64":
+                # The format the openai client asks for unless told otherwise
+                vectors = [base64.b64encode(array.array("f", vector).tobytes()).decode() for vector in vectors]
+            data = [{"object": "embedding", "index": i, "embedding": vector} for i, vector in enumerate(vectors)]
+            tokens = sum(len(text.split()) if isinstance(text, str) else len(text) for text in inputs)
+            payload = {"object": "list", "model": body.get("model"), "data": data,
+                       "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+            return httpx.Response(200, json=payload), self._draw(self.embedding_latency_ms, self.latency_sigma) / 1000
+
+        stage, content = self._completion_content(body)
+        # ~4 characters per token, so the fake does not spend time tokenizing
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in body.get("messages", [])) // 4
+        cached_tokens = min(prompt_tokens, self._cached_tokens(body))
+        completion_tokens = max(1, len(content) // 4)
+        latency = self._draw(self.latency_ms, self.latency_sigma) / 1000
+        with self._lock:
+            self.requests[stage] += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.completion_tokens_sent += completion_tokens
+            self.simulated_latency += latency
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens, "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        model = body.get("model")
+        if not body.get("stream"):
+            return httpx.Response(200, json={
+                "id": "fake", "object": "chat.completion", "created": 0, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            }), latency
+
+        events = []
+        for start in range(0, len(content), 16):
+            events.append({"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": model,
+                           "choices": [{"index": 0, "delta": {"content": content[start:start + 16]},
+                                        "finish_reason": None}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            events.append({"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": model,
+                           "choices": [], "usage": usage})
+        stream = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        return httpx.Response(200, content=stream.encode(), headers={"content-type": "text/event-stream"}), latency
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        response, latency = self._respond(request)
+        time.sleep(latency)
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        response, latency = self._respond(request)
+        await asyncio.sleep(latency)
+        return response
+
+    def stats(self) -> Dict:
+        """Requests per stage, tokens sent and the total simulated latency in seconds."""
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "completion_tokens": self.completion_tokens_sent,
+                "simulated_latency": self.simulated_latency,
+            }
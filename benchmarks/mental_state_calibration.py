@@ -0,0 +1,84 @@
+"""
+Calibrate the local mental-state classifier against the LLM labels stored in the user XMLs.
+
+For every confidence threshold the script reports which share of messages the local
+classifier would answer (coverage), how often it agrees with the LLM on those, the overall
+agreement when low-confidence messages still go to the LLM, and the latency saved.
+
+    python benchmarks/mental_state_calibration.py --users-dir generated_data/users --save
+"""
+import argparse
+import random
+import time
+from collections import Counter
+from EchoMind.engines.mental_state import (
+    DEFAULT_MODEL_PATH, LocalMentalStateClassifier, NaiveBayesMentalStateClassifier, load_labeled_turns
+)
+
+
+def cross_validated_predictions(examples, folds, min_examples):
+    """Predict every example with a classifier trained on the other folds."""
+    predictions = []
+    for fold in range(folds):
+        train = [example for i, example in enumerate(examples) if i % folds != fold]
+        test = [example for i, example in enumerate(examples) if i % folds == fold]
+        classifier = LocalMentalStateClassifier(NaiveBayesMentalStateClassifier().train(train),
+                                                min_examples=min_examples)
+        for text, label in test:
+            state, confidence = classifier.predict(text)
+            predictions.append((label, state, confidence))
+    return predictions
+
+
+def measure_latency(classifier, texts, repeats=3):
+    """Mean seconds per local prediction."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for text in texts:
+            classifier.predict(text)
+    return (time.perf_counter() - start) / (repeats * len(texts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users-dir", default="generated_data/users")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--thresholds", default="0.5,0.6,0.65,0.7,0.8,0.9")
+    parser.add_argument("--min-examples", type=int, default=50)
+    parser.add_argument("--llm-latency-ms", type=float, default=450.0,
+                        help="Average latency of a mental-state LLM call, e.g. from the engine's metrics")
+    parser.add_argument("--save", action="store_true", help=f"Train on all turns and save to {DEFAULT_MODEL_PATH}")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    examples = load_labeled_turns(args.users_dir)
+    if len(examples) < args.folds:
+        print(f"Only {len(examples)} labelled turns in {args.users_dir}; nothing to calibrate.")
+        return
+    random.Random(args.seed).shuffle(examples)
+    print(f"{len(examples)} LLM-labelled turns: {dict(Counter(label for _, label in examples))}")
+
+    predictions = cross_validated_predictions(examples, args.folds, args.min_examples)
+    classifier = LocalMentalStateClassifier.from_user_xml(args.users_dir, min_examples=args.min_examples)
+    local_ms = measure_latency(classifier, [text for text, _ in examples]) * 1000
+    backend = "naive Bayes" if classifier.model.examples >= args.min_examples else "lexicon"
+    print(f"Backend: {backend}, local latency: {local_ms:.3f} ms per message\n")
+
+    print(f"{'threshold':>9} {'coverage':>9} {'local agree':>12} {'overall agree':>14} {'saved ms/msg':>13}")
+    for threshold in (float(value) for value in args.thresholds.split(",")):
+        local = [(label, state) for label, state, confidence in predictions
+                 if state is not None and confidence >= threshold]
+        coverage = len(local) / len(predictions)
+        local_agreement = sum(label == state for label, state in local) / len(local) if local else 0.0
+        # Escalated messages keep the LLM label, so they agree by definition.
+        overall = (sum(label == state for label, state in local) + len(predictions) - len(local)) / len(predictions)
+        saved = coverage * (args.llm_latency_ms - local_ms)
+        print(f"{threshold:>9.2f} {coverage:>9.1%} {local_agreement:>12.1%} {overall:>14.1%} {saved:>13.1f}")
+
+    if args.save:
+        classifier.save(DEFAULT_MODEL_PATH)
+        print(f"\nSaved model trained on {classifier.model.examples} turns to {DEFAULT_MODEL_PATH}")
+
+
+if __name__ == "__main__":
+    main()
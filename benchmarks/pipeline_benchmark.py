@@ -0,0 +1,204 @@
+"""
+Benchmark the chat pipeline (LLMEngine + RAGSystem + XmlManager) without network access.
+
+Every OpenAI request goes to FakeOpenAIBackend (benchmarks/fake_openai.py) with the given
+latency and completion-length distributions, so the numbers reflect EchoMind's own overhead
+(prompt building, history handling, XML reads and writes, retrieval) on top of a known,
+reproducible API latency. The script simulates --users users with --turns standard turns
+each and reports throughput, turn latency percentiles, the share of generation prompt tokens
+served from the (simulated) prompt cache, the per-stage span timings of the engine's tracer
+and the storage I/O of the run.
+
+    python benchmarks/pipeline_benchmark.py --users 8 --turns 10 --latency-ms 300 --post-processing
+    python benchmarks/pipeline_benchmark.py --latency-ms 0 --latency-sigma 0 --json baseline.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from fake_openai import VOCABULARY, FakeOpenAIBackend
+
+from EchoMind.engines.llm import LLMEngine
+from EchoMind.engines.rag import RAGSystem, RateLimitedEmbeddings
+from EchoMind.managers.context_manager import ContextWindowManager
+from EchoMind.utils.client_factory import ClientFactory
+from EchoMind.utils.helpers import setup_openai_key
+from EchoMind.utils.rate_limiter import configure_rate_limiter_from_config
+from EchoMind.utils.work_queue import PostProcessingQueue
+
+DEFAULT_SCHEMA = Path(__file__).parent.parent / "examples" / "gradio_chat_with_RAG" / "user_schema_config.json"
+
+
+def read_io_counters() -> Optional[Dict[str, int]]:
+    """This process's I/O counters from /proc/self/io (Linux only), or None."""
+    try:
+        with open("/proc/self/io") as f:
+            return {key: int(value) for key, value in (line.split(": ") for line in f if ": " in line)}
+    except OSError:
+        return None
+
+
+def directory_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+def write_corpus(docs_path: Path, documents: int, rng: random.Random) -> None:
+    """Write documents of a few paragraphs of vocabulary words for the RAG index."""
+    docs_path.mkdir(parents=True, exist_ok=True)
+    for number in range(documents):
+        paragraphs = [" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(60, 160))) + "."
+                      for _ in range(rng.randint(3, 8))]
+        (docs_path / f"doc_{number:03d}.txt").write_text("\n\n".join(paragraphs))
+
+
+def user_message(rng: random.Random) -> str:
+    words = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(5, 25)))
+    return f"Can you explain how {words} works?"
+
+
+def run_user(engine: LLMEngine, user_id: str, turns: int, seed: int, stream: bool) -> List[float]:
+    """Play turns standard turns of one user, carrying the session history like the demos do."""
+    rng = random.Random(seed)
+    session_history, latencies = [], []
+    for _ in range(turns):
+        message = user_message(rng)
+        start = time.perf_counter()
+        if stream:
+            reply = "".join(engine.stream_llm_response(user_id, message, session_history=session_history))
+        else:
+            reply = engine.generate_llm_response(user_id, message, session_history=session_history)
+        latencies.append(time.perf_counter() - start)
+        session_history.append([message, reply])
+    return latencies
+
+
+def percentile(samples: List[float], q: float) -> float:
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=10, help="Turns per user")
+    parser.add_argument("--parallel-users", type=int, default=4, help="Users chatting at the same time")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Median chat completion latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="Log-normal spread of the latencies")
+    parser.add_argument("--embedding-latency-ms", type=float, default=50.0)
+    parser.add_argument("--completion-tokens", type=float, default=120.0, help="Median reply length")
+    parser.add_argument("--completion-sigma", type=float, default=0.5)
+    parser.add_argument("--documents", type=int, default=20, help="Documents in the RAG corpus")
+    parser.add_argument("--history-budget", type=int, default=0,
+                        help="Token budget of the prompt history; unbounded when 0")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Run the classifier calls of a turn one after another instead of fanning them out")
+    parser.add_argument("--post-processing", action="store_true", help="Defer the bookkeeping to a queue")
+    parser.add_argument("--stream", action="store_true", help="Stream the replies")
+    parser.add_argument("--prompt-layout", default="inline", choices=("inline", "cache_friendly"))
+    parser.add_argument("--schema", default=str(DEFAULT_SCHEMA), help="Profile schema of the simulated users")
+    parser.add_argument("--workdir", help="Directory for the XMLs and the index; a temporary one by default")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute limit; 0 disables it")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens per minute limit; 0 disables it")
+    args = parser.parse_args()
+
+    json_path = Path(args.json).resolve() if args.json else None
+    schema_path = Path(args.schema).resolve()
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="echomind-benchmark-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)  # XmlManager writes to generated_data/ under the working directory
+    rng = random.Random(args.seed)
+
+    backend = FakeOpenAIBackend(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                                embedding_latency_ms=args.embedding_latency_ms,
+                                completion_tokens=args.completion_tokens, completion_sigma=args.completion_sigma,
+                                seed=args.seed)
+    factory = ClientFactory(transport=backend)
+    Path("config.json").write_text(json.dumps({"openai_api_key": "sk-benchmark",
+                                               "requests_per_minute": args.rpm, "tokens_per_minute": args.tpm}))
+    setup_openai_key(Path("config.json"))  # The embeddings client reads it from the environment
+    configure_rate_limiter_from_config(Path("config.json"))
+    shutil.copy(schema_path, "schema.json")
+    schema = json.loads(schema_path.read_text())["schema"]
+    write_corpus(Path("docs"), args.documents, rng)
+
+    start = time.perf_counter()
+    rag = RAGSystem("docs", "faiss_index", client_factory=factory)
+    # Send the chunks as text; the default tokenizes them first, which needs tiktoken's download
+    rag.embeddings = RateLimitedEmbeddings(factory.embeddings(check_embedding_ctx_length=False))
+    rag.build_or_update_index()
+    index_seconds = time.perf_counter() - start
+
+    engine = LLMEngine(
+        Path("config.json"), rag_system=rag, schema_config_path="schema.json", concurrent=not args.sequential,
+        context_manager=ContextWindowManager(args.history_budget) if args.history_budget else None,
+        post_processing=PostProcessingQueue() if args.post_processing else None,
+        prompt_layout=args.prompt_layout, client_factory=factory,
+    )
+    users = [f"user_{number:03d}" for number in range(args.users)]
+    for user_id in users:
+        engine.xml_class.initialize_user_xml(user_id, {field: rng.choice(values) for field, values in schema.items()})
+
+    io_before = read_io_counters()
+    requests_before = sum(backend.stats()["requests"].values())
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.parallel_users) as pool:
+        runs = [pool.submit(run_user, engine, user_id, args.turns, args.seed + number, args.stream)
+                for number, user_id in enumerate(users)]
+        latencies = sorted(latency for run in runs for latency in run.result())
+    engine.close()  # Includes the deferred bookkeeping
+    elapsed = time.perf_counter() - start
+    io_after = read_io_counters()
+
+    backend_stats = backend.stats()
+    turns = len(latencies)
+    results = {
+        "users": args.users,
+        "turns": turns,
+        "index_seconds": index_seconds,
+        "elapsed_seconds": elapsed,
+        "turns_per_second": turns / elapsed,
+        "latency_ms": {name: 1000 * value for name, value in (
+            ("mean", sum(latencies) / turns), ("p50", percentile(latencies, 0.50)),
+            ("p95", percentile(latencies, 0.95)), ("p99", percentile(latencies, 0.99)), ("max", latencies[-1]),
+        )},
+        "api_requests_per_turn": (sum(backend_stats["requests"].values()) - requests_before) / turns,
+        "backend": backend_stats,
+        "stages": engine.tracer.histogram.dump(),
+        "prompt_cache": engine.prompt_cache_stats.stats(),
+        "storage_bytes": directory_size(Path("generated_data")),
+        "io": {key: io_after[key] - io_before[key] for key in io_after} if io_before and io_after else None,
+    }
+
+    print(f"{turns} turns of {args.users} users in {elapsed:.2f} s: {results['turns_per_second']:.2f} turns/s "
+          f"(index built in {index_seconds:.2f} s)")
+    print("Turn latency (ms): " + ", ".join(f"{name} {value:.1f}" for name, value in results["latency_ms"].items()))
+    print(f"API requests per turn: {results['api_requests_per_turn']:.2f} {dict(backend_stats['requests'])}")
+    generation = results["prompt_cache"].get("generation")
+    if generation:
+        print(f"Prompt cache (generation): {generation['cached_ratio']:.1%} of {generation['prompt_tokens']} "
+              f"prompt tokens cached")
+    print(f"\n{engine.tracer.histogram.report()}\n")
+    print(f"User XMLs on disk: {results['storage_bytes']} bytes")
+    if results["io"] is None:
+        print("Storage I/O: /proc/self/io is not available on this platform")
+    else:
+        io = results["io"]
+        print(f"Storage I/O: {io['rchar']} bytes read, {io['wchar']} bytes written by file calls; "
+              f"{io['read_bytes']} / {io['write_bytes']} bytes reached the block device")
+    if json_path:
+        json_path.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {json_path}")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
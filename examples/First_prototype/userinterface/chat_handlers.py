@@ -3,7 +3,10 @@ from EchoMind.managers.xml_manager import get_user_profile, reset_dynamic
 
 from EchoMind.engines.rag import RAGSystem
 from EchoMind.utils.helpers import setup_openai_key
+from EchoMind.utils.rate_limiter import configure_rate_limiter_from_config
+from EchoMind.utils.turns import TurnCancelled
 from pathlib import Path
+import gradio as gr
 
 # Initialize with demo-specific paths
 current_dir = Path(__file__).parent
@@ -12,6 +15,8 @@ index_path = current_dir.parent / "faiss_index"
 
 # Set up OpenAI key from demo config
 setup_openai_key(current_dir / "config.json")
+# Rate limits from config.json ("requests_per_minute", "tokens_per_minute") or the environment
+configure_rate_limiter_from_config(current_dir / "config.json")
 
 # Create RAG system
 rag = RAGSystem(
@@ -25,7 +30,11 @@ def handle_query(query):
 
 llm_class = LLMEngine(rag_system=rag)
 def update_chat_history(user_message, chat_history, username):
-    system_response = llm_class.generate_llm_response(username, user_message, session_history=chat_history, mode="standard")
+    try:
+        system_response = llm_class.generate_llm_response(username, user_message, session_history=chat_history, mode="standard")
+    except TurnCancelled:
+        # The user sent a new message before this reply was complete; that turn takes over
+        return gr.update(), gr.update(), gr.update(), gr.update()
     updated_history = chat_history + [[f"👤 {user_message}", f"🤖 {system_response}"]]
     profile = get_user_profile(username, mode="standard")
     session_history_text = ""
@@ -59,7 +68,11 @@ def new_chat_standard(username):
     return [], dashboard_text, []
 
 def update_chat_history_file(user_message, file_chat_history, username, file_context):
-    system_response = llm_class.generate_llm_response_file(username, user_message, file_context, session_history=file_chat_history, mode="file")
+    try:
+        system_response = llm_class.generate_llm_response_file(username, user_message, file_context, session_history=file_chat_history, mode="file")
+    except TurnCancelled:
+        # The user sent a new message before this reply was complete; that turn takes over
+        return gr.update(), gr.update(), gr.update(), gr.update()
     updated_history = file_chat_history + [[f"👤 {user_message}", f"🤖 {system_response}"]]
     profile = get_user_profile(username, mode="file")
     session_history_text = ""
@@ -13,7 +13,7 @@ def analyze_file_biases(uploaded_file):
         s = s.strip()
         if s:
             sentence = s if s.endswith('.') else s + '.'
-            bias = llm_class.predict_content_bias(sentence)
+            bias = llm_class.predict_content_bias(sentence).value_or("Neutral")
             if bias != "Neutral":
                 html_output += (
                     f'<p style="color: red; font-weight: bold;">'
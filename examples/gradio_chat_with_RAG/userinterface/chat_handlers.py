@@ -2,8 +2,12 @@ from EchoMind.engines.llm import LLMEngine
 from EchoMind.managers.xml_manager import XmlManager
 from EchoMind.engines.rag import RAGSystem
 from EchoMind.utils.helpers import setup_openai_key
+from EchoMind.utils.rate_limiter import configure_rate_limiter_from_config
+from EchoMind.utils.work_queue import PostProcessingQueue
+from EchoMind.utils.turns import TurnCancelled
 from pathlib import Path
 import json
+import gradio as gr
 from icecream import ic
 
 # Initialize with demo-specific paths
@@ -19,6 +23,8 @@ with open(user_schema_config_path) as f:
 
 # Set up OpenAI key from demo config
 setup_openai_key(current_dir / "config.json")
+# Rate limits from config.json ("requests_per_minute", "tokens_per_minute") or the environment
+configure_rate_limiter_from_config(current_dir / "config.json")
 
 # Create RAG system
 rag = RAGSystem(
@@ -32,7 +38,9 @@ xml_class = XmlManager(user_schema_config_path)
 def handle_query(query):
     return rag.retrieve_content(query)
 
-llm_class = LLMEngine(openai_config_path = current_dir / "config.json", rag_system=rag, schema_config_path=user_schema_config_path)
+# State updates run in the background once a reply has been streamed
+llm_class = LLMEngine(openai_config_path = current_dir / "config.json", rag_system=rag, schema_config_path=user_schema_config_path,
+                      post_processing=PostProcessingQueue())
 
 def _build_dashboard_text(profile):
     """Helper to build dynamic dashboard text based on schema"""
@@ -54,10 +62,21 @@ def _build_dashboard_text(profile):
     return "\n".join(profile_lines)
 
 def update_chat_history(user_message, chat_history, username):
-    system_response = llm_class.generate_llm_response(
-        username, user_message, session_history=chat_history, mode="standard"
-    )
-    updated_history = chat_history + [[f"👤 {user_message}", f"🤖 {system_response}"]]
+    # Stream the reply into the chatbot; the dashboard is refreshed once the turn is stored.
+    system_response = ""
+    try:
+        for delta in llm_class.stream_llm_response(
+            username, user_message, session_history=chat_history, mode="standard"
+        ):
+            system_response += delta
+            partial_history = chat_history + [[f"👤 {user_message}", f"🤖 {system_response}"]]
+            yield partial_history, "", chat_history, gr.update()
+    except TurnCancelled:
+        # The user sent a new message before this reply was complete; that turn takes over
+        return
+
+    updated_history = chat_history + [[f"👤 {user_message}", f"🤖 {system_response.strip()}"]]
+    llm_class.wait_for_pending(username, mode="standard")
     profile = xml_class.get_user_profile(username, mode="standard")
     
     session_history_text = ""
@@ -65,11 +84,12 @@ def update_chat_history(user_message, chat_history, username):
         session_history_text += f"{turn[0]}\n{turn[1]}\n\n"
     
     dashboard_text = _build_dashboard_text(profile) + "\n\nCurrent Session Chat History:\n" + session_history_text
-    return updated_history, "", updated_history, dashboard_text
+    yield updated_history, "", updated_history, dashboard_text
 
 def new_chat_standard(username):
     if not username:
         return [], "Error: No user logged in.", []
+    llm_class.wait_for_pending(username, mode="standard")
     xml_class.reset_dynamic(username, mode="standard")
     profile = xml_class.get_user_profile(username, mode="standard")
     dashboard_text = _build_dashboard_text(profile) + "\n\nCurrent Session Chat History:\n"
@@ -78,6 +98,7 @@ def new_chat_standard(username):
 def new_chat_file(username):
     if not username:
         return [], "Error: No user logged in.", []
+    llm_class.wait_for_pending(username, mode="file")
     xml_class.reset_dynamic(username, mode="file")
     profile = xml_class.get_user_profile(username, mode="file")
     dashboard_text = _build_dashboard_text(profile) + "\n\nCurrent Session Chat History:\n"
@@ -1,7 +1,9 @@
 from EchoMind.engines.llm import LLMEngine
+from EchoMind.engines.document_pipeline import DocumentPipeline
 from pathlib import Path
 import json
 from EchoMind.utils.helpers import setup_openai_key
+from EchoMind.utils.rate_limiter import configure_rate_limiter_from_config
 # Initialize with demo-specific paths
 current_dir = Path(__file__).parent
 user_schema_config_path = current_dir.parent / "user_schema_config.json"
@@ -13,30 +15,18 @@ with open(user_schema_config_path) as f:
 
 # Set up OpenAI key from demo config
 setup_openai_key(current_dir / "config.json")
+# Rate limits from config.json ("requests_per_minute", "tokens_per_minute") or the environment
+configure_rate_limiter_from_config(current_dir / "config.json")
 
 llm_class = LLMEngine(openai_config_path = current_dir / "config.json", schema_config_path=user_schema_config_path)
+pipeline = DocumentPipeline(llm_class, max_concurrency=4)
 
 def analyze_file_biases(uploaded_file):
     if uploaded_file is None:
-        return "No file uploaded.", ""
+        yield "No file uploaded.", ""
+        return
     with open(uploaded_file.name, "r") as f:
         content = f.read()
-    sentences = content.split('.')
-    html_output = "<div style='font-family: Arial, sans-serif; line-height:1.5;'>"
-    
-    for s in sentences:
-        s = s.strip()
-        if s:
-            sentence = s if s.endswith('.') else s + '.'
-            bias = llm_class.predict_content_bias(sentence)
-            if bias != "Neutral":
-                html_output += (
-                    f'<p style="color: red; font-weight: bold;">'
-                    f'{sentence} '
-                    f'<span style="color:black; background-color: yellow; padding: 2px 4px; border-radius: 3px;">[{bias}]</span>'
-                    f'</p>'
-                )
-            else:
-                html_output += f"<p>{sentence}</p>"
-    html_output += "</div>"
-    return html_output, content
+    # Show the document right away and highlight biases as the sections complete
+    for html_output in pipeline.stream_bias_html(content):
+        yield html_output, content
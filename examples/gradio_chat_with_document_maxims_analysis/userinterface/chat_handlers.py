@@ -2,8 +2,11 @@ from EchoMind.engines.llm import LLMEngine
 from EchoMind.managers.xml_manager import XmlManager
 # from EchoMind.engines.rag import RAGSystem
 from EchoMind.utils.helpers import setup_openai_key
+from EchoMind.utils.rate_limiter import configure_rate_limiter_from_config
+from EchoMind.utils.turns import TurnCancelled
 from pathlib import Path
 import json
+import gradio as gr
 from icecream import ic
 
 # Initialize with demo-specific paths
@@ -17,6 +20,8 @@ with open(user_schema_config_path) as f:
 
 # Set up OpenAI key from demo config
 setup_openai_key(current_dir / "config.json")
+# Rate limits from config.json ("requests_per_minute", "tokens_per_minute") or the environment
+configure_rate_limiter_from_config(current_dir / "config.json")
 
 # # Create RAG system
 # rag = RAGSystem(
@@ -52,7 +57,11 @@ def _build_dashboard_text(profile):
     return "\n".join(profile_lines)
 
 def update_chat_history_content_maxim_evaluation(user_message, file_chat_history, username, file_context, file_analysis):
-    system_response, _ = llm_class.generate_llm_response_with_maxim_evaluation(username, user_message, file_context, file_analysis, session_history=file_chat_history, mode="file_maxim_evaluation")
+    try:
+        system_response, _ = llm_class.generate_llm_response_with_maxim_evaluation(username, user_message, file_context, file_analysis, session_history=file_chat_history, mode="file_maxim_evaluation")
+    except TurnCancelled:
+        # The user sent a new message before this reply was complete; that turn takes over
+        return gr.update(), gr.update(), gr.update(), gr.update()
     
     updated_history = file_chat_history + [[f"👤 {user_message}", f"🤖 {system_response}"]]
     profile = xml_class.get_user_profile_content_maxim_evaluation(username, mode="file_maxim_evaluation")
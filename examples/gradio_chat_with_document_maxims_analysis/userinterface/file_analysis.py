@@ -1,7 +1,10 @@
 from EchoMind.engines.llm import LLMEngine
+from EchoMind.engines.document_pipeline import DocumentPipeline
 from pathlib import Path
+import html
 import json
 from EchoMind.utils.helpers import setup_openai_key
+from EchoMind.utils.rate_limiter import configure_rate_limiter_from_config
 
 # Initialize with demo-specific paths
 current_dir = Path(__file__).parent
@@ -14,8 +17,12 @@ with open(user_schema_config_path) as f:
 
 # Set up OpenAI key from demo config
 setup_openai_key(current_dir / "config.json")
+# Rate limits from config.json ("requests_per_minute", "tokens_per_minute") or the environment
+configure_rate_limiter_from_config(current_dir / "config.json")
 
 llm_class = LLMEngine(openai_config_path=current_dir / "config.json", schema_config_path=user_schema_config_path)
+# Large files are scored section by section; re-uploading an edited file only re-scores the changed sections
+pipeline = DocumentPipeline(llm_class, max_concurrency=4)
 
 def analyze_file_maxims(username, uploaded_file, domain_context="general", mode="file_maxim_evaluation"):
     if uploaded_file is None:
@@ -24,17 +31,19 @@ def analyze_file_maxims(username, uploaded_file, domain_context="general", mode=
     with open(uploaded_file.name, "r") as f:
         content = f.read()
     
-    # Analyze the entire content for Grice's maxims
-    evaluation = llm_class.analyze_grice_maxims(username, content, domain_context=domain_context, mode=mode)
+    # Analyze the content for Grice's maxims, section by section
+    analysis = pipeline.analyze_maxims(username, content, domain_context=domain_context, mode=mode)
 
     # Format evaluation as plain text
     evaluation_text = ""
-    for maxim, details in evaluation.items():
+    for maxim, details in analysis["maxims"].items():
         evaluation_text += (
             f"{maxim.capitalize()}:\n"
-            f"  Score: {details['score']}\n"
+            f"  Score: {details['score']} (lowest section: {details['min_score']})\n"
             f"  Explanation: {details['explanation']}\n\n"
         )
+    if analysis["failed_sections"]:
+        evaluation_text += f"Sections that could not be evaluated: {len(analysis['failed_sections'])}\n\n"
         
     # Build HTML output: show file content followed by the evaluation
     html_output = "<div style='font-family: Arial, sans-serif; line-height:1.5;'>"
@@ -43,6 +52,10 @@ def analyze_file_maxims(username, uploaded_file, domain_context="general", mode=
     html_output += "<h2>Grice Maxims Evaluation</h2>"
     # html_output += f"<pre>{json.dumps(evaluation, indent=2)}</pre>"
     html_output += f"<p>{evaluation_text}</p>"
+    worst = analysis["worst_section"]
+    if worst is not None and len(analysis["sections"]) > 1:
+        html_output += f"<h3>Weakest Section ({worst['index'] + 1} of {len(analysis['sections'])}, mean score {worst['score']})</h3>"
+        html_output += f"<blockquote>{html.escape(worst['text'])}</blockquote>"
     html_output += "</div>"
     
     return html_output, content
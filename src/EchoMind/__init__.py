@@ -1,11 +1,45 @@
 from .engines.llm import LLMEngine
+from .engines.async_llm import AsyncLLMEngine
 from .engines.rag import RAGSystem
+from .engines.mental_state import LocalMentalStateClassifier
+from .engines.model_registry import ModelRegistry, RoutingRule
 from .managers.profile_manager import ProfileManager
 from .managers.xml_manager import XmlManager
+from .managers.cache_manager import ResultCache
+from .managers.context_manager import ContextWindowManager
+from .managers.semantic_cache import SemanticResponseCache
+from .managers.usage_manager import UsageLedger
+from .utils.resilience import PredictionResult, ResilientCaller, RetryPolicy
+from .utils.work_queue import PostProcessingQueue, AsyncPostProcessingQueue
+from .utils.client_factory import ClientFactory
+from .utils.cassette import CassetteMiss, CassetteTransport
+from .utils.tracing import HistogramRecorder, SpanHook, Tracer
+from .utils.turns import TurnCancelled, TurnRegistry
 
 __all__ = [
     "LLMEngine",
+    "AsyncLLMEngine",
     "RAGSystem",
+    "LocalMentalStateClassifier",
+    "ModelRegistry",
+    "RoutingRule",
     "ProfileManager",
-    "XmlManager"
+    "XmlManager",
+    "ResultCache",
+    "ContextWindowManager",
+    "SemanticResponseCache",
+    "UsageLedger",
+    "PredictionResult",
+    "ResilientCaller",
+    "RetryPolicy",
+    "PostProcessingQueue",
+    "AsyncPostProcessingQueue",
+    "ClientFactory",
+    "Tracer",
+    "SpanHook",
+    "HistogramRecorder",
+    "CassetteMiss",
+    "CassetteTransport",
+    "TurnCancelled",
+    "TurnRegistry"
 ]
\ No newline at end of file
@@ -0,0 +1,497 @@
+import asyncio
+import json
+import time
+from EchoMind.engines.llm import BaseLLMEngine, USER_TURN_SIGNALS
+from EchoMind.engines.rag import RAGSystem
+from EchoMind.engines.mental_state import LocalMentalStateClassifier
+from EchoMind.engines.model_registry import ModelRegistry
+from EchoMind.managers.cache_manager import ResultCache
+from EchoMind.managers.context_manager import ContextWindow, ContextWindowManager
+from EchoMind.managers.semantic_cache import SemanticQuery, SemanticResponseCache
+from EchoMind.managers.usage_manager import UsageLedger
+from EchoMind.utils.rate_limiter import TokenBucketRateLimiter, estimate_request_tokens
+from EchoMind.utils.resilience import PredictionResult, ResilientCaller
+from EchoMind.utils.work_queue import AsyncPostProcessingQueue
+from EchoMind.utils.client_factory import ClientFactory
+from EchoMind.utils.tracing import Tracer
+from EchoMind.utils.turns import TurnCancelled, TurnHandle, check_cancelled, current_handle
+from EchoMind.utils.helpers import setup_openai_key
+from typing import AsyncIterator, Callable, List, Dict, Tuple, Optional
+
+
+class AsyncLLMEngine(BaseLLMEngine):
+    """
+    Asyncio counterpart of LLMEngine built on AsyncOpenAI.
+    Every generate/predict/analyze method is a coroutine, so a single event loop can
+    serve many conversations without holding a thread per user.
+    """
+    def __init__(self, openai_config_path: str = None, rag_system: Optional[RAGSystem] = None, schema_config_path: Optional[str] = None,
+                 result_cache: Optional[ResultCache] = None, context_manager: Optional[ContextWindowManager] = None,
+                 rate_limiter: Optional[TokenBucketRateLimiter] = None, resilience: Optional[ResilientCaller] = None,
+                 post_processing: Optional[AsyncPostProcessingQueue] = None,
+                 mental_state_classifier: Optional[LocalMentalStateClassifier] = None, prompt_layout: str = "inline",
+                 semantic_cache: Optional[SemanticResponseCache] = None, client_factory: Optional[ClientFactory] = None,
+                 tracer: Optional[Tracer] = None, usage_ledger: Optional[UsageLedger] = None,
+                 model_registry: Optional[ModelRegistry] = None, cancel_stale_turns: bool = True):
+        """
+        See LLMEngine for the arguments. With cancel_stale_turns, cancelling a turn also aborts
+        its API requests in flight.
+        """
+        super().__init__(rag_system=rag_system, schema_config_path=schema_config_path, result_cache=result_cache,
+                         context_manager=context_manager, rate_limiter=rate_limiter, resilience=resilience,
+                         mental_state_classifier=mental_state_classifier, prompt_layout=prompt_layout,
+                         semantic_cache=semantic_cache, client_factory=client_factory, tracer=tracer,
+                         usage_ledger=usage_ledger, model_registry=model_registry,
+                         cancel_stale_turns=cancel_stale_turns)
+        api_key = setup_openai_key(openai_config_path)
+        self.client = self.client_factory.async_openai_client(api_key)
+        self.post_processing = post_processing
+
+    async def _send_completion(self, request: Dict, stage: str, hedge: bool = False, escalated: bool = False,
+                               **kwargs):
+        """Async variant of LLMEngine._send_completion. Returns (response, attempts, hedged)."""
+        turn = current_handle()
+        with self.models.routed(stage, request, escalated) as route:
+            request = {**request, "model": route.model}
+
+            async def send(timeout):
+                check_cancelled(turn)
+                estimate = estimate_request_tokens(request)
+                await self.rate_limiter.acquire_async(estimate)
+                check_cancelled(turn)
+                response = await self.client.chat.completions.create(**request, timeout=timeout, **kwargs)
+                if not kwargs.get("stream"):
+                    self._settle_usage(estimate, getattr(response, "usage", None))
+                return response
+
+            if kwargs.get("stream"):
+                return await self.resilience.acall(send, stage, hedge)
+            started = time.monotonic()
+            with self.tracer.span(f"api.{stage}", model=route.model, route=route.reason) as span:
+                # A task of its own, so cancelling the turn aborts the request in flight
+                response, attempts, hedged = await self._create_task(self.resilience.acall(send, stage, hedge))
+                usage = getattr(response, "usage", None)
+                span.set(attempts=attempts, hedged=hedged).add_usage(usage)
+        self._record_usage(stage, route.model, usage, time.monotonic() - started)
+        return response, attempts, hedged
+
+    @staticmethod
+    def _create_task(coro) -> asyncio.Task:
+        """Run coro as a task that is cancelled together with the turn being processed."""
+        task = asyncio.ensure_future(coro)
+        turn = current_handle()
+        return turn.track(task) if turn is not None else task
+
+    async def _create_completion(self, request: Dict, stage: str, **kwargs):
+        """Send a chat completion request, retrying transient failures. Raises the last error."""
+        return (await self._send_completion(request, stage, **kwargs))[0]
+
+    async def _defer(self, user_id: str, mode: str, fn, *args) -> asyncio.Future:
+        """Async variant of LLMEngine._defer; fn is a coroutine function."""
+        if self.post_processing is not None:
+            return self.post_processing.submit((user_id, mode), fn, *args)
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(await fn(*args))
+        return future
+
+    async def wait_for_pending(self, user_id: str, mode: str) -> None:
+        """Wait until the queued bookkeeping of a user's conversation is done."""
+        if self.post_processing is not None:
+            await self.post_processing.wait_idle((user_id, mode))
+
+    async def close(self) -> None:
+        """
+        Finish the queued bookkeeping. The HTTP connections belong to the client factory's
+        shared pool; close them with client_factory.aclose().
+        """
+        if self.post_processing is not None:
+            await self.post_processing.flush()
+
+    async def summarize_dialogue(self, previous_summary: str, turns: List[Dict[str, str]]) -> str:
+        """
+        Fold turns into previous_summary and return the updated rolling summary.
+        """
+        response = await self._create_completion(self._summary_request(previous_summary, turns), "summary")
+        return response.choices[0].message.content.strip()
+
+    async def _fold_history(self, user_id: str, window: ContextWindow, mode: str) -> None:
+        """Async variant of LLMEngine._fold_history."""
+        try:
+            summary = await self.summarize_dialogue(window.summary, window.to_fold)
+        except Exception as e:
+            print(f"Error summarizing dialogue: {e}")
+            return
+        # XML writes run on a worker thread, off the event loop
+        await asyncio.to_thread(self._store_summary, user_id, window, summary, mode)
+
+    async def _build_combined_history(self, user_id: str, session_history, mode: str) -> Tuple[str, str]:
+        with self.tracer.span("history"):
+            window = await asyncio.to_thread(self._plan_history, user_id, session_history, mode)
+            history = window.render()
+            if window.to_fold:
+                await self._defer(user_id, mode, self._fold_history, user_id, window, mode)
+            return history, window.session_text
+
+    async def _classify(self, stage: str, request: Dict, is_clear: Optional[Callable[[str], bool]] = None) -> PredictionResult:
+        """Async variant of LLMEngine._classify. The result cache is read and written on a worker thread."""
+        key, cached = await asyncio.to_thread(self._cache_lookup, stage, request)
+        if cached is not None:
+            return PredictionResult(value=cached, cached=True)
+        try:
+            response, attempts, hedged = await self._send_completion(request, stage, hedge=True)
+            result = response.choices[0].message.content.strip()
+            escalation = None if is_clear is None or is_clear(result) else self.models.escalation(stage, request)
+            if escalation is not None:
+                response, retries, hedged = await self._send_completion({**request, "model": escalation}, stage,
+                                                                        hedge=True, escalated=True)
+                result = response.choices[0].message.content.strip()
+                attempts += retries
+        except Exception as e:
+            return PredictionResult(error=f"{stage} failed: {e}")
+        await asyncio.to_thread(self._cache_store, key, result)
+        return PredictionResult(value=result, attempts=attempts, hedged=hedged)
+
+    async def analyze_user_turn(self, user_input: str, signals: Optional[List[str]] = None) -> Dict[str, PredictionResult]:
+        """
+        Async variant of LLMEngine.analyze_user_turn: all per-turn signals from one JSON-mode call.
+        """
+        results, signals = self._local_user_turn_signals(user_input, list(signals or USER_TURN_SIGNALS))
+        if signals:
+            response = await self._classify("user_turn", self._user_turn_request(user_input, signals),
+                                            lambda content: self._user_turn_is_clear(content, signals))
+            results.update(self._parse_user_turn(response, signals))
+        return results
+
+    async def predict_mental_state(self, user_input: str) -> PredictionResult:
+        """
+        Function to predict the user's mental state, locally when possible, otherwise using OpenAI's model.
+        """
+        return (await self.analyze_user_turn(user_input, ["mental_state"]))["mental_state"]
+
+    async def predict_content_bias(self, text: str) -> PredictionResult:
+        """
+        Function to predict bias in the retrieved content using OpenAI's model.
+        """
+        return await self._classify("content_bias", self._content_bias_request(text), self._is_bias_label)
+
+    async def _classify_bias_batch(self, batch: Dict[int, str]) -> Tuple[Dict[int, str], Optional[str]]:
+        try:
+            response = await self._create_completion(self._content_bias_batch_request(batch), "content_bias_batch")
+        except Exception as e:
+            print(f"Error predicting content bias batch: {e}")
+            return {}, f"content_bias_batch failed: {e}"
+        return self._parse_bias_batch(response.choices[0].message.content, batch), None
+
+    async def predict_content_bias_batch(self, sentences: List[str], max_request_tokens: int = 2000,
+                                         max_batch_size: int = 40, max_retries: int = 2) -> List[PredictionResult]:
+        """
+        Async variant of LLMEngine.predict_content_bias_batch; the batches of a round run
+        concurrently. The cached labels are read and stored on a worker thread.
+        """
+        labels, pending = await asyncio.to_thread(self._start_bias_batch, sentences)
+        for attempt in range(1, max_retries + 2):
+            if not pending:
+                break
+            batches = self._pack_bias_batches(sentences, pending, max_request_tokens, max_batch_size)
+            results = await asyncio.gather(*(self._classify_bias_batch(batch) for batch in batches))
+            unlabelled = await asyncio.gather(*(
+                asyncio.to_thread(self._apply_bias_batch, labels, batch, parsed, error, attempt)
+                for batch, (parsed, error) in zip(batches, results)
+            ))
+            pending = [index for indices in unlabelled for index in indices]
+
+        for index in pending:
+            labels[index] = await self.predict_content_bias(sentences[index])
+        return labels
+
+    async def predict_chunk_content_bias(self, chunks: List[Tuple[str, str]]) -> PredictionResult:
+        """Async variant of LLMEngine.predict_chunk_content_bias."""
+        labels, missing = self._known_chunk_biases(chunks)
+        results = await self.predict_content_bias_batch([text for _, text in missing]) if missing else []
+        labels.update(await asyncio.to_thread(self._store_chunk_biases, missing, results))
+        return self._merge_chunk_biases(chunks, labels, results)
+
+    async def annotate_chunk_biases(self) -> int:
+        """Async variant of LLMEngine.annotate_chunk_biases."""
+        if self.rag is None:
+            raise ValueError("annotate_chunk_biases requires a RAG system")
+        _, missing = self._known_chunk_biases(self.rag.all_chunks())
+        results = await self.predict_content_bias_batch([text for _, text in missing]) if missing else []
+        return len(await asyncio.to_thread(self._store_chunk_biases, missing, results))
+
+    async def predict_dialogue_bias(self, text: str) -> PredictionResult:
+        """
+        Function to predict bias in the user dialogue using OpenAI's model.
+        """
+        return (await self.analyze_user_turn(text, ["dialogue_bias"]))["dialogue_bias"]
+
+    async def _retrieve_chunks(self, query: str) -> List[Tuple[str, str]]:
+        with self.tracer.span("retrieval"):
+            return await self.rag.aretrieve_chunks(query) if self.rag else []
+
+    async def _semantic_lookup(self, embedding_task: Optional[asyncio.Task], scope: Tuple) -> Optional[SemanticQuery]:
+        """Async variant of LLMEngine._semantic_lookup."""
+        if embedding_task is None:
+            return None
+        with self.tracer.span("semantic_cache") as span:
+            try:
+                embedding = await embedding_task
+            except Exception as e:
+                print(f"Error embedding query for the semantic cache: {e}")
+                return None
+            semantic = self.semantic_cache.lookup(embedding, scope)
+            span.set(hit=semantic.reply is not None)
+            return semantic
+
+    async def _prepare_standard_turn(self, user_id, user_input, session_history, mode) -> Tuple[Optional[Dict], Dict[str, PredictionResult], Optional[SemanticQuery]]:
+        await self.wait_for_pending(user_id, mode)
+        user_turn_task = self._create_task(self.analyze_user_turn(user_input))
+        embedding_task = None
+        if self._use_semantic_cache(user_input):
+            embedding_task = self._create_task(self._query_embeddings().aembed_query(user_input))
+
+        combined_history, session_text = await self._build_combined_history(user_id, session_history, mode)
+        profile = await asyncio.to_thread(self._xml_read, "get_user_profile", user_id, mode)
+
+        chunks = await self._retrieve_chunks(session_text)
+        retrieved_content = RAGSystem.join_chunks(chunks)
+        semantic = await self._semantic_lookup(embedding_task, self._semantic_scope(user_id, mode, profile, chunks))
+        if semantic is not None and semantic.reply is not None:
+            return None, await user_turn_task, semantic
+
+        content_bias_prediction = await self.predict_chunk_content_bias(chunks)
+        user_turn = await user_turn_task
+
+        if content_bias_prediction.ok:
+            await self._defer(user_id, mode, self._store_content_bias, user_id, content_bias_prediction.value, mode)
+
+        system_prompt = self._remember_prompt(user_id, mode, self.prompts.standard(
+            retrieved_content, combined_history, content_bias_prediction.value_or(),
+            user_turn["dialogue_bias"].value_or(), profile
+        ))
+        return self._generation_request(system_prompt, user_input), user_turn, semantic
+
+    async def _prepare_file_turn(self, user_id, user_input, file_analysis, session_history, mode) -> Tuple[Dict, Dict[str, PredictionResult]]:
+        await self.wait_for_pending(user_id, mode)
+        user_turn_task = self._create_task(self.analyze_user_turn(user_input))
+        combined_history, _ = await self._build_combined_history(user_id, session_history, mode)
+
+        profile = await asyncio.to_thread(self._xml_read, "get_user_profile", user_id, mode)
+        user_turn = await user_turn_task
+
+        system_prompt = self._remember_prompt(user_id, mode, self.prompts.file(
+            file_analysis, combined_history, user_turn["dialogue_bias"].value_or(), profile
+        ))
+        return self._generation_request(system_prompt, user_input), user_turn
+
+    async def _stream_reply(self, user_id, user_input, request, user_turn, mode,
+                            semantic: Optional[SemanticQuery] = None,
+                            turn: Optional[TurnHandle] = None) -> AsyncIterator[str]:
+        if request is None:
+            # Answered from the semantic cache
+            yield semantic.reply
+            self._commit_turn(turn)
+            await self._defer(user_id, mode, self._finish_turn, user_id, user_input, semantic.reply, user_turn, mode)
+            return
+        started = time.monotonic()
+        model = self.models.route("generation", request).model
+        span = self.tracer.start_span("api.generation", user_id=user_id, mode=mode, model=model, stream=True)
+        parts = []
+        stream = None
+        try:
+            check_cancelled(turn)
+            stream = await self._create_completion(request, "generation", stream=True, stream_options={"include_usage": True})
+            async for chunk in stream:
+                # Closing the stream below aborts the generation of a cancelled turn
+                check_cancelled(turn)
+                if getattr(chunk, "usage", None) is not None:
+                    span.add_usage(chunk.usage)
+                    self._settle_usage(estimate_request_tokens(request), chunk.usage)
+                    self._record_usage("generation", model, chunk.usage, time.monotonic() - started,
+                                       user_id, mode)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            if stream is not None:
+                await stream.close()
+            span.end()
+        reply = "".join(parts).strip()
+        self._cache_reply(semantic, reply)
+
+        self._commit_turn(turn)
+        await self._defer(user_id, mode, self._finish_turn, user_id, user_input, reply, user_turn, mode)
+
+    async def _store_content_bias(self, user_id, content_bias, mode) -> None:
+        await asyncio.to_thread(self._xml_write, "update_predicted_content_bias", user_id, content_bias, mode)
+
+    async def _finish_turn(self, user_id, user_input, reply, user_turn, mode) -> None:
+        await asyncio.to_thread(self._record_turn, user_id, user_input, reply, user_turn["mental_state"],
+                                user_turn["dialogue_bias"], mode)
+
+    async def generate_llm_response(self, user_id, user_input, session_history=None, mode="standard"):
+        with self.tracer.turn("standard", user_id, mode), self.turns.turn(user_id, mode) as turn:
+            request, user_turn, semantic = await self._prepare_standard_turn(
+                user_id, user_input, session_history, mode
+            )
+            if request is None:
+                reply = semantic.reply
+            else:
+                response = await self._create_completion(request, "generation")
+                reply = response.choices[0].message.content.strip()
+                self._cache_reply(semantic, reply)
+
+            self._commit_turn(turn)
+            await self._defer(user_id, mode, self._finish_turn, user_id, user_input, reply, user_turn, mode)
+            return reply
+
+    async def stream_llm_response(self, user_id, user_input, session_history=None, mode="standard") -> AsyncIterator[str]:
+        """
+        Async iterator variant of generate_llm_response, yielding reply deltas as they arrive.
+        State is written once the stream has been fully consumed.
+        """
+        turn = self.tracer.start_turn("standard", user_id, mode)
+        handle = self.turns.start(user_id, mode)
+        try:
+            with self.tracer.scope(turn), handle.scope():
+                request, user_turn, semantic = await self._prepare_standard_turn(
+                    user_id, user_input, session_history, mode
+                )
+            async for delta in self._stream_reply(user_id, user_input, request, user_turn, mode, semantic, handle):
+                yield delta
+        finally:
+            self.turns.finish(handle)
+            turn.end()
+
+    async def generate_llm_response_file(self, user_id, user_input, file_analysis, session_history=None, mode="file"):
+        with self.tracer.turn("file", user_id, mode), self.turns.turn(user_id, mode) as turn:
+            request, user_turn = await self._prepare_file_turn(
+                user_id, user_input, file_analysis, session_history, mode
+            )
+            response = await self._create_completion(request, "generation")
+            reply = response.choices[0].message.content.strip()
+
+            self._commit_turn(turn)
+            await self._defer(user_id, mode, self._finish_turn, user_id, user_input, reply, user_turn, mode)
+            return reply
+
+    async def stream_llm_response_file(self, user_id, user_input, file_analysis, session_history=None, mode="file") -> AsyncIterator[str]:
+        """
+        Async iterator variant of generate_llm_response_file. See stream_llm_response.
+        """
+        turn = self.tracer.start_turn("file", user_id, mode)
+        handle = self.turns.start(user_id, mode)
+        try:
+            with self.tracer.scope(turn), handle.scope():
+                request, user_turn = await self._prepare_file_turn(
+                    user_id, user_input, file_analysis, session_history, mode
+                )
+            async for delta in self._stream_reply(user_id, user_input, request, user_turn, mode, turn=handle):
+                yield delta
+        finally:
+            self.turns.finish(handle)
+            turn.end()
+
+    async def analyze_grice_maxims(self,
+        user_id: str,
+        text: str,
+        domain_context: str = "general",
+        guidelines: Optional[Dict[str, str]] = None,
+        mode: str = "file_maxim_evaluation",
+    ) -> Dict:
+        """
+        Async variant of LLMEngine.analyze_grice_maxims.
+
+        Raises:
+            ValueError: If text is empty.
+        """
+        analysis = await self.evaluate_grice_maxims(text, domain_context, guidelines)
+        if "error" not in analysis:
+            await asyncio.to_thread(self.store_maxim_evaluation, user_id, analysis, mode)
+        return analysis
+
+    async def evaluate_grice_maxims(self, text: str, domain_context: str = "general",
+                                    guidelines: Optional[Dict[str, str]] = None) -> Dict:
+        """
+        Async variant of LLMEngine.evaluate_grice_maxims.
+        """
+        request = self._grice_maxims_request(text, domain_context, guidelines)
+
+        try:
+            response = await self._create_completion(request, "maxim_evaluation")
+            return json.loads(response.choices[0].message.content)
+        except Exception as e:
+            return {"error": f"API request failed: {str(e)}"}
+
+    async def analyze_grice_maxims_in_response(self,
+        conversation_history: List[Tuple[str, str]],
+        latest_response: str,
+        domain_context: str = "general",
+        guidelines: Optional[Dict[str, str]] = None
+    ) -> Dict:
+        """
+        Async variant of LLMEngine.analyze_grice_maxims_in_response.
+        """
+        request = self._response_evaluation_request(conversation_history, latest_response, domain_context, guidelines)
+
+        try:
+            response = await self._create_completion(request, "response_evaluation")
+            return json.loads(response.choices[0].message.content)
+        except Exception as e:
+            return {"error": f"Evaluation failed: {str(e)}"}
+
+    async def generate_llm_response_with_maxim_evaluation(self,
+        user_id: str,
+        user_input: str,
+        file_context: Optional[str] = None,
+        file_analysis: Optional[str] = None,
+        session_history: Optional[List[Tuple[str, str]]] = None,
+        domain_context: str = "general",
+        mode: str = "file_maxim_evaluation",
+    ) -> Dict[str, str]:
+        """
+        Async variant of LLMEngine.generate_llm_response_with_maxim_evaluation. With a
+        post-processing queue the evaluation is a Task that resolves to the evaluation dict.
+        """
+        with self.tracer.turn("maxim", user_id, mode), self.turns.turn(user_id, mode) as turn:
+            await self.wait_for_pending(user_id, mode)
+            mental_state_task = self._create_task(self.predict_mental_state(user_input))
+            combined_history, _ = await self._build_combined_history(user_id, session_history, mode)
+            system_message = self._build_maxim_system_message(file_context, file_analysis, domain_context)
+
+            try:
+                response = await self._create_completion(self._generation_request(system_message, user_input, temperature=0.0), "generation")
+                llm_response = response.choices[0].message.content.strip()
+
+                self._commit_turn(turn)
+                evaluation = await self._defer(user_id, mode, self._finish_maxim_turn, user_id, user_input, llm_response,
+                                               mental_state_task, combined_history, domain_context, mode)
+                maxim_evaluation = evaluation if self.post_processing is not None else evaluation.result()
+                return llm_response, {
+                    "response": llm_response,
+                    "evaluation": maxim_evaluation,
+                    "history": combined_history
+                }
+
+            except Exception as e:
+                mental_state_task.cancel()
+                return {"error": f"Response generation failed: {str(e)}"}
+
+    async def _finish_maxim_turn(self, user_id, user_input, llm_response, mental_state_task, combined_history,
+                                 domain_context, mode) -> Dict:
+        new_state = await mental_state_task
+        if new_state.ok:
+            await asyncio.to_thread(self._xml_write, "update_dynamic_mental_state", user_id, new_state.value, mode)
+        await asyncio.to_thread(self._append_dialogue, user_id, user_input, llm_response, new_state, mode)
+        maxim_evaluation = await self.analyze_grice_maxims_in_response(
+            conversation_history=combined_history,
+            latest_response=llm_response,
+            domain_context=domain_context,
+        )
+
+        await asyncio.to_thread(self._xml_write, "update_predicted_LLM_dialogue_maxim_evaluations", user_id,
+                                maxim_evaluation, mode)
+        return maxim_evaluation
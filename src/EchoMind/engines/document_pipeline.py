@@ -0,0 +1,302 @@
+import contextvars
+import hashlib
+import html
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional, Iterator, Tuple
+from EchoMind.engines.llm import LLMEngine, NO_BIAS_LABEL
+from EchoMind.managers.cache_manager import ResultCache
+from EchoMind.utils.helpers import count_tokens
+from EchoMind.utils.resilience import PredictionResult
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text on '.' into non-empty sentences, each ending with a period."""
+    sentences = []
+    for sentence in text.split('.'):
+        sentence = sentence.strip()
+        if sentence:
+            sentences.append(sentence if sentence.endswith('.') else sentence + '.')
+    return sentences
+
+
+_HEADING_PATTERN = re.compile(r"^#{1,6}\s")
+
+
+def _is_cut_point(piece: str) -> bool:
+    """About one paragraph in four ends a section, chosen by its content alone."""
+    return int(hashlib.sha1(piece.encode()).hexdigest()[:8], 16) % 4 == 0
+
+
+def split_sections(text: str, max_tokens: int = 1500) -> List[str]:
+    """
+    Split text into sections on blank lines, merging short paragraphs and breaking
+    paragraphs longer than max_tokens on sentence boundaries. Markdown headings start a new
+    section.
+
+    Once a section holds a quarter of max_tokens it also ends after any paragraph that is a
+    content-defined cut point. Boundaries therefore depend on the nearby text only, and an
+    edit leaves the sections away from it unchanged, so their cached evaluations are reused.
+    """
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+        else:
+            pieces.extend(split_sentences(paragraph))
+
+    sections, current, used = [], [], 0
+    for piece in pieces:
+        cost = count_tokens(piece)
+        if current and (used + cost > max_tokens or _HEADING_PATTERN.match(piece)):
+            sections.append("\n\n".join(current))
+            current, used = [], 0
+        current.append(piece)
+        used += cost
+        if used >= max_tokens // 4 and _is_cut_point(piece):
+            sections.append("\n\n".join(current))
+            current, used = [], 0
+    if current:
+        sections.append("\n\n".join(current))
+    return sections
+
+
+def aggregate_maxim_evaluations(sections: List[str], evaluations: List[Dict]) -> Dict:
+    """
+    Combine per-section maxim evaluations into a document-level result.
+
+    Each maxim score is the mean of the section scores weighted by section length in tokens;
+    its explanation is the one of the section that scored lowest on it. Maxim names are
+    normalized ("quantity", " Quantity" -> "Quantity"), so sections whose responses spell
+    them differently are still combined. Sections whose evaluation failed are listed in
+    failed_sections and left out of the means.
+
+    Returns:
+        {"maxims": {maxim: {"score", "explanation", "min_score", "worst_section"}},
+         "worst_section": {"index", "score", "scores", "text"} or None, "failed_sections": [...]}
+    """
+    weights = [count_tokens(section) for section in sections]
+    totals, weight_sums, worst = {}, {}, {}
+    failed, section_scores = [], {}
+    for index, evaluation in enumerate(evaluations):
+        if not isinstance(evaluation, dict) or "error" in evaluation:
+            failed.append(index)
+            continue
+        for maxim, details in evaluation.items():
+            maxim = str(maxim).strip().title()
+            try:
+                score = float(details["score"])
+            except (TypeError, KeyError, ValueError):
+                continue
+            totals[maxim] = totals.get(maxim, 0.0) + score * weights[index]
+            weight_sums[maxim] = weight_sums.get(maxim, 0) + weights[index]
+            section_scores.setdefault(index, {})[maxim] = score
+            if maxim not in worst or score < worst[maxim][0]:
+                worst[maxim] = (score, index, details.get("explanation", ""))
+
+    maxims = {}
+    for maxim, total in totals.items():
+        min_score, index, explanation = worst[maxim]
+        maxims[maxim] = {
+            "score": round(total / weight_sums[maxim], 2) if weight_sums[maxim] else min_score,
+            "explanation": explanation,
+            "min_score": min_score,
+            "worst_section": index,
+        }
+
+    worst_section = None
+    if section_scores:
+        index = min(section_scores, key=lambda i: sum(section_scores[i].values()) / len(section_scores[i]))
+        scores = section_scores[index]
+        worst_section = {
+            "index": index,
+            "score": round(sum(scores.values()) / len(scores), 2),
+            "scores": scores,
+            "text": sections[index],
+        }
+    return {"maxims": maxims, "worst_section": worst_section, "failed_sections": failed}
+
+
+BIAS_HTML_START = "<div style='font-family: Arial, sans-serif; line-height:1.5;'>"
+BIAS_HTML_END = "</div>"
+
+
+def render_bias_paragraph(sentence: str, result: Optional[PredictionResult]) -> str:
+    """
+    Render a sentence with its bias label. Sentences without a result yet are greyed out,
+    sentences whose prediction failed are greyed out and marked as unavailable.
+    """
+    sentence = html.escape(sentence)
+    if result is None:
+        return f'<p style="color: gray;">{sentence}</p>'
+    if not result.ok:
+        return f'<p style="color: gray;">{sentence} <i>[bias analysis unavailable]</i></p>'
+    if (bias := result.value) not in ("Neutral", NO_BIAS_LABEL):
+        return (
+            f'<p style="color: red; font-weight: bold;">'
+            f'{sentence} '
+            f'<span style="color:black; background-color: yellow; padding: 2px 4px; border-radius: 3px;">[{html.escape(bias)}]</span>'
+            f'</p>'
+        )
+    return f"<p>{sentence}</p>"
+
+
+def render_bias_html(sentences: List[str], labels: List[Optional[PredictionResult]]) -> str:
+    """Render sentences with their bias labels; see render_bias_paragraph."""
+    return BIAS_HTML_START + "".join(map(render_bias_paragraph, sentences, labels)) + BIAS_HTML_END
+
+
+class DocumentPipeline:
+    """
+    Runs document bias and maxim analysis as a pipeline of independent work units.
+
+    The document is split into units (groups of sentences for bias analysis, sections for
+    maxim analysis) which are dispatched to the engine with at most max_concurrency in
+    flight. Results are yielded as units complete, so callers can show progress.
+    """
+    def __init__(self, engine: LLMEngine, max_concurrency: int = 4, sentences_per_unit: int = 40,
+                 max_section_tokens: int = 1500, section_cache: Optional[ResultCache] = None):
+        """
+        Args:
+            engine: Engine used for the classifier and evaluation calls.
+            max_concurrency: Maximum number of work units analyzed at the same time.
+            sentences_per_unit: Sentences per bias work unit (one batched request).
+            max_section_tokens: Token limit of a maxim analysis section.
+            section_cache: Store of the per-section maxim evaluations, so re-analyzing an
+                edited document only evaluates the sections that changed. Defaults to the
+                engine's result cache, or an in-memory cache when the engine has none.
+        """
+        self.engine = engine
+        self.max_concurrency = max_concurrency
+        self.sentences_per_unit = sentences_per_unit
+        self.max_section_tokens = max_section_tokens
+        self.section_cache = section_cache or engine.result_cache or ResultCache()
+
+    def _run(self, fn, units: List) -> Iterator:
+        """Yield (index, result) for each unit as it completes."""
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            # Each unit runs in a copy of the caller's context, which carries the turn being traced
+            futures = {executor.submit(contextvars.copy_context().run, fn, unit): index
+                       for index, unit in enumerate(units)}
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                # Stop queued units if the consumer stops early
+                for future in futures:
+                    future.cancel()
+
+    def iter_bias_results(self, text: str) -> Iterator[Dict]:
+        """
+        Yield one dict per completed unit:
+        {"unit": index, "units": total, "start": first sentence index, "sentences": [...], "labels": [PredictionResult, ...]}
+        """
+        sentences = split_sentences(text)
+        size = self.sentences_per_unit
+        starts = list(range(0, len(sentences), size))
+        units = [sentences[start:start + size] for start in starts]
+        for index, labels in self._run(self.engine.predict_content_bias_batch, units):
+            yield {
+                "unit": index,
+                "units": len(units),
+                "start": starts[index],
+                "sentences": units[index],
+                "labels": labels,
+            }
+
+    def stream_bias_html(self, text: str) -> Iterator[str]:
+        """
+        Yield the bias HTML of the whole document each time a unit completes. Each paragraph
+        is rendered once when its label arrives; only the completed unit's slice is replaced.
+        """
+        sentences = split_sentences(text)
+        paragraphs = [render_bias_paragraph(sentence, None) for sentence in sentences]
+        yield BIAS_HTML_START + "".join(paragraphs) + BIAS_HTML_END
+        for result in self.iter_bias_results(text):
+            start = result["start"]
+            paragraphs[start:start + len(result["labels"])] = map(render_bias_paragraph, result["sentences"],
+                                                                  result["labels"])
+            yield BIAS_HTML_START + "".join(paragraphs) + BIAS_HTML_END
+
+    def iter_maxim_results(self, text: str, domain_context: str = "general",
+                           guidelines: Optional[Dict[str, str]] = None) -> Iterator[Dict]:
+        """
+        Yield one dict per completed section:
+        {"unit": index, "units": total, "text": section, "evaluation": {maxim: {"score", "explanation"}}}
+        """
+        sections = split_sections(text, self.max_section_tokens)
+
+        def evaluate(section):
+            return self._evaluate_section(section, domain_context, guidelines)
+
+        for index, (evaluation, cached) in self._run(evaluate, sections):
+            yield {
+                "unit": index,
+                "units": len(sections),
+                "text": sections[index],
+                "evaluation": evaluation,
+                "cached": cached,
+            }
+
+    def _evaluate_section(self, section: str, domain_context: str,
+                          guidelines: Optional[Dict[str, str]]) -> Tuple[Dict, bool]:
+        """Evaluate a section, or reuse the stored evaluation of identical text. Returns (evaluation, cached)."""
+        key = self.engine.grice_maxims_cache_key(section, domain_context, guidelines)
+        evaluation = self.section_cache.get(key)
+        if evaluation is not None:
+            return evaluation, True
+        evaluation = self.engine.evaluate_grice_maxims(section, domain_context, guidelines)
+        if "error" not in evaluation:
+            self.section_cache.set(key, evaluation)
+        return evaluation, False
+
+    def evaluate_maxims(self, text: str, domain_context: str = "general",
+                        guidelines: Optional[Dict[str, str]] = None) -> Dict:
+        """
+        Map-reduce maxim analysis: evaluate the sections of text concurrently and aggregate
+        them with aggregate_maxim_evaluations. The result also lists the sections and counts
+        how many were evaluated ("recomputed") and how many came from the section cache.
+
+        Raises:
+            ValueError: If text is empty.
+        """
+        if not text.strip():
+            raise ValueError("Text cannot be empty.")
+        results = sorted(self.iter_maxim_results(text, domain_context, guidelines), key=lambda result: result["unit"])
+        sections = [result["text"] for result in results]
+        analysis = aggregate_maxim_evaluations(sections, [result["evaluation"] for result in results])
+        analysis["sections"] = results
+        analysis["recomputed"] = sum(not result["cached"] for result in results)
+        analysis["reused"] = len(results) - analysis["recomputed"]
+        return analysis
+
+    def analyze_maxims(self, user_id: str, text: str, domain_context: str = "general",
+                       guidelines: Optional[Dict[str, str]] = None, mode: str = "file_maxim_evaluation") -> Dict:
+        """
+        Chunked counterpart of LLMEngine.analyze_grice_maxims for documents too large for one
+        request. The document-level scores are stored in the user's XML in the same format.
+        """
+        with self.engine.tracer.turn("document", user_id, mode):
+            analysis = self.evaluate_maxims(text, domain_context, guidelines)
+            if analysis["maxims"]:
+                self.engine.store_maxim_evaluation(user_id, {
+                    maxim: {"score": details["score"], "explanation": details["explanation"]}
+                    for maxim, details in analysis["maxims"].items()
+                }, mode)
+            return analysis
+
+    def stream_maxim_json(self, text: str, domain_context: str = "general",
+                          guidelines: Optional[Dict[str, str]] = None) -> Iterator[str]:
+        """Yield a JSON document with the section evaluations completed so far, in document order."""
+        completed = {}
+        for result in self.iter_maxim_results(text, domain_context, guidelines):
+            completed[result["unit"]] = result
+            yield json.dumps({
+                "completed": len(completed),
+                "units": result["units"],
+                "sections": [completed[index] for index in sorted(completed)],
+            })
@@ -1,26 +1,146 @@
-
 import openai
 from openai import OpenAI
 import json
+import contextvars
+import threading
+import time
 from icecream import ic
 from EchoMind.managers.xml_manager import XmlManager
-from EchoMind.engines.rag import RAGSystem
+from EchoMind.managers.cache_manager import ResultCache
+from EchoMind.managers.semantic_cache import SemanticQuery, SemanticResponseCache
+from EchoMind.managers.usage_manager import UsageLedger
+from EchoMind.managers.context_manager import ContextWindow, ContextWindowManager, merge_session_history, render_turn
+from EchoMind.utils.helpers import count_tokens
+from EchoMind.utils.rate_limiter import TokenBucketRateLimiter, estimate_request_tokens, get_rate_limiter
+from EchoMind.utils.resilience import PredictionResult, ResilientCaller
+from EchoMind.utils.work_queue import PostProcessingQueue
+from EchoMind.utils.client_factory import ClientFactory, get_client_factory
+from EchoMind.utils.tracing import Tracer
+from EchoMind.utils.turns import TurnCancelled, TurnHandle, TurnRegistry, check_cancelled, current_handle
+from EchoMind.engines.rag import RAGSystem, RateLimitedEmbeddings
+from EchoMind.engines.mental_state import LocalMentalStateClassifier, normalize_state
+from EchoMind.engines.model_registry import ModelRegistry
+from EchoMind.engines.prompts import PromptCacheStats, PromptCompiler, RenderedPrompt
 from EchoMind.utils.helpers import setup_openai_key
-from typing import List, Dict, Tuple, Optional
+from typing import Callable, List, Dict, Tuple, Optional, Iterator, Union
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
+# Signals extracted from every user message by analyze_user_turn, with their instructions.
+USER_TURN_SIGNALS = {
+    "mental_state": (
+        "The user's most likely mental state, as a single word: Engaged (interested and following along), "
+        "Curious (wants more info or deeper explanations), Confused (uncertain or not understanding), "
+        "Bored (attention is waning), Frustrated (annoyed or stuck) or Satisfied (needs have been met)."
+    ),
+    "dialogue_bias": (
+        'Biases in the user message, using ONLY short technical names (e.g. "Political bias", "Cultural bias"), '
+        'one per line with "- " bullets, or "No biases detected" if none exist. Never add explanations.'
+    ),
+}
 
-class LLMEngine:
-    def __init__(self, openai_config_path: str = None,  rag_system: Optional[RAGSystem] = None, schema_config_path: Optional[str] = None):
-        api_key = setup_openai_key(openai_config_path)
-        self.client = openai.OpenAI(api_key=api_key)
+USER_TURN_SYSTEM_MESSAGE = """You are an AI trained to analyze a single user message in a conversation with an AI assistant.
+Return a JSON object with exactly these fields:
+{fields}"""
+
+# CONTENT_BIAS_SYSTEM_MESSAGE = """
+# You are an AI trained to identify potential biases in text content. 
+# Analyze the provided text and identify any biases that may be present.
+# Return a concise list of the biases, if any or "Neutral" if no significant bias is detected.
+# """
+CONTENT_BIAS_SYSTEM_MESSAGE = """You are an expert bias-detection AI. Analyze the given text and:
+            1. Strictly list detected biases using ONLY short technical names (e.g., "Political bias", "Cultural bias")
+            2. Use bullet points with "- " formatting
+            3. Return "No biases detected" if none exist
+            4. Never add explanations or descriptions
+
+            Example output:
+            - Confirmation bias
+            - Gender bias"""
+
+CONTENT_BIAS_BATCH_SYSTEM_MESSAGE = """You are an expert bias-detection AI. You receive numbered sentences, one per line.
+For every sentence:
+1. Strictly list detected biases using ONLY short technical names (e.g., "Political bias", "Cultural bias")
+2. Use bullet points with "- " formatting, one bias per line
+3. Use "No biases detected" if none exist
+4. Never add explanations or descriptions
+
+Return a JSON object mapping every sentence number to its label, for example:
+{"labels": {"1": "No biases detected", "2": "- Confirmation bias\\n- Gender bias"}}"""
+
+NO_BIAS_LABEL = "No biases detected"
+
+
+def merge_bias_labels(labels: List[str]) -> str:
+    """Combine content bias labels into one "- " list without duplicates, or NO_BIAS_LABEL."""
+    biases = []
+    for label in labels:
+        for line in label.splitlines():
+            line = line.strip()
+            if line.startswith("- ") and line not in biases:
+                biases.append(line)
+    return "\n".join(biases) or NO_BIAS_LABEL
+
+GRICE_MAXIMS_SYSTEM_MESSAGE = (
+    "You are a linguistics expert analyzing text for adherence to Grice's Cooperative Principle maxims: "
+    "Quantity (informative, not over/under), Quality (truthful, evidence-backed), "
+    "Relevance (stays on-topic), and Manner (clear, orderly, unambiguous)."
+)
+
+RESPONSE_EVALUATION_SYSTEM_MESSAGE = """You are a dialogue quality analyzer. Evaluate the AI's final response 
+        in the provided conversation history against Grice's maxims, considering:\n
+        1. How well it maintains Quantity given the conversation flow\n
+        2. Truthfulness and evidence (Quality) based on available context\n
+        3. Relevance to both immediate and broader dialogue context\n
+        4. Clarity and structure (Manner) in the response"""
+
+SUMMARY_SYSTEM_MESSAGE = (
+    "You maintain a running summary of a conversation between a user and an AI assistant. "
+    "Update the existing summary with the new turns. Keep the facts, questions and preferences "
+    "that matter for the rest of the conversation, drop small talk, and answer with the updated "
+    "summary only, in at most 150 words."
+)
+
+
+class BaseLLMEngine:
+    """
+    Client-independent part of the engines: configuration, history and prompt building.
+    LLMEngine and AsyncLLMEngine only differ in how the requests built here are sent.
+    """
+    def __init__(self, rag_system: Optional[RAGSystem] = None, schema_config_path: Optional[str] = None,
+                 result_cache: Optional[ResultCache] = None, context_manager: Optional[ContextWindowManager] = None,
+                 rate_limiter: Optional[TokenBucketRateLimiter] = None, resilience: Optional[ResilientCaller] = None,
+                 mental_state_classifier: Optional[LocalMentalStateClassifier] = None, prompt_layout: str = "inline",
+                 semantic_cache: Optional[SemanticResponseCache] = None, client_factory: Optional[ClientFactory] = None,
+                 tracer: Optional[Tracer] = None, usage_ledger: Optional[UsageLedger] = None,
+                 model_registry: Optional[ModelRegistry] = None, cancel_stale_turns: bool = True):
         self.rag = rag_system
+        self.client_factory = client_factory or get_client_factory()
         self.schema_config_path = schema_config_path
         self.prompt_config = self._load_prompt_config()
         self.xml_class = XmlManager(self.schema_config_path)
-        
+        self.result_cache = result_cache
+        self.context_manager = context_manager
+        self._rate_limiter = rate_limiter
+        self.resilience = resilience or ResilientCaller()
+        # Model of every stage and the routing policy between models
+        self.models = model_registry or ModelRegistry()
+        self.mental_state_classifier = mental_state_classifier
+        self.prompts = PromptCompiler(self.prompt_config, layout=prompt_layout)
+        # Stage timings of every turn; tracer.histogram.dump() gives p50/p95/p99 per stage
+        self.tracer = tracer or Tracer()
+        self.semantic_cache = semantic_cache
+        # Prompt tokens the provider served from its prompt cache, per stage
+        self.prompt_cache_stats = PromptCacheStats()
+        # Tokens and cost per user, mode, stage and model; kept in memory unless a stored ledger is given
+        self.usage_ledger = usage_ledger or UsageLedger(path=None)
+        # Outcome of the last history assembly per (user_id, mode)
+        self.history_reports = {}
+        # Last rendered system prompt per (user_id, mode), for inspection
+        self.last_prompts: Dict[Tuple[str, str], RenderedPrompt] = {}
+        # Turn in flight per (user_id, mode); a new message cancels the previous turn if it is still running
+        self.turns = TurnRegistry(cancel_previous=cancel_stale_turns)
 
-        
     def _load_prompt_config(self):
         try:
             with open(self.schema_config_path, "r") as f:
@@ -30,277 +150,958 @@ class LLMEngine:
             print(f"Error loading prompt config: {e}")
             return {}
 
+    def _record_usage(self, stage: str, model: Optional[str], usage, latency: float,
+                      user_id: Optional[str] = None, mode: Optional[str] = None) -> None:
+        self.prompt_cache_stats.record(stage, usage, latency)
+        self.usage_ledger.record(stage, usage, model, user_id, mode)
+
+    @property
+    def rate_limiter(self) -> TokenBucketRateLimiter:
+        """The engine's limiter, or the process-wide one shared by all EchoMind API calls."""
+        return self._rate_limiter or get_rate_limiter()
+
+    def _settle_usage(self, estimate: int, usage) -> None:
+        """Correct the token estimate a request was admitted with by its reported usage."""
+        total = getattr(usage, "total_tokens", None)
+        if total is not None:
+            self.rate_limiter.settle(estimate, total)
 
-    def predict_mental_state(self, user_input: str) -> str:
+    def _result_cache_key(self, stage: str, request: Dict) -> str:
         """
-        Function to predict the user's mental state using OpenAI's model.
+        Cache key of a request as it is sent: with the model the registry routes it to, so a
+        result is not reused once the routing sends the request to another model.
         """
+        return ResultCache.make_key({**request, "model": self.models.route(stage, request).model})
+
+    def _cache_lookup(self, stage: str, request: Dict) -> Tuple[Optional[str], Optional[str]]:
+        """Return the cache key of a classifier request and its cached result, if any."""
+        if self.result_cache is None:
+            return None, None
+        key = self._result_cache_key(stage, request)
+        return key, self.result_cache.get(key)
+
+    def _cache_store(self, key: Optional[str], result: str) -> None:
+        if key is not None:
+            self.result_cache.set(key, result)
+
+    def _local_mental_state(self, user_input: str) -> Optional[PredictionResult]:
+        """Answer from the local classifier when it is confident enough; None escalates to the LLM."""
+        if self.mental_state_classifier is None:
+            return None
+        state, confidence = self.mental_state_classifier.predict(user_input)
+        if state is None or confidence < self.mental_state_classifier.threshold:
+            return None
+        return PredictionResult(value=state, local=True)
+
+    def _local_user_turn_signals(self, user_input: str, signals: List[str]) -> Tuple[Dict[str, PredictionResult], List[str]]:
+        """Answer what the local classifiers can; return those results and the signals left for the LLM."""
+        unknown = [signal for signal in signals if signal not in USER_TURN_SIGNALS]
+        if unknown:
+            raise ValueError(f"Unknown user turn signals: {unknown}")
+        results = {}
+        if "mental_state" in signals and self.mental_state_classifier is not None:
+            with self.tracer.span("mental_state_local"):
+                local = self._local_mental_state(user_input)
+            if local is not None:
+                results["mental_state"] = local
+        return results, [signal for signal in signals if signal not in results]
+
+    def _user_turn_request(self, user_input: str, signals: List[str]) -> Dict:
+        fields = "\n".join(f'- "{signal}": {USER_TURN_SIGNALS[signal]}' for signal in signals)
+        return dict(
+            model=self.models.model_for("user_turn"),
+            messages=[
+                {"role": "system", "content": USER_TURN_SYSTEM_MESSAGE.format(fields=fields)},
+                {"role": "user", "content": user_input}
+            ],
+            temperature=0.3,  # Lower temperature for more deterministic output
+            max_tokens=30 * len(signals) + 20,  # Short labels only
+            response_format={"type": "json_object"}
+        )
+
+    def _parse_user_turn(self, response: PredictionResult, signals: List[str]) -> Dict[str, PredictionResult]:
+        """Split a user turn response into one result per signal."""
+        if not response.ok:
+            return {signal: PredictionResult(error=response.error) for signal in signals}
+        try:
+            fields = json.loads(response.value)
+        except (TypeError, ValueError):
+            fields = None
+        if not isinstance(fields, dict):
+            return {signal: PredictionResult(error="user_turn failed: unparsable response") for signal in signals}
+        results = {}
+        for signal in signals:
+            value = fields.get(signal)
+            if isinstance(value, list):
+                value = "\n".join(f"- {item}" for item in value) if value else NO_BIAS_LABEL
+            if isinstance(value, str) and value.strip():
+                value = value.strip()
+                if signal == "mental_state":
+                    value = normalize_state(value) or value
+                results[signal] = PredictionResult(value=value, attempts=response.attempts, hedged=response.hedged,
+                                                   cached=response.cached)
+            else:
+                results[signal] = PredictionResult(error=f"user_turn failed: no {signal} in response")
+        return results
+
+    def _user_turn_is_clear(self, content: str, signals: List[str]) -> bool:
+        """Whether a user turn answer has every signal and a known mental state."""
+        results = self._parse_user_turn(PredictionResult(value=content), signals)
+        if not all(result.ok for result in results.values()):
+            return False
+        return "mental_state" not in results or normalize_state(results["mental_state"].value) is not None
+
+    @staticmethod
+    def _is_bias_label(content: str) -> bool:
+        """Whether a content bias answer is "No biases detected" or a list of "- " bullets."""
+        lines = [line.strip() for line in content.splitlines() if line.strip()]
+        return content.strip() == NO_BIAS_LABEL or (bool(lines) and all(line.startswith("- ") for line in lines))
+
+    def _known_chunk_biases(self, chunks: List[Tuple[str, str]]) -> Tuple[Dict[str, str], List[Tuple[str, str]]]:
+        """Stored bias labels of chunks, and the (chunk id, text) pairs that have none yet."""
+        known = self.rag.get_chunk_biases([chunk_id for chunk_id, _ in chunks]) if self.rag else {}
+        # One line per chunk, as the batch prompt expects one sentence per line
+        missing = {chunk_id: " ".join(text.split()) for chunk_id, text in chunks if chunk_id not in known}
+        return known, list(missing.items())
+
+    def _store_chunk_biases(self, missing: List[Tuple[str, str]], results: List[PredictionResult]) -> Dict[str, str]:
+        labels = {chunk_id: result.value for (chunk_id, _), result in zip(missing, results) if result.ok}
+        if self.rag is not None:
+            self.rag.set_chunk_biases(labels)
+        return labels
+
+    @staticmethod
+    def _merge_chunk_biases(chunks: List[Tuple[str, str]], labels: Dict[str, str],
+                            results: List[PredictionResult]) -> PredictionResult:
+        failed = next((result for result in results if not result.ok), None)
+        if failed is not None:
+            return PredictionResult(error=failed.error)
+        return PredictionResult(value=merge_bias_labels([labels[chunk_id] for chunk_id, _ in chunks]),
+                                cached=not results)
+
+    def _content_bias_request(self, text: str) -> Dict:
+        return dict(
+            model=self.models.model_for("content_bias"),
+            messages=[
+                {"role": "system", "content": CONTENT_BIAS_SYSTEM_MESSAGE},
+                {"role": "user", "content": text}
+            ],
+            temperature=0.3,  # Lower temperature for more deterministic output
+            max_tokens=50     # Limit response length
+        )
+
+    def _content_bias_batch_request(self, sentences: Dict[int, str]) -> Dict:
+        numbered = "\n".join(f"{number}. {sentence}" for number, sentence in sentences.items())
+        return dict(
+            model=self.models.model_for("content_bias_batch"),
+            messages=[
+                {"role": "system", "content": CONTENT_BIAS_BATCH_SYSTEM_MESSAGE},
+                {"role": "user", "content": numbered}
+            ],
+            temperature=0.3,
+            max_tokens=20 * len(sentences) + 50,  # Room for a short label per sentence
+            response_format={"type": "json_object"}
+        )
+
+    def _pack_bias_batches(self, sentences: List[str], indices: List[int], max_request_tokens: int,
+                           max_batch_size: int) -> List[Dict[int, str]]:
+        """Group sentences into numbered batches whose input stays within max_request_tokens."""
+        budget = max_request_tokens - count_tokens(CONTENT_BIAS_BATCH_SYSTEM_MESSAGE)
+        batches, batch, used = [], {}, 0
+        for index in indices:
+            cost = count_tokens(sentences[index]) + 4  # Number and line break
+            if batch and (used + cost > budget or len(batch) >= max_batch_size):
+                batches.append(batch)
+                batch, used = {}, 0
+            batch[index + 1] = sentences[index]
+            used += cost
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _parse_bias_batch(self, content: str, batch: Dict[int, str]) -> Dict[int, str]:
+        """Map the labels of a batch response back to sentence numbers, skipping unusable ones."""
         try:
-            # Define the system message to guide the model
-            system_message = """
-            You are an AI trained to predict the mental state of a user based on their input. 
-            The possible mental states are:
-            - Engaged (the user is interested and following along)
-            - Curious (the user wants more info or deeper explanations)
-            - Confused (the user is uncertain or not understanding)
-            - Bored (the user’s attention is waning)
-            - Frustrated (the user is annoyed or stuck)
-            - Satisfied (the user feels their needs have been met)
-
-            Analyze the user's input and predict the most likely mental state.
-            Return only the predicted mental state as a single word.
-            """
-
-            # Call the OpenAI API
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",  # You can use "gpt-4" if you have access
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_input}
-                ],
-                temperature=0.3,  # Lower temperature for more deterministic output
-                max_tokens=10     # Limit response length
+            labels = json.loads(content)
+        except (TypeError, ValueError):
+            return {}
+        if isinstance(labels, dict) and isinstance(labels.get("labels"), dict):
+            labels = labels["labels"]
+        if not isinstance(labels, dict):
+            return {}
+        parsed = {}
+        for number in batch:
+            label = labels.get(str(number))
+            if isinstance(label, list):
+                label = "\n".join(f"- {item}" for item in label) if label else NO_BIAS_LABEL
+            if isinstance(label, str) and label.strip():
+                parsed[number] = label.strip()
+        return parsed
+
+    def _start_bias_batch(self, sentences: List[str]) -> Tuple[List[Optional[PredictionResult]], List[int]]:
+        """Results of the sentences that need no request (empty or cached) and the indices of the others."""
+        labels = [None] * len(sentences)
+        pending = []
+        for index, sentence in enumerate(sentences):
+            if not sentence.strip():
+                labels[index] = PredictionResult(value=NO_BIAS_LABEL)
+                continue
+            key = self._bias_batch_cache_key(sentence)
+            cached = self.result_cache.get(key) if key else None
+            if cached is not None:
+                labels[index] = PredictionResult(value=cached, cached=True)
+            else:
+                pending.append(index)
+        return labels, pending
+
+    def _apply_bias_batch(self, labels: List[Optional[PredictionResult]], batch: Dict[int, str],
+                          parsed: Dict[int, str], error: Optional[str], attempt: int) -> List[int]:
+        """
+        Store the parsed labels of a batch and return the indices of its sentences left without one.
+        If the request itself failed (error), its sentences get that error and are not retried.
+        """
+        if error is not None:
+            for number in batch:
+                labels[number - 1] = PredictionResult(error=error, attempts=attempt)
+            return []
+        unlabelled = []
+        for number in batch:
+            if number in parsed:
+                labels[number - 1] = PredictionResult(value=parsed[number], attempts=attempt)
+                self._cache_store(self._bias_batch_cache_key(batch[number]), parsed[number])
+            else:
+                unlabelled.append(number - 1)
+        return unlabelled
+
+    def _bias_batch_cache_key(self, sentence: str) -> Optional[str]:
+        if self.result_cache is None:
+            return None
+        # Keyed per sentence, on the model a batch of that sentence alone is routed to
+        model = self.models.route("content_bias_batch", {"messages": [
+            {"role": "system", "content": CONTENT_BIAS_BATCH_SYSTEM_MESSAGE}, {"role": "user", "content": sentence}
+        ]}).model
+        return self.result_cache.make_key({"model": model, "system": CONTENT_BIAS_BATCH_SYSTEM_MESSAGE,
+                                           "input": sentence})
+
+    def _generation_request(self, system_prompt: Union[str, RenderedPrompt], user_input: str,
+                            temperature: float = 0.7) -> Dict:
+        if isinstance(system_prompt, RenderedPrompt):
+            system_messages = system_prompt.messages
+        else:
+            system_messages = [{"role": "system", "content": system_prompt}]
+        return dict(
+            model=self.models.model_for("generation"),
+            messages=system_messages + [{"role": "user", "content": user_input}],
+            max_tokens=500,
+            temperature=temperature,
+        )
+
+    def _summary_request(self, previous_summary: str, turns: List[Dict[str, str]]) -> Dict:
+        new_turns = "".join(render_turn(turn) for turn in turns)
+        return dict(
+            model=self.models.model_for("summary"),
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_MESSAGE},
+                {"role": "user", "content": f"Existing summary:\n{previous_summary or 'None'}\n\nNew turns:\n{new_turns}"}
+            ],
+            temperature=0.3,
+            max_tokens=250
+        )
+
+    def _plan_history(self, user_id: str, session_history, mode: str) -> ContextWindow:
+        """
+        Merge the persistent and session history and choose what fits the token budget.
+
+        Session turns that were already stored through append_dialogue are dropped, and the
+        chat UI decoration is stripped. The tokens this saves are recorded in history_reports.
+        """
+        # Persistent dialogue history from XML (list of dicts with keys 'user' and 'system').
+        persistent_history = self._xml_read("get_dialogue_history", user_id, mode)
+        session_turns, duplicate_turns = merge_session_history(persistent_history, session_history)
+
+        # Without a context manager the whole history is used.
+        if self.context_manager is None:
+            window = ContextWindow(persistent_history, session_turns)
+        else:
+            summary, summarized_turns = self._xml_read("get_conversation_summary", user_id, mode)
+            session_summarized, session_digest = self._xml_read("get_summarized_session_turns", user_id, mode)
+            window = self.context_manager.plan(persistent_history, session_turns, summary, summarized_turns,
+                                               session_summarized, session_digest)
+
+        raw_session_text = "".join(f"{turn[0]}\n{turn[1]}\n" for turn in session_history or [])
+        # The retrieval query keeps the whole session, duplicates included.
+        window.session_text = "".join(
+            render_turn(turn) for turn in merge_session_history([], session_history)[0]
+        )
+        self.history_reports[(user_id, mode)] = {
+            "session_turns": len(session_history or []),
+            "duplicate_turns": duplicate_turns,
+            "tokens_saved": count_tokens(raw_session_text) - count_tokens("".join(render_turn(turn) for turn in session_turns)),
+        }
+        return window
+
+    def _store_summary(self, user_id: str, window: ContextWindow, summary: str, mode: str) -> None:
+        """Store summary as the summary of the window's folded turns."""
+        window.fold(summary)
+        self._xml_write("update_conversation_summary", user_id, window.summary, window.summarized_turns, mode,
+                        session_turns=window.summarized_session_turns, session_digest=window.session_digest)
+
+    def _query_embeddings(self):
+        """Embeddings model of the semantic cache; created on first use, once the API key is set up."""
+        if self.semantic_cache.embeddings is None:
+            if self.rag is not None:
+                self.semantic_cache.embeddings = self.rag.embeddings
+            else:
+                self.semantic_cache.embeddings = RateLimitedEmbeddings(self.client_factory.embeddings(), self._rate_limiter)
+        return self.semantic_cache.embeddings
+
+    def _semantic_scope(self, user_id: str, mode: str, profile: Dict, chunks: List[Tuple[str, str]]) -> Tuple:
+        """
+        A cached reply is only reused in the same conversation (user and mode), with the same
+        profile settings and retrieved chunks, so replies never leak between users. The history
+        and the mental state are left out: they change from turn to turn and would prevent a
+        question asked again later in the conversation from hitting. The cache's ttl bounds
+        how old a reused reply can be.
+        """
+        settings = tuple(profile.get(field, "") for field in self.prompt_config)
+        return user_id, mode, settings, tuple(chunk_id for chunk_id, _ in chunks)
+
+    def _use_semantic_cache(self, user_input: str) -> bool:
+        return self.semantic_cache is not None and self.semantic_cache.accepts(user_input)
+
+    def _cache_reply(self, semantic: Optional[SemanticQuery], reply: str) -> None:
+        if semantic is not None and reply:
+            self.semantic_cache.store(semantic, reply)
+
+    def _remember_prompt(self, user_id: str, mode: str, prompt: RenderedPrompt) -> RenderedPrompt:
+        self.last_prompts[(user_id, mode)] = prompt
+        return prompt
+
+    @staticmethod
+    def _commit_turn(turn: Optional[TurnHandle]) -> None:
+        """The reply is complete: from here on the turn's bookkeeping runs even if a newer turn starts."""
+        if turn is not None:
+            turn.commit()
+
+    def cancel_turn(self, user_id: str, mode: str = "standard") -> bool:
+        """
+        Cancel the turn in flight in the user's conversation, e.g. from a stop button. The
+        cancelled call raises TurnCancelled. Returns False if no turn could be cancelled.
+        """
+        return self.turns.cancel(user_id, mode)
+
+    def get_last_prompt(self, user_id: str, mode: str = "standard") -> Optional[RenderedPrompt]:
+        """The system prompt of the user's last turn; its tokens attribute gives the token count."""
+        return self.last_prompts.get((user_id, mode))
+
+    def _build_maxim_system_message(self, file_context, file_analysis, domain_context) -> str:
+        return f"""You are a conversational AI. Follow these guidelines:
+        - Grice's Maxims: Be informative but concise (Quantity), truthful (Quality), 
+        relevant to conversation history, and clear (Manner)
+        - Context: {file_context or 'No file context'}
+        - Grice's maxim evaluation: {file_analysis or 'No file analysis'}
+        - Domain: {domain_context}"""
+
+    def _record_turn(self, user_id: str, user_input: str, reply: str, new_state: PredictionResult,
+                     dialogue_bias_prediction: PredictionResult, mode: str) -> None:
+        """Persist the outcome of a finished chat turn. Failed predictions leave the stored value as is."""
+        with self.tracer.span("record_turn"):
+            if new_state.ok:
+                self._xml_write("update_dynamic_mental_state", user_id, new_state.value, mode)
+            self._append_dialogue(user_id, user_input, reply, new_state, mode)
+            if dialogue_bias_prediction.ok:
+                self._xml_write("update_predicted_user_dialogue_bias", user_id, dialogue_bias_prediction.value, mode)
+
+    def _append_dialogue(self, user_id: str, user_input: str, reply: str, new_state: PredictionResult, mode: str) -> None:
+        """Append the turn together with its mental-state label."""
+        self._xml_write("append_dialogue", user_id, user_input, reply, mode,
+                        mental_state=new_state.value if new_state.ok else None,
+                        mental_state_source="local" if new_state.local else "llm")
+
+    def _xml_read(self, op: str, *args, **kwargs):
+        """Call the XmlManager reader op under an xml_read span."""
+        with self.tracer.span("xml_read", op=op):
+            return getattr(self.xml_class, op)(*args, **kwargs)
+
+    def _xml_write(self, op: str, *args, **kwargs):
+        """
+        Call the XmlManager update op under an xml_write span. Raises TurnCancelled instead
+        if the turn being processed was cancelled, so stale turns do not write out of order.
+        """
+        check_cancelled()
+        with self.tracer.span("xml_write", op=op):
+            return getattr(self.xml_class, op)(*args, **kwargs)
+
+    def grice_maxims_cache_key(self, text: str, domain_context: str = "general",
+                               guidelines: Optional[Dict[str, str]] = None) -> str:
+        """
+        Key of the maxim evaluation of text in a ResultCache; the same for every call that
+        would send the same request.
+
+        Raises:
+            ValueError: If text is empty.
+        """
+        return self._result_cache_key("maxim_evaluation", self._grice_maxims_request(text, domain_context, guidelines))
+
+    def store_maxim_evaluation(self, user_id: str, evaluation: Dict[str, Dict],
+                               mode: str = "file_maxim_evaluation") -> None:
+        """Store a {maxim: {"score", "explanation"}} evaluation of a document in the user's XML."""
+        self._xml_write("update_predicted_content_maxim_evaluation", user_id, evaluation, mode)
+
+    def _grice_maxims_request(self, text: str, domain_context: str = "general",
+                              guidelines: Optional[Dict[str, str]] = None) -> Dict:
+        # Validate inputs
+        if not text.strip():
+            raise ValueError("Text cannot be empty.")
+
+        # User prompt with text, domain context, and guidelines
+        guidelines_str = ""
+        if guidelines:
+            guidelines_str = "\nCustom Guidelines:\n" + "\n".join(
+                [f"- {maxim}: {desc}" for maxim, desc in guidelines.items()]
             )
 
-            # Extract and return the predicted mental state
-            predicted_state = response.choices[0].message.content.strip()
-            return predicted_state
-        except Exception as e:
-            return f"Error predicting mental state: {str(e)}"
+        user_prompt = (
+            f"Analyze this text for Grice's maxims:\n\n{text}\n\n"
+            f"Domain Context: {domain_context}\n"
+            f"{guidelines_str}\n\n"
+            "Provide a JSON response with a numerical score (1-5) and concise explanation for each maxim. "
+            "Example format: {\"quantity\": {\"score\": 3, \"explanation\": \"...\"}, ...}"
+        )
+        return dict(
+            model=self.models.model_for("maxim_evaluation"),
+            messages=[
+                {"role": "system", "content": GRICE_MAXIMS_SYSTEM_MESSAGE},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.0,
+            response_format={"type": "json_object"}  # Ensure JSON output
+        )
+
+    def _response_evaluation_request(self, conversation_history, latest_response: str,
+                                     domain_context: str = "general",
+                                     guidelines: Optional[Dict[str, str]] = None) -> Dict:
+        if not conversation_history:
+            raise ValueError("Conversation history cannot be empty")
+        if not latest_response.strip():
+            raise ValueError("LLM response cannot be empty")
+
+        # Extract relevant context (last 3 exchanges for efficiency)
+        # context_exchanges = "\n".join(
+        #     [f"User: {u}\nAI: {a}" for u, a in conversation_history[-3:]]
+        # )
 
-    def predict_content_bias(self, text: str) -> str:
+        user_prompt = f"""Conversation Context:\n{conversation_history}\n\nLatest AI Response:\n{latest_response}\n\n
+        Domain: {domain_context}\nCustom Guidelines: {guidelines or 'None'}\n\n
+        Provide JSON evaluation with 1-5 scores and explanations for each maxim."""
+        return dict(
+            model=self.models.model_for("response_evaluation"),
+            messages=[
+                {"role": "system", "content": RESPONSE_EVALUATION_SYSTEM_MESSAGE},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.0,
+            response_format={"type": "json_object"}
+        )
+
+
+class LLMEngine(BaseLLMEngine):
+    def __init__(self, openai_config_path: str = None,  rag_system: Optional[RAGSystem] = None, schema_config_path: Optional[str] = None,
+                 concurrent: bool = True, max_workers: int = 16, result_cache: Optional[ResultCache] = None,
+                 context_manager: Optional[ContextWindowManager] = None, rate_limiter: Optional[TokenBucketRateLimiter] = None,
+                 resilience: Optional[ResilientCaller] = None, post_processing: Optional[PostProcessingQueue] = None,
+                 mental_state_classifier: Optional[LocalMentalStateClassifier] = None, prompt_layout: str = "inline",
+                 semantic_cache: Optional[SemanticResponseCache] = None, client_factory: Optional[ClientFactory] = None,
+                 tracer: Optional[Tracer] = None, usage_ledger: Optional[UsageLedger] = None,
+                 model_registry: Optional[ModelRegistry] = None, cancel_stale_turns: bool = True):
         """
-        Function to predict bias in the retrieved content using OpenAI's model.
+        Args:
+            concurrent: Fan out the independent calls of a turn (user turn classifier, query
+                embedding, content bias) on a thread pool instead of running them one after
+                another, so a turn takes about one classifier call plus the generation. Turn it
+                off to keep every call on the calling thread, e.g. when threads are scarce.
+            max_workers: Size of the thread pool used in concurrent mode. The pool is shared by
+                all conversations of the engine and a standard turn keeps up to three jobs in
+                it, so size it to about three times the turns expected in flight at once; with
+                fewer workers the calls of concurrent turns queue behind each other.
+            result_cache: Cache for the bias and mental-state classifier results. Repeated
+                inputs are answered from it without an API call. ResultCache() also keeps them on
+                disk under generated_data/cache; ResultCache(disk_dir=None) keeps them in memory only.
+            context_manager: Keeps the prompt history within a token budget by folding older
+                turns into a rolling summary stored in the user's XML. Unbounded when None.
+            rate_limiter: Limiter for this engine's requests. Defaults to the process-wide limiter.
+            resilience: Retry, deadline and hedging settings of the API calls. Defaults to
+                ResilientCaller() (3 attempts, no hedging).
+            post_processing: Queue for the bookkeeping after a reply (mental state, XML writes,
+                response maxim evaluation), so replies return as soon as they are generated.
+                The bookkeeping runs inline when None.
+            mental_state_classifier: Local classifier tried before the LLM for the mental state.
+                Inputs it is not confident about still go to the LLM.
+            prompt_layout: "inline" (one system message) or "cache_friendly" (static instructions,
+                profile, history and the per-turn mental state, retrieval and biases as separate
+                system messages, so consecutive turns share a prefix the provider can serve from
+                its prompt cache). The cached tokens are reported in prompt_cache_stats.
+            semantic_cache: Answers standard turns whose query is nearly identical to an earlier
+                one of the same user, with the same profile and retrieved chunks, from the cached
+                reply instead of generating a new one. Disabled when None.
+            client_factory: Source of the OpenAI client and its connection pool. Defaults to the
+                process-wide factory, so all engines and RAG systems share one pool.
+            tracer: Receives a timed span for every stage of a turn (XML reads and writes,
+                retrieval, each API call with its token counts, ...). Defaults to a Tracer
+                with an in-memory histogram; see tracer.histogram.report().
+            usage_ledger: Books the prompt, completion and cached tokens and the cost of every
+                call per user, mode, stage and model; see usage_ledger.top(). Defaults to an
+                in-memory ledger; pass UsageLedger(path) to keep the totals across restarts.
+            model_registry: Model of every stage and the routing policy, e.g.
+                ModelRegistry.from_config("models.json") or ModelRegistry(routing=DEFAULT_ROUTING)
+                to send short classifier inputs to a smaller model. Defaults to the built-in
+                models, with only the per-turn classifier routed (gpt-4o-mini, escalated to
+                gpt-4o for long or unclear inputs). Decisions are logged in model_registry.stats().
+            cancel_stale_turns: A new message cancels the turn still in flight in the same
+                user and mode, e.g. when a user sends their message again: the old turn's
+                queued work is dropped, its streamed reply is closed, it sends no further API
+                calls and writes no state, and its call raises TurnCancelled. A request already
+                sent completes, but its result is discarded. Turns whose reply is complete are
+                never cancelled.
         """
+        super().__init__(rag_system=rag_system, schema_config_path=schema_config_path, result_cache=result_cache,
+                         context_manager=context_manager, rate_limiter=rate_limiter, resilience=resilience,
+                         mental_state_classifier=mental_state_classifier, prompt_layout=prompt_layout,
+                         semantic_cache=semantic_cache, client_factory=client_factory, tracer=tracer,
+                         usage_ledger=usage_ledger, model_registry=model_registry,
+                         cancel_stale_turns=cancel_stale_turns)
+        api_key = setup_openai_key(openai_config_path)
+        self.client = self.client_factory.openai_client(api_key)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers) if concurrent else None
+        self.post_processing = post_processing
+        # Set on the pool's threads while they run a job
+        self._worker = threading.local()
+
+    def _run_job(self, fn, *args):
+        self._worker.active = True
         try:
-            # Define the system message to guide the model
-            # system_message = """
-            # You are an AI trained to identify potential biases in text content. 
-            # Analyze the provided text and identify any biases that may be present.
-            # Return a concise list of the biases, if any or "Neutral" if no significant bias is detected.
-            # """
-            system_message = """You are an expert bias-detection AI. Analyze the given text and:
-            1. Strictly list detected biases using ONLY short technical names (e.g., "Political bias", "Cultural bias")
-            2. Use bullet points with "- " formatting
-            3. Return "No biases detected" if none exist
-            4. Never add explanations or descriptions
+            return fn(*args)
+        finally:
+            self._worker.active = False
 
-            Example output:
-            - Confirmation bias
-            - Gender bias"""
+    def _submit(self, fn, *args) -> Future:
+        """
+        Run fn on the engine's thread pool in concurrent mode, inline otherwise. Jobs submitted
+        from a pool thread run inline too, so a job never waits for a pool it occupies.
+        """
+        if self.executor is not None and not getattr(self._worker, "active", False):
+            # The copied context carries the current turn's tracing attributes and handle to
+            # the worker; the job is dropped if the turn is cancelled before it starts
+            future = self.executor.submit(contextvars.copy_context().run, self._run_job, fn, *args)
+            turn = current_handle()
+            return turn.track(future) if turn is not None else future
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except (Exception, TurnCancelled) as e:
+            future.set_exception(e)
+        return future
 
-            # Call the OpenAI API
-            response = self.client.chat.completions.create(
-                model="gpt-4o",  # You can use "gpt-4" if you have access
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": text}
-                ],
-                temperature=0.3,  # Lower temperature for more deterministic output
-                max_tokens=50     # Limit response length
-            )
+    def _defer(self, user_id: str, mode: str, fn, *args) -> Future:
+        """
+        Queue fn behind the pending bookkeeping of the user's conversation. Without a
+        post-processing queue fn runs inline and its errors propagate.
+        """
+        if self.post_processing is not None:
+            return self.post_processing.submit((user_id, mode), fn, *args)
+        future = Future()
+        future.set_result(fn(*args))
+        return future
 
-            # Extract and return the predicted bias
-            predicted_bias = response.choices[0].message.content.strip()
-            return predicted_bias
-        except Exception as e:
-            return f"Error predicting content bias: {str(e)}"
+    def _predict_mental_state_deferred(self, user_id: str, user_input: str, mode: str) -> Future:
+        """The mental state is only needed for bookkeeping, so it is predicted off the reply path."""
+        if self.post_processing is not None:
+            return self._defer(user_id, mode, self.predict_mental_state, user_input)
+        return self._submit(self.predict_mental_state, user_input)
 
+    def wait_for_pending(self, user_id: str, mode: str, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the queued bookkeeping of a user's conversation is done, e.g. before
+        reading its XML. Returns False if the timeout expired first.
+        """
+        if self.post_processing is None:
+            return True
+        return self.post_processing.wait_idle((user_id, mode), timeout)
 
-    def predict_dialogue_bias(self, text: str) -> str:
+    def _send_completion(self, request: Dict, stage: str, hedge: bool = False, escalated: bool = False, **kwargs):
         """
-        Function to predict bias in the user dialogue using OpenAI's model.
+        Send a chat completion request through the model router, the rate limiter and the
+        resilience layer. Returns (response, attempts, hedged).
+        """
+        # Captured here: hedged attempts run on threads that do not share the turn's context
+        turn = current_handle()
+        with self.models.routed(stage, request, escalated) as route:
+            request = {**request, "model": route.model}
+
+            def send(timeout):
+                check_cancelled(turn)
+                estimate = estimate_request_tokens(request)
+                self.rate_limiter.acquire(estimate)
+                # The turn may have been cancelled while waiting for capacity
+                check_cancelled(turn)
+                response = self.client.chat.completions.create(**request, timeout=timeout, **kwargs)
+                if not kwargs.get("stream"):
+                    # Streams are settled by the consumer once the usage chunk arrives
+                    self._settle_usage(estimate, getattr(response, "usage", None))
+                return response
+
+            if kwargs.get("stream"):
+                # Timed by the caller, which sees the whole stream
+                return self.resilience.call(send, stage, hedge)
+            started = time.monotonic()
+            with self.tracer.span(f"api.{stage}", model=route.model, route=route.reason) as span:
+                response, attempts, hedged = self.resilience.call(send, stage, hedge)
+                usage = getattr(response, "usage", None)
+                span.set(attempts=attempts, hedged=hedged).add_usage(usage)
+        self._record_usage(stage, route.model, usage, time.monotonic() - started)
+        return response, attempts, hedged
+
+    def _create_completion(self, request: Dict, stage: str, **kwargs):
+        """Send a chat completion request, retrying transient failures. Raises the last error."""
+        return self._send_completion(request, stage, **kwargs)[0]
+
+    def close(self) -> None:
+        """Finish the queued bookkeeping and release the thread pool used in concurrent mode."""
+        if self.post_processing is not None:
+            self.post_processing.flush()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def _classify(self, stage: str, request: Dict, is_clear: Optional[Callable[[str], bool]] = None) -> PredictionResult:
+        """
+        Send a (hedged) classifier request, answering from the result cache when possible.
+        An answer is_clear rejects is asked again on the stage's escalation model, if any; the
+        escalated answer is cached for the routed request, so a repeat skips the unclear one.
         """
+        key, cached = self._cache_lookup(stage, request)
+        if cached is not None:
+            return PredictionResult(value=cached, cached=True)
         try:
-            # Define the system message to guide the model
-            # system_message = """
-            # You are an AI trained to identify potential biases in user dialogue. 
-            # Analyze the provided text and identify any biases that may be present.
-            # Return a concise description of the bias or "Neutral" if no significant bias is detected.
-            # """
-            system_message = """You are an expert bias-detection AI. Analyze the given user dialogue and:
-            1. Strictly list detected biases using ONLY short technical names (e.g., "Political bias", "Cultural bias")
-            2. Use bullet points with "- " formatting
-            3. Return "No biases detected" if none exist
-            4. Never add explanations or descriptions
+            response, attempts, hedged = self._send_completion(request, stage, hedge=True)
+            result = response.choices[0].message.content.strip()
+            escalation = None if is_clear is None or is_clear(result) else self.models.escalation(stage, request)
+            if escalation is not None:
+                response, retries, hedged = self._send_completion({**request, "model": escalation}, stage,
+                                                                  hedge=True, escalated=True)
+                result = response.choices[0].message.content.strip()
+                attempts += retries
+        except Exception as e:
+            return PredictionResult(error=f"{stage} failed: {e}")
+        self._cache_store(key, result)
+        return PredictionResult(value=result, attempts=attempts, hedged=hedged)
 
-            Example output:
-            - Confirmation bias
-            - Gender bias"""
-            # Call the OpenAI API
-            response = self.client.chat.completions.create(
-                model="gpt-4o",  # You can use "gpt-4" if you have access
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": text}
-                ],
-                temperature=0.3,  # Lower temperature for more deterministic output
-                max_tokens=50     # Limit response length
-            )
+    def summarize_dialogue(self, previous_summary: str, turns: List[Dict[str, str]]) -> str:
+        """
+        Fold turns into previous_summary and return the updated rolling summary.
+        """
+        response = self._create_completion(self._summary_request(previous_summary, turns), "summary")
+        return response.choices[0].message.content.strip()
 
-            # Extract and return the predicted bias
-            predicted_bias = response.choices[0].message.content.strip()
-            return predicted_bias
+    def _fold_history(self, user_id: str, window: ContextWindow, mode: str) -> None:
+        """Fold the turns that left the window into the stored summary. A failed fold is retried next turn."""
+        try:
+            summary = self.summarize_dialogue(window.summary, window.to_fold)
         except Exception as e:
-            return f"Error predicting dialogue bias: {str(e)}"
+            print(f"Error summarizing dialogue: {e}")
+            return
+        self._store_summary(user_id, window, summary, mode)
 
-        
-    def generate_llm_response(self, user_id, user_input, session_history=None, mode="standard"):
-        # Retrieve persistent dialogue history from XML (list of dicts with keys 'user' and 'system').
-        persistent_history = self.xml_class.get_dialogue_history(user_id, mode)
-        
-        # Normalize persistent history to text.
-        persistent_text = ""
-        for turn in persistent_history:
-            persistent_text += f"User: {turn.get('user', '')}\nAI: {turn.get('system', '')}\n"
-        
-        # Normalize current session history (if provided) to text.
-        session_text = ""
-        if session_history:
-            for turn in session_history:
-                # Here, each turn is assumed to be a list/tuple [user_msg, system_msg]
-                session_text += f"{turn[0]}\n{turn[1]}\n"
-                
-        # Combine both histories.
-        combined_history = persistent_text + "\n" + session_text
+    def _build_combined_history(self, user_id: str, session_history, mode: str) -> Tuple[str, str]:
+        """
+        Return the prompt history text and the full session text. Turns that no longer fit
+        are left out and folded into the summary on the post-processing queue, so the fold
+        is off the critical path and the next turn sees it.
+        """
+        with self.tracer.span("history"):
+            window = self._plan_history(user_id, session_history, mode)
+            history = window.render()
+            if window.to_fold:
+                self._defer(user_id, mode, self._fold_history, user_id, window, mode)
+            return history, window.session_text
+
+    def analyze_user_turn(self, user_input: str, signals: Optional[List[str]] = None) -> Dict[str, PredictionResult]:
+        """
+        Predict the per-turn signals of a user message (by default every signal in
+        USER_TURN_SIGNALS: mental state and dialogue bias) with a single JSON-mode call.
+        Signals a local classifier is confident about are not sent to the LLM.
+
+        Returns:
+            Dict[str, PredictionResult]: One result per signal.
+        """
+        results, signals = self._local_user_turn_signals(user_input, list(signals or USER_TURN_SIGNALS))
+        if signals:
+            response = self._classify("user_turn", self._user_turn_request(user_input, signals),
+                                      lambda content: self._user_turn_is_clear(content, signals))
+            results.update(self._parse_user_turn(response, signals))
+        return results
+
+    def predict_mental_state(self, user_input: str) -> PredictionResult:
+        """
+        Function to predict the user's mental state, locally when possible, otherwise using OpenAI's model.
+        """
+        return self.analyze_user_turn(user_input, ["mental_state"])["mental_state"]
+
+    def predict_content_bias(self, text: str) -> PredictionResult:
+        """
+        Function to predict bias in the retrieved content using OpenAI's model.
+        """
+        return self._classify("content_bias", self._content_bias_request(text), self._is_bias_label)
+
+    def _classify_bias_batch(self, batch: Dict[int, str]) -> Tuple[Dict[int, str], Optional[str]]:
+        """The parsed labels of a batch, and the error if the request failed after its retries."""
+        try:
+            response = self._create_completion(self._content_bias_batch_request(batch), "content_bias_batch")
+        except Exception as e:
+            print(f"Error predicting content bias batch: {e}")
+            return {}, f"content_bias_batch failed: {e}"
+        return self._parse_bias_batch(response.choices[0].message.content, batch), None
+
+    def predict_content_bias_batch(self, sentences: List[str], max_request_tokens: int = 2000,
+                                   max_batch_size: int = 40, max_retries: int = 2) -> List[PredictionResult]:
+        """
+        Predict the content bias of many sentences with few requests.
+
+        Sentences are numbered and packed into structured-JSON requests of at most
+        max_request_tokens input tokens; the labels are mapped back by number. Only sentences
+        whose label is missing or unparsable are retried, and those still failing after
+        max_retries fall back to predict_content_bias. Sentences of a request that failed
+        (after the resilience policy's retries) get its error instead.
+
+        Returns:
+            List[PredictionResult]: One result per sentence, as returned by predict_content_bias.
+        """
+        labels, pending = self._start_bias_batch(sentences)
+        for attempt in range(1, max_retries + 2):
+            if not pending:
+                break
+            batches = self._pack_bias_batches(sentences, pending, max_request_tokens, max_batch_size)
+            futures = [(batch, self._submit(self._classify_bias_batch, batch)) for batch in batches]
+            pending = [index for batch, future in futures
+                       for index in self._apply_bias_batch(labels, batch, *future.result(), attempt)]
+
+        for index in pending:
+            labels[index] = self.predict_content_bias(sentences[index])
+        return labels
+
+    def predict_chunk_content_bias(self, chunks: List[Tuple[str, str]]) -> PredictionResult:
+        """
+        Content bias of retrieved (chunk id, content) pairs, assembled from per-chunk labels.
+        Chunks without a stored label are classified with one batched call and their labels
+        are stored next to the RAG index, so every chunk is classified only once.
+        """
+        labels, missing = self._known_chunk_biases(chunks)
+        results = self.predict_content_bias_batch([text for _, text in missing]) if missing else []
+        labels.update(self._store_chunk_biases(missing, results))
+        return self._merge_chunk_biases(chunks, labels, results)
+
+    def annotate_chunk_biases(self) -> int:
+        """
+        Label every chunk of the RAG index that has no content bias label yet, e.g. after
+        build_or_update_index, so no turn waits for a bias call. Returns the number labelled.
+        """
+        if self.rag is None:
+            raise ValueError("annotate_chunk_biases requires a RAG system")
+        _, missing = self._known_chunk_biases(self.rag.all_chunks())
+        results = self.predict_content_bias_batch([text for _, text in missing]) if missing else []
+        return len(self._store_chunk_biases(missing, results))
+
+    def predict_dialogue_bias(self, text: str) -> PredictionResult:
+        """
+        Function to predict bias in the user dialogue using OpenAI's model.
+        """
+        return self.analyze_user_turn(text, ["dialogue_bias"])["dialogue_bias"]
+
+    def _prepare_standard_turn(self, user_id, user_input, session_history, mode) -> Tuple[Optional[Dict], Dict[str, PredictionResult], Optional[SemanticQuery]]:
+        """
+        Run everything a standard turn needs before generation and return the generation
+        request, the user turn signals and the semantic cache query (None without a cache).
+        The request is None when the semantic cache already holds the reply.
+        """
+        # The previous turn's bookkeeping must be stored before the history is read.
+        self.wait_for_pending(user_id, mode)
+        # The dialogue bias and mental state only depend on the user input, so they can
+        # run while the history is read and the content is retrieved.
+        user_turn_future = self._submit(self.analyze_user_turn, user_input)
+        embedding_future = self._submit(self._embed_query, user_input) if self._use_semantic_cache(user_input) else None
+
+        combined_history, session_text = self._build_combined_history(user_id, session_history, mode)
 
         # Retrieve user profile and dialogue history
-        profile = self.xml_class.get_user_profile(user_id, mode)
-        user_adaptation = [
-        f"- **Mental State:** {profile['mental_state']}"
-            ]
-        # Build dynamic prompt sections
-        for field, instructions in self.prompt_config.items():
-            value = profile.get(field, "")
-            user_adaptation.append(
-                f"- **{field.replace('_', ' ').title()}:** {value}\n    {instructions}"
-        )
-        user_adaptation_text = "\n".join([
-                "    " + line  # Add 4-space indentation to each line
-                for entry in user_adaptation 
-                for line in entry.split('\n')
-            ])
+        profile = self._xml_read("get_user_profile", user_id, mode)
 
         # Retrieve relevant content using the RAG module
-        retrieved_content = self.rag.retrieve_content(session_text) if self.rag else ""
+        with self.tracer.span("retrieval"):
+            chunks = self.rag.retrieve_chunks(session_text) if self.rag else []
+        retrieved_content = RAGSystem.join_chunks(chunks)
 
-        # Predict biases
-        content_bias_prediction = self.predict_content_bias(retrieved_content)
-        dialogue_bias_prediction = self.predict_dialogue_bias(user_input)
+        # A near-identical question with the same profile and content skips generation
+        semantic = self._semantic_lookup(embedding_future, self._semantic_scope(user_id, mode, profile, chunks))
+        if semantic is not None and semantic.reply is not None:
+            return None, user_turn_future.result(), semantic
+
+        # Predict biases; only chunks never annotated before cost a bias call. The content
+        # bias runs while the user turn call (dialogue bias and mental state) is still in
+        # flight, and the prompt is built once both are back.
+        content_bias_future = self._submit(self.predict_chunk_content_bias, chunks)
+        user_turn = user_turn_future.result()
+        content_bias_prediction = content_bias_future.result()
         
         # Update XML with bias predictions
-        self.xml_class.update_predicted_content_bias(user_id, content_bias_prediction, mode)
-        
+        if content_bias_prediction.ok:
+            self._defer(user_id, mode, self._xml_write, "update_predicted_content_bias",
+                        user_id, content_bias_prediction.value, mode)
 
-        # TODO: change the prompt for user-centric adaptation and also profile!
-        system_prompt = f"""
-            You are a conversational partner whose wisdom, intelligence, and empathy make your responses indistinguishable from a human's. Your primary goal is to provide precise, fact-based, and unbiased insights while engaging with users in a natural and human-like manner. In every interaction, consider the following guidelines:
+        system_prompt = self._remember_prompt(user_id, mode, self.prompts.standard(
+            retrieved_content, combined_history, content_bias_prediction.value_or(),
+            user_turn["dialogue_bias"].value_or(), profile
+        ))
+        return self._generation_request(system_prompt, user_input), user_turn, semantic
 
-            - **Grice's Maxims:**
-            - **Quantity:** Offer just the right amount of information—neither too little nor too much.
-            - **Quality:** Ensure every response is truthful and supported by accurate information.
-            - **Relevance:** Stay on topic and address the user's query directly.
-            - **Manner:** Communicate clearly and succinctly to avoid any confusion.
+    def _embed_query(self, user_input: str):
+        return self._query_embeddings().embed_query(user_input)
 
-            - **Contextual Awareness:**
-            - **Retrieved Content:** {retrieved_content}
-            - **Combined History:** {combined_history}
-            - **Bias Considerations:**
-                - Content Bias: {content_bias_prediction}
-                - Dialogue Bias: {dialogue_bias_prediction}
+    def _semantic_lookup(self, embedding_future: Optional[Future], scope: Tuple) -> Optional[SemanticQuery]:
+        """Look the query up in the semantic cache. The cache is skipped if the query cannot be embedded."""
+        if embedding_future is None:
+            return None
+        with self.tracer.span("semantic_cache") as span:
+            try:
+                embedding = embedding_future.result()
+            except Exception as e:
+                print(f"Error embedding query for the semantic cache: {e}")
+                return None
+            semantic = self.semantic_cache.lookup(embedding, scope)
+            span.set(hit=semantic.reply is not None)
+            return semantic
 
-            - **User-Centric Adaptation:**
-            {user_adaptation_text}
+    def _prepare_file_turn(self, user_id, user_input, file_analysis, session_history, mode) -> Tuple[Dict, Dict[str, PredictionResult]]:
+        """Run everything a file turn needs before generation and return the generation request."""
+        self.wait_for_pending(user_id, mode)
+        user_turn_future = self._submit(self.analyze_user_turn, user_input)
+        combined_history, _ = self._build_combined_history(user_id, session_history, mode)
 
-            Your responses should seamlessly integrate all of the above, ensuring that each interaction is both precise and warmly human.
-            """
-        
-        # Use the new interface: explicitly import and use ChatCompletion.create()
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_input},
-            ],
-            max_tokens=500,
-            temperature=0.7,
-        )
-        
-        reply = response.choices[0].message.content.strip()
-        
-        # Update mental state and dialogue history
-        new_state = self.predict_mental_state(user_input)
-        self.xml_class.update_dynamic_mental_state(user_id, new_state, mode)
-        self.xml_class.append_dialogue(user_id, user_input, reply, mode)
-        self.xml_class.update_predicted_user_dialogue_bias(user_id, dialogue_bias_prediction, mode)
-        return reply
+        profile = self._xml_read("get_user_profile", user_id, mode)
+        user_turn = user_turn_future.result()
 
-    def generate_llm_response_file(self, user_id, user_input, file_analysis, session_history=None, mode="file"):
-        persistent_history = self.xml_class.get_dialogue_history(user_id, mode)
-        persistent_text = ""
-        for turn in persistent_history:
-            persistent_text += f"User: {turn.get('user', '')}\nAI: {turn.get('system', '')}\n"
-        session_text = ""
-        if session_history:
-            for turn in session_history:
-                session_text += f"{turn[0]}\n{turn[1]}\n"
-        combined_history = persistent_text + "\n" + session_text
-
-        profile = self.xml_class.get_user_profile(user_id, mode)
-        dialogue_bias_prediction = self.predict_dialogue_bias(user_input)
-        user_adaptation = [
-        f"- **Mental State:** {profile['mental_state']}"
-            ]
-        # Build dynamic prompt sections
-        for field, instructions in self.prompt_config.items():
-            value = profile.get(field, "")
-            user_adaptation.append(
-                f"- **{field.replace('_', ' ').title()}:** {value}\n    {instructions}"
-        )
-        user_adaptation_text = "\n".join([
-                "    " + line  # Add 4-space indentation to each line
-                for entry in user_adaptation 
-                for line in entry.split('\n')
-            ])
+        system_prompt = self._remember_prompt(user_id, mode, self.prompts.file(
+            file_analysis, combined_history, user_turn["dialogue_bias"].value_or(), profile
+        ))
+        return self._generation_request(system_prompt, user_input), user_turn
 
+    def _stream_reply(self, user_id, user_input, request, user_turn, mode,
+                      semantic: Optional[SemanticQuery] = None, turn: Optional[TurnHandle] = None) -> Iterator[str]:
+        if request is None:
+            # Answered from the semantic cache
+            yield semantic.reply
+            self._commit_turn(turn)
+            self._defer(user_id, mode, self._finish_turn, user_id, user_input, semantic.reply, user_turn, mode)
+            return
+        started = time.monotonic()
+        # Started by hand: a with block would span the consumer's code between the deltas
+        model = self.models.route("generation", request).model
+        span = self.tracer.start_span("api.generation", user_id=user_id, mode=mode, model=model, stream=True)
+        parts = []
+        stream = None
+        try:
+            check_cancelled(turn)
+            stream = self._create_completion(request, "generation", stream=True, stream_options={"include_usage": True})
+            for chunk in stream:
+                # Closing the stream below aborts the generation of a cancelled turn
+                check_cancelled(turn)
+                if getattr(chunk, "usage", None) is not None:
+                    span.add_usage(chunk.usage)
+                    self._settle_usage(estimate_request_tokens(request), chunk.usage)
+                    self._record_usage("generation", model, chunk.usage, time.monotonic() - started,
+                                       user_id, mode)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            if stream is not None:
+                stream.close()
+            span.end()
+        reply = "".join(parts).strip()
+        self._cache_reply(semantic, reply)
 
-        system_prompt = f"""
-        You are a conversational partner whose wisdom, intelligence, and empathy make your responses indistinguishable from a human's. Your primary goal is to provide precise, fact-based, and unbiased insights while engaging with users in a natural and human-like manner. In every interaction, consider the following guidelines:
+        # State is only written once the whole reply is known.
+        self._commit_turn(turn)
+        self._defer(user_id, mode, self._finish_turn, user_id, user_input, reply, user_turn, mode)
 
-        - **Grice's Maxims:**
-        - **Quantity:** Offer just the right amount of information—neither too little nor too much.
-        - **Quality:** Ensure every response is truthful and supported by accurate information.
-        - **Relevance:** Stay on topic and address the user's query directly.
-        - **Manner:** Communicate clearly and succinctly to avoid any confusion.
+    def _finish_turn(self, user_id, user_input, reply, user_turn, mode) -> None:
+        self._record_turn(user_id, user_input, reply, user_turn["mental_state"], user_turn["dialogue_bias"], mode)
 
-        - **Contextual Awareness:**
-        - **Retrieved Content:** {file_analysis}
-        - **Combined History:** {combined_history}
-        - **Bias Considerations:**
-            - Dialogue Bias: {dialogue_bias_prediction}
+    def generate_llm_response(self, user_id, user_input, session_history=None, mode="standard"):
+        with self.tracer.turn("standard", user_id, mode), self.turns.turn(user_id, mode) as turn:
+            request, user_turn, semantic = self._prepare_standard_turn(
+                user_id, user_input, session_history, mode
+            )
+            if request is None:
+                reply = semantic.reply
+            else:
+                response = self._create_completion(request, "generation")
+                reply = response.choices[0].message.content.strip()
+                self._cache_reply(semantic, reply)
+        
+            # Update mental state and dialogue history
+            self._commit_turn(turn)
+            self._defer(user_id, mode, self._finish_turn, user_id, user_input, reply, user_turn, mode)
+            return reply
 
-        - **User-Centric Adaptation:**
-        {user_adaptation_text}
+    def stream_llm_response(self, user_id, user_input, session_history=None, mode="standard") -> Iterator[str]:
+        """
+        Streaming variant of generate_llm_response.
 
-        Your responses should seamlessly integrate all of the above, ensuring that each interaction is both precise and warmly human.
+        Yields the reply as text deltas while it is generated. The dialogue history, mental state
+        and dialogue bias are written once, after the last delta has been consumed.
         """
-        
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_input},
-            ],
-            max_tokens=500,
-            temperature=0.7,
-        )
-        reply = response.choices[0].message.content.strip()
-        new_state = self.predict_mental_state(user_input)
+        turn = self.tracer.start_turn("standard", user_id, mode)
+        handle = self.turns.start(user_id, mode)
+        try:
+            with self.tracer.scope(turn), handle.scope():
+                request, user_turn, semantic = self._prepare_standard_turn(
+                    user_id, user_input, session_history, mode
+                )
+            yield from self._stream_reply(user_id, user_input, request, user_turn, mode, semantic, handle)
+        finally:
+            self.turns.finish(handle)
+            turn.end()
+
+    def generate_llm_response_file(self, user_id, user_input, file_analysis, session_history=None, mode="file"):
+        with self.tracer.turn("file", user_id, mode), self.turns.turn(user_id, mode) as turn:
+            request, user_turn = self._prepare_file_turn(
+                user_id, user_input, file_analysis, session_history, mode
+            )
+            response = self._create_completion(request, "generation")
+            reply = response.choices[0].message.content.strip()
+
+            self._commit_turn(turn)
+            self._defer(user_id, mode, self._finish_turn, user_id, user_input, reply, user_turn, mode)
+            return reply
 
-        self.xml_class.update_dynamic_mental_state(user_id, new_state, mode)
-        self.xml_class.append_dialogue(user_id, user_input, reply, mode)
-        self.xml_class.update_predicted_user_dialogue_bias(user_id, dialogue_bias_prediction, mode)
-        return reply
+    def stream_llm_response_file(self, user_id, user_input, file_analysis, session_history=None, mode="file") -> Iterator[str]:
+        """
+        Streaming variant of generate_llm_response_file. See stream_llm_response.
+        """
+        turn = self.tracer.start_turn("file", user_id, mode)
+        handle = self.turns.start(user_id, mode)
+        try:
+            with self.tracer.scope(turn), handle.scope():
+                request, user_turn = self._prepare_file_turn(
+                    user_id, user_input, file_analysis, session_history, mode
+                )
+            yield from self._stream_reply(user_id, user_input, request, user_turn, mode, turn=handle)
+        finally:
+            self.turns.finish(handle)
+            turn.end()
     
     def analyze_grice_maxims(self, 
                              user_id: str,
@@ -328,46 +1129,24 @@ class LLMEngine:
         Raises:
             ValueError: If text is empty or API key is invalid.
         """
-        # Validate inputs
-        if not text.strip():
-            raise ValueError("Text cannot be empty.")
-
-        # System message defining the task
-        system_message = (
-            "You are a linguistics expert analyzing text for adherence to Grice's Cooperative Principle maxims: "
-            "Quantity (informative, not over/under), Quality (truthful, evidence-backed), "
-            "Relevance (stays on-topic), and Manner (clear, orderly, unambiguous)."
-        )
+        analysis = self.evaluate_grice_maxims(text, domain_context, guidelines)
+        if "error" not in analysis:
+            self.store_maxim_evaluation(user_id, analysis, mode)
+        return analysis
 
-        # User prompt with text, domain context, and guidelines
-        guidelines_str = ""
-        if guidelines:
-            guidelines_str = "\nCustom Guidelines:\n" + "\n".join(
-                [f"- {maxim}: {desc}" for maxim, desc in guidelines.items()]
-            )
+    def evaluate_grice_maxims(self, text: str, domain_context: str = "general",
+                              guidelines: Optional[Dict[str, str]] = None) -> Dict:
+        """
+        Score text against Grice's maxims like analyze_grice_maxims, without storing the result.
 
-        user_prompt = (
-            f"Analyze this text for Grice's maxims:\n\n{text}\n\n"
-            f"Domain Context: {domain_context}\n"
-            f"{guidelines_str}\n\n"
-            "Provide a JSON response with a numerical score (1-5) and concise explanation for each maxim. "
-            "Example format: {\"quantity\": {\"score\": 3, \"explanation\": \"...\"}, ...}"
-        )
+        Raises:
+            ValueError: If text is empty.
+        """
+        request = self._grice_maxims_request(text, domain_context, guidelines)
 
         try:
-            response = openai.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.0,
-                response_format={"type": "json_object"}  # Ensure JSON output
-            )
-            analysis = json.loads(response.choices[0].message.content)
-            self.xml_class.update_predicted_content_maxim_evaluation(user_id, analysis, mode)
-            return analysis
-        
+            response = self._create_completion(request, "maxim_evaluation")
+            return json.loads(response.choices[0].message.content)
         except Exception as e:
             return {"error": f"API request failed: {str(e)}"}
 
@@ -392,37 +1171,10 @@ class LLMEngine:
         Returns:
             Dict: Maxim evaluation with scores and explanations
         """
-        if not conversation_history:
-            raise ValueError("Conversation history cannot be empty")
-        if not latest_response.strip():
-            raise ValueError("LLM response cannot be empty")
-
-        # Extract relevant context (last 3 exchanges for efficiency)
-        # context_exchanges = "\n".join(
-        #     [f"User: {u}\nAI: {a}" for u, a in conversation_history[-3:]]
-        # )
-
-        system_prompt = """You are a dialogue quality analyzer. Evaluate the AI's final response 
-        in the provided conversation history against Grice's maxims, considering:\n
-        1. How well it maintains Quantity given the conversation flow\n
-        2. Truthfulness and evidence (Quality) based on available context\n
-        3. Relevance to both immediate and broader dialogue context\n
-        4. Clarity and structure (Manner) in the response"""
-
-        user_prompt = f"""Conversation Context:\n{conversation_history}\n\nLatest AI Response:\n{latest_response}\n\n
-        Domain: {domain_context}\nCustom Guidelines: {guidelines or 'None'}\n\n
-        Provide JSON evaluation with 1-5 scores and explanations for each maxim."""
+        request = self._response_evaluation_request(conversation_history, latest_response, domain_context, guidelines)
 
         try:
-            response = openai.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.0,
-                response_format={"type": "json_object"}
-            )
+            response = self._create_completion(request, "response_evaluation")
             return json.loads(response.choices[0].message.content)
         except Exception as e:
             return {"error": f"Evaluation failed: {str(e)}"}
@@ -451,58 +1203,50 @@ class LLMEngine:
             temperature: Creativity control
         
         Returns:
-            Dict containing response text and maxim evaluation
-        """
-        # Get persistent history and construct prompt (implementation details would depend on storage system)
-        persistent_history = self.xml_class.get_dialogue_history(user_id, mode)
-        persistent_text = ""
-        for turn in persistent_history:
-            persistent_text += f"User: {turn.get('user', '')}\nAI: {turn.get('system', '')}\n"
-        session_text = ""
-        if session_history:
-            for turn in session_history:
-                session_text += f"{turn[0]}\n{turn[1]}\n"
-        combined_history = persistent_text + "\n" + session_text
-        # ic(combined_history)
-        # Generate response using similar logic to reference code
-        system_message = f"""You are a conversational AI. Follow these guidelines:
-        - Grice's Maxims: Be informative but concise (Quantity), truthful (Quality), 
-        relevant to conversation history, and clear (Manner)
-        - Context: {file_context or 'No file context'}
-        - Grice's maxim evaluation: {file_analysis or 'No file analysis'}
-        - Domain: {domain_context}"""
-        
-        try:
-            response = openai.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_input}
-                ],
-                max_tokens=500,
-                temperature=0.0
-            )
-            llm_response = response.choices[0].message.content.strip()
-
-            new_state = self.predict_mental_state(user_input)
+            Dict containing response text and maxim evaluation. With a post-processing queue
+            the evaluation is a Future that resolves to the evaluation dict.
+        """
+        with self.tracer.turn("maxim", user_id, mode), self.turns.turn(user_id, mode) as turn:
+            self.wait_for_pending(user_id, mode)
+            mental_state_future = self._predict_mental_state_deferred(user_id, user_input, mode)
 
-            self.xml_class.update_dynamic_mental_state(user_id, new_state, mode)
-            self.xml_class.append_dialogue(user_id, user_input, llm_response, mode)
-            # Evaluate the response
-            maxim_evaluation = self.analyze_grice_maxims_in_response(
-                conversation_history=combined_history,
-                latest_response=llm_response,
-                domain_context=domain_context,
-            )
+            # Get persistent history and construct prompt (implementation details would depend on storage system)
+            combined_history, _ = self._build_combined_history(user_id, session_history, mode)
+            # ic(combined_history)
+            # Generate response using similar logic to reference code
+            system_message = self._build_maxim_system_message(file_context, file_analysis, domain_context)
+        
+            try:
+                response = self._create_completion(self._generation_request(system_message, user_input, temperature=0.0), "generation")
+                llm_response = response.choices[0].message.content.strip()
 
-            self.xml_class.update_predicted_LLM_dialogue_maxim_evaluations(user_id, maxim_evaluation, mode)
-            return llm_response,{
-                "response": llm_response,
-                "evaluation": maxim_evaluation,
-                "history": combined_history
-            }
+                # State updates and the response evaluation do not change the reply.
+                self._commit_turn(turn)
+                evaluation_future = self._defer(user_id, mode, self._finish_maxim_turn, user_id, user_input, llm_response,
+                                                mental_state_future, combined_history, domain_context, mode)
+                maxim_evaluation = evaluation_future if self.post_processing is not None else evaluation_future.result()
+                return llm_response,{
+                    "response": llm_response,
+                    "evaluation": maxim_evaluation,
+                    "history": combined_history
+                }
             
-        except Exception as e:
-            return {"error": f"Response generation failed: {str(e)}"}
+            except Exception as e:
+                return {"error": f"Response generation failed: {str(e)}"}
+
+    def _finish_maxim_turn(self, user_id, user_input, llm_response, mental_state_future, combined_history,
+                           domain_context, mode) -> Dict:
+        new_state = mental_state_future.result()
+        if new_state.ok:
+            self._xml_write("update_dynamic_mental_state", user_id, new_state.value, mode)
+        self._append_dialogue(user_id, user_input, llm_response, new_state, mode)
+        # Evaluate the response
+        maxim_evaluation = self.analyze_grice_maxims_in_response(
+            conversation_history=combined_history,
+            latest_response=llm_response,
+            domain_context=domain_context,
+        )
 
+        self._xml_write("update_predicted_LLM_dialogue_maxim_evaluations", user_id, maxim_evaluation, mode)
+        return maxim_evaluation
     
\ No newline at end of file
@@ -0,0 +1,212 @@
+import glob
+import json
+import math
+import os
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MENTAL_STATES = ("Engaged", "Curious", "Confused", "Bored", "Frustrated", "Satisfied")
+
+DEFAULT_MODEL_PATH = "generated_data/models/mental_state.json"
+
+# Phrases that point to a mental state. Each match is a vote for the state and a model feature.
+LEXICAL_CUES = {
+    "Engaged": ("interesting", "i see", "and then", "cool", "let's", "next", "go on", "tell me about"),
+    "Curious": ("?", "how does", "how do", "why", "what if", "tell me more", "more about", "explain",
+                "elaborate", "i wonder", "what about", "curious"),
+    "Confused": ("confused", "don't understand", "dont understand", "not sure what", "what do you mean",
+                 "lost", "unclear", "doesn't make sense", "makes no sense", "huh", "???"),
+    "Bored": ("whatever", "boring", "meh", "k", "i guess", "anyway", "fine", "sure", "ok"),
+    "Frustrated": ("not working", "doesn't work", "does not work", "useless", "wrong", "annoying", "ugh",
+                   "already told you", "again", "still not", "!!", "come on"),
+    "Satisfied": ("thanks", "thank you", "perfect", "great", "that helps", "got it", "awesome", "exactly",
+                  "makes sense", "helpful"),
+}
+
+
+def _cue_pattern(cue: str) -> str:
+    # Word boundaries where the cue starts or ends with a word character; repeated
+    # punctuation ("???") counts as one match.
+    start = r"(?<!\w)" if cue[0].isalnum() else ""
+    end = r"(?!\w)" if cue[-1].isalnum() else re.escape(cue[-1]) + "*"
+    return start + re.escape(cue) + end
+
+
+_CUE_PATTERNS = {
+    state: re.compile("|".join(_cue_pattern(cue) for cue in cues)) for state, cues in LEXICAL_CUES.items()
+}
+_TOKEN_PATTERN = re.compile(r"[a-z']+|[?!]")
+
+
+def normalize_state(label: Optional[str]) -> Optional[str]:
+    """Map a model answer such as 'curious.' to one of MENTAL_STATES, or None."""
+    label = re.sub(r"[^a-z]", "", (label or "").lower())
+    for state in MENTAL_STATES:
+        if state.lower() == label:
+            return state
+    return None
+
+
+def cue_counts(text: str) -> Counter:
+    """Number of cue phrases of each state found in text."""
+    text = text.lower()
+    return Counter({state: len(pattern.findall(text)) for state, pattern in _CUE_PATTERNS.items()}) + Counter()
+
+
+def extract_features(text: str) -> Counter:
+    """Unigrams, bigrams, cue matches and a length bucket of text."""
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    features = Counter(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    features.update({f"cue:{state}": count for state, count in cue_counts(text).items()})
+    length = len(tokens)
+    features["len:short" if length <= 3 else "len:medium" if length <= 15 else "len:long"] += 1
+    return features
+
+
+def load_labeled_turns(users_dir: str = "generated_data/users", source: str = "llm") -> List[Tuple[str, str]]:
+    """
+    Collect (user message, mental state) pairs from the dialogue turns stored in the user XMLs.
+    Only turns labelled by the given source are used, so the local model never trains on itself.
+    """
+    examples = []
+    for path in sorted(glob.glob(os.path.join(users_dir, "*.xml"))):
+        try:
+            root = ET.parse(path).getroot()
+        except (ET.ParseError, OSError) as e:
+            print(f"Error reading {path}: {e}")
+            continue
+        for turn in root.findall("./Dynamic/DialogueHistory/Turn"):
+            state = normalize_state(turn.get("mental_state"))
+            user = turn.find("User")
+            if state and turn.get("mental_state_source") == source and user is not None and user.text:
+                examples.append((user.text, state))
+    return examples
+
+
+class LexicalMentalStateClassifier:
+    """Cue-phrase voting. Needs no training data; confidence grows with the number of agreeing cues."""
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        counts = cue_counts(text)
+        if not counts:
+            return None, 0.0
+        state, votes = counts.most_common(1)[0]
+        return state, votes / (sum(counts.values()) + 1)
+
+
+class NaiveBayesMentalStateClassifier:
+    """Multinomial naive Bayes over extract_features; a linear model in log space."""
+    def __init__(self, alpha: float = 1.0):
+        self.alpha = alpha
+        self.class_counts = Counter()
+        self.feature_counts: Dict[str, Counter] = defaultdict(Counter)
+        self.feature_totals = Counter()
+        self.vocabulary = set()
+
+    @property
+    def examples(self) -> int:
+        return sum(self.class_counts.values())
+
+    def train(self, examples: Iterable[Tuple[str, str]]) -> "NaiveBayesMentalStateClassifier":
+        for text, state in examples:
+            features = extract_features(text)
+            self.class_counts[state] += 1
+            self.feature_counts[state].update(features)
+            self.feature_totals[state] += sum(features.values())
+            self.vocabulary.update(features)
+        return self
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        if not self.class_counts:
+            return {}
+        features = [(f, n) for f, n in extract_features(text).items() if f in self.vocabulary]
+        total = self.examples
+        vocabulary_size = len(self.vocabulary)
+        scores = {}
+        for state, count in self.class_counts.items():
+            denominator = math.log(self.feature_totals[state] + self.alpha * vocabulary_size)
+            score = math.log(count / total)
+            for feature, n in features:
+                score += n * (math.log(self.feature_counts[state][feature] + self.alpha) - denominator)
+            scores[state] = score
+        top = max(scores.values())
+        exp_scores = {state: math.exp(score - top) for state, score in scores.items()}
+        norm = sum(exp_scores.values())
+        return {state: value / norm for state, value in exp_scores.items()}
+
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        probabilities = self.predict_proba(text)
+        if not probabilities:
+            return None, 0.0
+        state = max(probabilities, key=probabilities.get)
+        return state, probabilities[state]
+
+    def to_dict(self) -> Dict:
+        return {
+            "alpha": self.alpha,
+            "class_counts": dict(self.class_counts),
+            "feature_counts": {state: dict(counts) for state, counts in self.feature_counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "NaiveBayesMentalStateClassifier":
+        model = cls(alpha=data.get("alpha", 1.0))
+        model.class_counts = Counter(data["class_counts"])
+        for state, counts in data["feature_counts"].items():
+            model.feature_counts[state] = Counter(counts)
+            model.feature_totals[state] = sum(counts.values())
+            model.vocabulary.update(counts)
+        return model
+
+
+class LocalMentalStateClassifier:
+    """
+    In-process mental-state classifier used before the LLM.
+
+    The naive Bayes model is used once it has been trained on at least min_examples labelled
+    turns, the cue lexicon before that. Predictions with a confidence below threshold are
+    escalated to the LLM by the engine.
+    """
+    def __init__(self, model: Optional[NaiveBayesMentalStateClassifier] = None, threshold: float = 0.65,
+                 min_examples: int = 50):
+        """
+        Args:
+            model: Trained model; the lexicon alone is used when None or too small.
+            threshold: Minimum confidence of a local answer.
+            min_examples: Training examples the model needs before it replaces the lexicon.
+        """
+        self.model = model
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self.lexicon = LexicalMentalStateClassifier()
+
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        """Return the predicted state and its confidence in [0, 1]."""
+        if self.model is not None and self.model.examples >= self.min_examples:
+            return self.model.predict(text)
+        return self.lexicon.predict(text)
+
+    @classmethod
+    def from_user_xml(cls, users_dir: str = "generated_data/users", **kwargs) -> "LocalMentalStateClassifier":
+        """Train on the LLM-labelled turns stored in the user XMLs."""
+        return cls(NaiveBayesMentalStateClassifier().train(load_labeled_turns(users_dir)), **kwargs)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH, **kwargs) -> "LocalMentalStateClassifier":
+        """Load a model saved with save(); falls back to the lexicon if there is none."""
+        try:
+            with open(path, "r") as f:
+                model = NaiveBayesMentalStateClassifier.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading mental state model: {e}")
+            model = None
+        return cls(model, **kwargs)
+
+    def save(self, path: str = DEFAULT_MODEL_PATH) -> None:
+        if self.model is None:
+            raise ValueError("No trained model to save.")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.model.to_dict(), f)
@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+from EchoMind.utils.helpers import count_tokens
+
+DEFAULT_MODEL = "gpt-4o"
+
+# Model of every stage when no routing rule applies
+DEFAULT_STAGE_MODELS = {
+    "user_turn": "gpt-4o-mini",
+    "content_bias": "gpt-4o",
+    "content_bias_batch": "gpt-4o",
+    "generation": "gpt-4o",
+    "summary": "gpt-3.5-turbo",
+    "maxim_evaluation": "gpt-4o",
+    "response_evaluation": "gpt-4o",
+}
+
+
+@dataclass
+class RoutingRule:
+    """
+    Send a stage to model while its input is at most max_input_tokens, and to escalate_to
+    when it is longer. With escalate_on_failure, a classifier answer that is missing or not
+    a valid label is asked again on escalate_to.
+    """
+    model: str
+    escalate_to: Optional[str] = None
+    max_input_tokens: Optional[int] = None
+    escalate_on_failure: bool = True
+
+
+# Opt-in policy: short classifier inputs go to the small model, long or unclear ones to gpt-4o
+DEFAULT_ROUTING = {
+    "user_turn": RoutingRule("gpt-4o-mini", escalate_to="gpt-4o", max_input_tokens=600),
+    "content_bias": RoutingRule("gpt-4o-mini", escalate_to="gpt-4o", max_input_tokens=600),
+    "content_bias_batch": RoutingRule("gpt-4o-mini", escalate_to="gpt-4o", max_input_tokens=2500),
+}
+
+# Used when no routing is given: the per-turn classifier runs on the small model and only
+# long or unclear inputs are escalated
+BASE_ROUTING = {"user_turn": DEFAULT_ROUTING["user_turn"]}
+
+
+@dataclass
+class RoutingDecision:
+    """The model chosen for one API call, why, and how the call went."""
+    stage: str
+    model: str
+    reason: str  # "default", "short_input", "long_input" or "escalated"
+    input_tokens: int
+    latency: Optional[float] = None
+    error: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+
+class ModelRegistry:
+    """
+    The models of the engines' stages and the policy routing calls between them.
+
+    Without routing rules every stage uses its configured model, so the engines behave as
+    with hard-coded names; by default only the user_turn stage is routed (BASE_ROUTING). A
+    rule sends a stage to a fast model for short inputs and escalates long ones (and, for
+    classifiers, unclear answers) to a stronger model. Every
+    decision is logged with its latency and error, in memory and optionally as JSON lines
+    in log_path; stats() summarizes the log per stage, model and reason.
+    """
+    def __init__(self, models: Optional[Dict[str, str]] = None, routing: Optional[Dict[str, RoutingRule]] = None,
+                 log_size: int = 1000, log_path: Optional[str] = None):
+        """
+        Args:
+            models: Model per stage, overriding DEFAULT_STAGE_MODELS.
+            routing: Routing rule per stage, e.g. DEFAULT_ROUTING. Stages without a rule always
+                use their model. BASE_ROUTING when None.
+            log_size: Decisions kept in memory.
+            log_path: File every decision is appended to as a JSON line. Not written when None.
+        """
+        self.models = {**DEFAULT_STAGE_MODELS, **(models or {})}
+        self.routing = dict(BASE_ROUTING if routing is None else routing)
+        self.log_path = log_path
+        self._log = deque(maxlen=log_size)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config_path: str, **kwargs) -> "ModelRegistry":
+        """
+        Load the registry from a JSON file such as
+
+            {"models": {"summary": "gpt-4o-mini"},
+             "routing": {"content_bias": {"model": "gpt-4o-mini", "escalate_to": "gpt-4o",
+                                          "max_input_tokens": 600}}}
+        """
+        with open(config_path, "r") as f:
+            config = json.load(f)
+        routing = None
+        if "routing" in config:
+            routing = {stage: RoutingRule(**rule) for stage, rule in config["routing"].items()}
+        return cls(models=config.get("models"), routing=routing, **kwargs)
+
+    def model_for(self, stage: str) -> str:
+        """The configured model of stage, before routing."""
+        return self.models.get(stage, DEFAULT_MODEL)
+
+    @staticmethod
+    def input_tokens(request: Dict) -> int:
+        return sum(count_tokens(message.get("content") or "") + 4 for message in request.get("messages", []))
+
+    def route(self, stage: str, request: Dict, escalated: bool = False) -> RoutingDecision:
+        """Choose the model of a request. An escalated request keeps the model it was escalated to."""
+        rule = self.routing.get(stage)
+        if escalated:
+            return RoutingDecision(stage, request.get("model") or self.model_for(stage), "escalated",
+                                   self.input_tokens(request))
+        if rule is None:
+            return RoutingDecision(stage, request.get("model") or self.model_for(stage), "default", 0)
+        tokens = self.input_tokens(request)
+        if rule.escalate_to and rule.max_input_tokens is not None and tokens > rule.max_input_tokens:
+            return RoutingDecision(stage, rule.escalate_to, "long_input", tokens)
+        return RoutingDecision(stage, rule.model, "short_input", tokens)
+
+    def escalation(self, stage: str, request: Dict) -> Optional[str]:
+        """The model to ask again after an unclear answer to request, or None if there is none."""
+        rule = self.routing.get(stage)
+        if rule is None or not rule.escalate_on_failure or not rule.escalate_to:
+            return None
+        return rule.escalate_to if self.route(stage, request).model != rule.escalate_to else None
+
+    @contextmanager
+    def routed(self, stage: str, request: Dict, escalated: bool = False) -> Iterator[RoutingDecision]:
+        """Route a request and log the decision with the latency and error of the with block."""
+        decision = self.route(stage, request, escalated)
+        started = time.monotonic()
+        try:
+            yield decision
+        except Exception as e:
+            decision.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            decision.latency = time.monotonic() - started
+            self._append(decision)
+
+    def _append(self, decision: RoutingDecision) -> None:
+        with self._lock:
+            self._log.append(decision)
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a") as f:
+                        f.write(json.dumps(asdict(decision)) + "\n")
+                except Exception as e:
+                    print(f"Error writing routing decision to {self.log_path}: {e}")
+
+    def decisions(self, stage: Optional[str] = None) -> List[RoutingDecision]:
+        """The logged decisions, oldest first, optionally of one stage."""
+        with self._lock:
+            return [decision for decision in self._log if stage is None or decision.stage == stage]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per "stage/model/reason": calls, errors, mean and p95 latency in ms and mean input
+        tokens. Input tokens are only counted for stages with a routing rule.
+        """
+        grouped = defaultdict(list)
+        for decision in self.decisions():
+            grouped[f"{decision.stage}/{decision.model}/{decision.reason}"].append(decision)
+        report = {}
+        for name, decisions in grouped.items():
+            latencies = sorted(decision.latency for decision in decisions)
+            report[name] = {
+                "calls": len(decisions),
+                "errors": sum(decision.error is not None for decision in decisions),
+                "mean_latency_ms": 1000 * sum(latencies) / len(latencies),
+                "p95_latency_ms": 1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+                "mean_input_tokens": sum(decision.input_tokens for decision in decisions) / len(decisions),
+            }
+        return report
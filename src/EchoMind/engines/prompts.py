@@ -0,0 +1,292 @@
+import string
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
+from EchoMind.utils.helpers import count_tokens
+
+# System prompt of standard (RAG) turns. Slots: retrieved_content, combined_history,
+# content_bias, dialogue_bias, user_adaptation.
+STANDARD_SYSTEM_PROMPT = """
+            You are a conversational partner whose wisdom, intelligence, and empathy make your responses indistinguishable from a human's. Your primary goal is to provide precise, fact-based, and unbiased insights while engaging with users in a natural and human-like manner. In every interaction, consider the following guidelines:
+
+            - **Grice's Maxims:**
+            - **Quantity:** Offer just the right amount of information—neither too little nor too much.
+            - **Quality:** Ensure every response is truthful and supported by accurate information.
+            - **Relevance:** Stay on topic and address the user's query directly.
+            - **Manner:** Communicate clearly and succinctly to avoid any confusion.
+
+            - **Contextual Awareness:**
+            - **Retrieved Content:** {retrieved_content}
+            - **Combined History:** {combined_history}
+            - **Bias Considerations:**
+                - Content Bias: {content_bias}
+                - Dialogue Bias: {dialogue_bias}
+
+            - **User-Centric Adaptation:**
+            {user_adaptation}
+
+            Your responses should seamlessly integrate all of the above, ensuring that each interaction is both precise and warmly human.
+            """
+
+# System prompt of file turns. Slots: file_analysis, combined_history, dialogue_bias, user_adaptation.
+FILE_SYSTEM_PROMPT = """
+        You are a conversational partner whose wisdom, intelligence, and empathy make your responses indistinguishable from a human's. Your primary goal is to provide precise, fact-based, and unbiased insights while engaging with users in a natural and human-like manner. In every interaction, consider the following guidelines:
+
+        - **Grice's Maxims:**
+        - **Quantity:** Offer just the right amount of information—neither too little nor too much.
+        - **Quality:** Ensure every response is truthful and supported by accurate information.
+        - **Relevance:** Stay on topic and address the user's query directly.
+        - **Manner:** Communicate clearly and succinctly to avoid any confusion.
+
+        - **Contextual Awareness:**
+        - **Retrieved Content:** {file_analysis}
+        - **Combined History:** {combined_history}
+        - **Bias Considerations:**
+            - Dialogue Bias: {dialogue_bias}
+
+        - **User-Centric Adaptation:**
+        {user_adaptation}
+
+        Your responses should seamlessly integrate all of the above, ensuring that each interaction is both precise and warmly human.
+        """
+
+# Layouts of the generation prompt. "inline" puts everything into one system message built
+# from the templates above. "cache_friendly" orders the messages from most to least stable
+# (static instructions, user profile, history, then what changes every turn: mental state,
+# retrieval and biases) so that the provider's prompt cache can reuse the prefix of earlier
+# turns, which grows with the history.
+PROMPT_LAYOUTS = ("inline", "cache_friendly")
+
+# Static instructions of the cache_friendly layout; the same bytes for every user and turn
+# of a schema config. Slot: adaptation_instructions.
+CACHE_FRIENDLY_INSTRUCTIONS = """You are a conversational partner whose wisdom, intelligence, and empathy make your responses indistinguishable from a human's. Your primary goal is to provide precise, fact-based, and unbiased insights while engaging with users in a natural and human-like manner. In every interaction, consider the following guidelines:
+
+- **Grice's Maxims:**
+- **Quantity:** Offer just the right amount of information—neither too little nor too much.
+- **Quality:** Ensure every response is truthful and supported by accurate information.
+- **Relevance:** Stay on topic and address the user's query directly.
+- **Manner:** Communicate clearly and succinctly to avoid any confusion.
+
+- **Contextual Awareness:** The following system messages give the user profile, the combined conversation history, and the mental state, retrieved content and bias considerations of this turn.
+
+- **User-Centric Adaptation:** Adapt to the profile values as follows.
+{adaptation_instructions}
+
+Your responses should seamlessly integrate all of the above, ensuring that each interaction is both precise and warmly human."""
+
+PROFILE_SECTION = "**User Profile:**\n{profile}"
+HISTORY_SECTION = "**Combined History:**\n{combined_history}"
+STANDARD_CONTEXT_SECTION = """**Current Mental State:** {mental_state}
+
+**Retrieved Content:**
+{retrieved_content}
+
+**Bias Considerations:**
+- Content Bias: {content_bias}
+- Dialogue Bias: {dialogue_bias}"""
+FILE_CONTEXT_SECTION = """**Current Mental State:** {mental_state}
+
+**Retrieved Content:**
+{file_analysis}
+
+**Bias Considerations:**
+- Dialogue Bias: {dialogue_bias}"""
+
+
+class CompiledTemplate:
+    """A str.format template split once into literal parts and slot names."""
+    def __init__(self, template: str):
+        self.parts: List[Tuple[str, Optional[str]]] = [
+            (literal, field) for literal, field, _, _ in string.Formatter().parse(template)
+        ]
+        self.fields = [field for _, field in self.parts if field is not None]
+
+    def render(self, **slots) -> str:
+        pieces = []
+        for literal, field in self.parts:
+            pieces.append(literal)
+            if field is not None:
+                pieces.append(str(slots[field]))
+        return "".join(pieces)
+
+
+class RenderedPrompt:
+    """
+    A rendered system prompt as one or more system messages; text joins them.
+    The token count is computed on first access.
+    """
+    def __init__(self, messages: List[str], model: str = "gpt-4o"):
+        self.messages = [{"role": "system", "content": content} for content in messages]
+        self.text = "\n\n".join(messages)
+        self.model = model
+        self._tokens = None
+
+    @property
+    def tokens(self) -> int:
+        if self._tokens is None:
+            self._tokens = count_tokens(self.text, self.model)
+        return self._tokens
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class PromptCompiler:
+    """
+    Builds the system prompts of one schema config.
+
+    The static templates are compiled once, and the user-adaptation block is memoized per
+    profile tuple (the values of the configured fields, and in the inline layout the mental
+    state), so a turn only fills in the dynamic slots.
+    """
+    def __init__(self, prompt_config: Dict[str, str], model: str = "gpt-4o", max_profiles: int = 256,
+                 layout: str = "inline"):
+        """
+        Args:
+            prompt_config: The "prompt" section of the schema config: field -> instructions.
+            model: Model whose tokenizer is used for RenderedPrompt.tokens.
+            max_profiles: Number of adaptation blocks kept.
+            layout: One of PROMPT_LAYOUTS.
+        """
+        if layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"Unknown prompt layout {layout!r}, expected one of {PROMPT_LAYOUTS}")
+        self.prompt_config = dict(prompt_config)
+        self.model = model
+        self.max_profiles = max_profiles
+        self.layout = layout
+        self.standard_template = CompiledTemplate(STANDARD_SYSTEM_PROMPT)
+        self.file_template = CompiledTemplate(FILE_SYSTEM_PROMPT)
+        self.instructions = CompiledTemplate(CACHE_FRIENDLY_INSTRUCTIONS).render(
+            adaptation_instructions="\n".join(
+                f"- **{field.replace('_', ' ').title()}:**\n    {instructions}"
+                for field, instructions in self.prompt_config.items()
+            )
+        )
+        self.profile_template = CompiledTemplate(PROFILE_SECTION)
+        self.history_template = CompiledTemplate(HISTORY_SECTION)
+        self.standard_context_template = CompiledTemplate(STANDARD_CONTEXT_SECTION)
+        self.file_context_template = CompiledTemplate(FILE_CONTEXT_SECTION)
+        self._adaptations = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def profile_key(self, profile: Dict) -> Tuple:
+        key = tuple(profile.get(field, "") for field in self.prompt_config)
+        if self.layout == "cache_friendly":
+            return key  # The mental state goes into the per-turn tail
+        return (profile.get("mental_state"),) + key
+
+    def adaptation(self, profile: Dict) -> str:
+        """
+        The per-profile part of the prompt: the indented user-adaptation block in the inline
+        layout, the profile values without the mental state in the cache_friendly layout.
+        """
+        key = self.profile_key(profile)
+        with self._lock:
+            text = self._adaptations.get(key)
+            if text is not None:
+                self._adaptations.move_to_end(key)
+                self.hits += 1
+                return text
+            self.misses += 1
+        text = self._render_adaptation(profile)
+        with self._lock:
+            self._adaptations[key] = text
+            if len(self._adaptations) > self.max_profiles:
+                self._adaptations.popitem(last=False)
+        return text
+
+    def _render_adaptation(self, profile: Dict) -> str:
+        if self.layout == "cache_friendly":
+            lines = [f"- **{field.replace('_', ' ').title()}:** {profile.get(field, '')}" for field in self.prompt_config]
+            return self.profile_template.render(profile="\n".join(lines))
+        user_adaptation = [f"- **Mental State:** {profile['mental_state']}"]
+        for field, instructions in self.prompt_config.items():
+            value = profile.get(field, "")
+            user_adaptation.append(f"- **{field.replace('_', ' ').title()}:** {value}\n    {instructions}")
+        # Add 4-space indentation to each line
+        return "\n".join("    " + line for entry in user_adaptation for line in entry.split("\n"))
+
+    def standard(self, retrieved_content, combined_history, content_bias, dialogue_bias, profile: Dict) -> RenderedPrompt:
+        """System prompt of a standard turn."""
+        if self.layout == "cache_friendly":
+            return self._layered(profile, combined_history, self.standard_context_template.render(
+                mental_state=profile["mental_state"], retrieved_content=retrieved_content,
+                content_bias=content_bias, dialogue_bias=dialogue_bias
+            ))
+        return RenderedPrompt([self.standard_template.render(
+            retrieved_content=retrieved_content, combined_history=combined_history, content_bias=content_bias,
+            dialogue_bias=dialogue_bias, user_adaptation=self.adaptation(profile)
+        )], self.model)
+
+    def file(self, file_analysis, combined_history, dialogue_bias, profile: Dict) -> RenderedPrompt:
+        """System prompt of a file turn."""
+        if self.layout == "cache_friendly":
+            return self._layered(profile, combined_history, self.file_context_template.render(
+                mental_state=profile["mental_state"], file_analysis=file_analysis, dialogue_bias=dialogue_bias
+            ))
+        return RenderedPrompt([self.file_template.render(
+            file_analysis=file_analysis, combined_history=combined_history, dialogue_bias=dialogue_bias,
+            user_adaptation=self.adaptation(profile)
+        )], self.model)
+
+    def _layered(self, profile: Dict, combined_history: str, context: str) -> RenderedPrompt:
+        # Most stable first: a change only invalidates the cached prefix from its message on.
+        # The history only grows between turns, so the prefix up to it is reused; everything
+        # that changes per turn is in context, after it.
+        return RenderedPrompt([
+            self.instructions,
+            self.adaptation(profile),
+            self.history_template.render(combined_history=combined_history),
+            context,
+        ], self.model)
+
+    def stats(self) -> Dict[str, int]:
+        return {"adaptation_hits": self.hits, "adaptation_misses": self.misses, "profiles": len(self._adaptations)}
+
+
+class PromptCacheStats:
+    """
+    Prompt tokens, provider-cached prompt tokens and latency of the API calls, per stage.
+    The cache-hit rows show what the provider's prompt cache saves in latency and cost.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = defaultdict(lambda: {
+            "calls": 0, "prompt_tokens": 0, "cached_tokens": 0,
+            "cache_hit_calls": 0, "cache_hit_latency": 0.0, "cache_miss_latency": 0.0,
+        })
+
+    def record(self, stage: str, usage, latency: float) -> None:
+        """Add the usage of a completion (response.usage) that took latency seconds."""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        with self._lock:
+            entry = self._stages[stage]
+            entry["calls"] += 1
+            entry["prompt_tokens"] += usage.prompt_tokens or 0
+            entry["cached_tokens"] += cached
+            if cached:
+                entry["cache_hit_calls"] += 1
+                entry["cache_hit_latency"] += latency
+            else:
+                entry["cache_miss_latency"] += latency
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per stage: calls, token totals, cached share and mean latency with and without a cache hit."""
+        report = {}
+        with self._lock:
+            for stage, entry in self._stages.items():
+                misses = entry["calls"] - entry["cache_hit_calls"]
+                report[stage] = {
+                    "calls": entry["calls"],
+                    "prompt_tokens": entry["prompt_tokens"],
+                    "cached_tokens": entry["cached_tokens"],
+                    "cached_ratio": entry["cached_tokens"] / entry["prompt_tokens"] if entry["prompt_tokens"] else 0.0,
+                    "mean_latency_cache_hit": entry["cache_hit_latency"] / entry["cache_hit_calls"] if entry["cache_hit_calls"] else None,
+                    "mean_latency_cache_miss": entry["cache_miss_latency"] / misses if misses else None,
+                }
+        return report
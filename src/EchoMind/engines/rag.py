@@ -1,23 +1,67 @@
 
 import os
+import json
 import hashlib
+import threading
 from pathlib import Path
 from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.embeddings import Embeddings
+from typing import Dict, List, Optional, Tuple
+from EchoMind.utils.helpers import count_tokens
+from EchoMind.utils.rate_limiter import TokenBucketRateLimiter, get_rate_limiter
+from EchoMind.utils.client_factory import ClientFactory, get_client_factory
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """Embeddings wrapper that sends every request through the EchoMind rate limiter"""
+    def __init__(self, embeddings: Embeddings, rate_limiter: Optional[TokenBucketRateLimiter] = None):
+        self.embeddings = embeddings
+        self._rate_limiter = rate_limiter
+
+    @property
+    def rate_limiter(self) -> TokenBucketRateLimiter:
+        return self._rate_limiter or get_rate_limiter()
+
+    def _tokens(self, texts: List[str]) -> int:
+        return sum(count_tokens(text) for text in texts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.rate_limiter.acquire(self._tokens(texts))
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.rate_limiter.acquire(self._tokens([text]))
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await self.rate_limiter.acquire_async(self._tokens(texts))
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await self.rate_limiter.acquire_async(self._tokens([text]))
+        return await self.embeddings.aembed_query(text)
+
 
 class RAGSystem:
-    def __init__(self, docs_path: str, index_path: str = "faiss_index"):
+    def __init__(self, docs_path: str, index_path: str = "faiss_index",
+                 rate_limiter: Optional[TokenBucketRateLimiter] = None, client_factory: Optional[ClientFactory] = None):
         """
         Args:
             docs_path: Path to documents directory (relative to calling script)
             index_path: Path to save/load FAISS index
+            rate_limiter: Limiter for embedding requests. Defaults to the process-wide limiter.
+            client_factory: Source of the embeddings client. Defaults to the process-wide factory,
+                whose connection pool the engines share.
         """
         self.docs_path = Path(docs_path)
         self.index_path = Path(index_path)
         self.index = None
-        self.embeddings = OpenAIEmbeddings()
+        self.embeddings = RateLimitedEmbeddings((client_factory or get_client_factory()).embeddings(), rate_limiter)
+        # Content bias label per chunk ID, stored next to the FAISS docstore
+        self.chunk_biases: Dict[str, str] = {}
+        self._bias_lock = threading.Lock()
         
         if not self.docs_path.exists():
             raise FileNotFoundError(f"Documents directory not found: {self.docs_path}")
@@ -45,6 +89,7 @@ class RAGSystem:
                 allow_dangerous_deserialization=True
             )
             existing_hashes = self._get_existing_hashes()
+            self._load_chunk_biases()
         else:
             self.index = None
             existing_hashes = set()
@@ -91,10 +136,76 @@ class RAGSystem:
         print(f"Index saved to {self.index_path}")
         return self.index
 
-    def retrieve_content(self, query: str, k: int = 5) -> str:
-        """Search index for relevant content"""
+    @property
+    def chunk_biases_path(self) -> Path:
+        return self.index_path / "chunk_biases.json"
+
+    def _load_chunk_biases(self) -> None:
+        if not self.chunk_biases_path.exists():
+            return
+        try:
+            with open(self.chunk_biases_path, "r") as f:
+                labels = json.load(f)
+        except Exception as e:
+            print(f"Error loading chunk bias annotations: {e}")
+            return
+        with self._bias_lock:
+            self.chunk_biases = labels
+
+    def get_chunk_biases(self, chunk_ids: List[str]) -> Dict[str, str]:
+        """Stored content bias labels of the given chunks; chunks not annotated yet are left out."""
+        with self._bias_lock:
+            return {chunk_id: self.chunk_biases[chunk_id] for chunk_id in chunk_ids if chunk_id in self.chunk_biases}
+
+    def set_chunk_biases(self, labels: Dict[str, str]) -> None:
+        """Add content bias labels by chunk ID and save them next to the index."""
+        if not labels:
+            return
+        with self._bias_lock:
+            self.chunk_biases.update(labels)
+            try:
+                self.index_path.mkdir(parents=True, exist_ok=True)
+                temporary = self.chunk_biases_path.with_suffix(".tmp")
+                with open(temporary, "w") as f:
+                    json.dump(self.chunk_biases, f)
+                os.replace(temporary, self.chunk_biases_path)
+            except Exception as e:
+                print(f"Error saving chunk bias annotations: {e}")
+
+    def all_chunks(self) -> List[Tuple[str, str]]:
+        """(chunk id, content) of every chunk in the index, e.g. to annotate them up front"""
         if not self.index:
             raise ValueError("Index not initialized. Call build_or_update_index() first")
-            
+        return [(chunk_id, doc.page_content) for chunk_id, doc in self.index.docstore._dict.items()]
+
+    def _chunk_id(self, doc) -> str:
+        """ID of a retrieved chunk: its docstore key, which is the chunk hash."""
+        return getattr(doc, "id", None) or self._compute_chunk_hash(doc)
+
+    def retrieve_chunks(self, query: str, k: int = 5) -> List[Tuple[str, str]]:
+        """Search index for relevant chunks and return (chunk id, content) pairs"""
+        if not self.index:
+            raise ValueError("Index not initialized. Call build_or_update_index() first")
+
         results = self.index.similarity_search(query, k=k)
-        return "\n---\n".join(doc.page_content for doc in results) if results else ""
\ No newline at end of file
+        return [(self._chunk_id(doc), doc.page_content) for doc in results]
+
+    async def aretrieve_chunks(self, query: str, k: int = 5) -> List[Tuple[str, str]]:
+        """Async variant of retrieve_chunks, embedding the query without blocking the event loop"""
+        if not self.index:
+            raise ValueError("Index not initialized. Call build_or_update_index() first")
+
+        results = await self.index.asimilarity_search(query, k=k)
+        return [(self._chunk_id(doc), doc.page_content) for doc in results]
+
+    @staticmethod
+    def join_chunks(chunks: List[Tuple[str, str]]) -> str:
+        return "\n---\n".join(content for _, content in chunks)
+
+    def retrieve_content(self, query: str, k: int = 5) -> str:
+        """Search index for relevant content"""
+        return self.join_chunks(self.retrieve_chunks(query, k))
+
+    async def aretrieve_content(self, query: str, k: int = 5) -> str:
+        """Async variant of retrieve_content, embedding the query without blocking the event loop"""
+        return self.join_chunks(await self.aretrieve_chunks(query, k))
@@ -0,0 +1,182 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+DEFAULT_CACHE_DIR = "generated_data/cache"
+
+
+class ResultCache:
+    """
+    Content-addressed cache for deterministic model results (e.g. classifier labels).
+
+    Entries are keyed by a hash of the full request (model, system prompt, parameters and input).
+    An in-memory LRU tier is always used; an on-disk tier under DEFAULT_CACHE_DIR keeps results
+    across restarts. Its files and sizes are indexed in memory once at startup, and once the tier
+    grows past max_disk_bytes the least recently used files are removed until it is back under
+    low_water of the limit, so a full cache does not evict on every store. Files are read,
+    written and removed outside the lock.
+    """
+    def __init__(self, max_entries: int = 1024, disk_dir: Optional[str] = DEFAULT_CACHE_DIR,
+                 max_disk_bytes: int = 50 * 1024 * 1024, low_water: float = 0.9):
+        """
+        Args:
+            max_entries: Number of results kept in memory.
+            disk_dir: Directory of the on-disk tier. Pass None for a memory-only cache that is
+                lost on restart.
+            max_disk_bytes: Size limit of the on-disk tier.
+            low_water: Fraction of max_disk_bytes the on-disk tier is trimmed to when it
+                exceeds the limit.
+        """
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.low_water = low_water
+        self._memory = OrderedDict()
+        # Key -> file size of the on-disk tier, least recently used first
+        self._disk = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk_bytes = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(request: Dict[str, Any]) -> str:
+        """Hash a chat completion request (model, messages and parameters) into a cache key."""
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_files(self):
+        for dirpath, _, filenames in os.walk(self.disk_dir):
+            for filename in filenames:
+                if filename.endswith(".json"):
+                    yield os.path.join(dirpath, filename)
+
+    def _load_disk_index(self) -> None:
+        entries = []
+        for path in self._disk_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, os.path.basename(path)[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+            if key not in self._disk:
+                self.misses += 1
+                return None
+            self._disk.move_to_end(key)
+
+        path = self._disk_path(key)
+        try:
+            with open(path, "r") as f:
+                value = json.load(f)["value"]
+            os.utime(path)  # Keeps the recency of the entry across restarts
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                # Removed or unreadable since it was indexed
+                self._forget_disk(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            self._remember(key, value)
+            self.disk_hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a JSON-serializable value under key."""
+        data = json.dumps({"value": value}).encode() if self.disk_dir else None
+        with self._lock:
+            self._remember(key, value)
+            if not self.disk_dir:
+                return
+            self._forget_disk(key)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            evicted = self._evict_disk() if self._disk_bytes > self.max_disk_bytes else []
+        self._write_disk(key, data)
+        for evicted_key in evicted:
+            try:
+                os.remove(self._disk_path(evicted_key))
+            except OSError:
+                pass
+
+    def _remember(self, key: str, value: Any) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _forget_disk(self, key: str) -> None:
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        path = self._disk_path(key)
+        # Written under a name of its own and moved into place, so readers never see a partial file
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except OSError as e:
+            print(f"Error writing cache entry {path}: {e}")
+            with self._lock:
+                self._forget_disk(key)
+
+    def _evict_disk(self) -> List[str]:
+        """Drop the least recently used entries from the index down to the low-water mark; returns their keys."""
+        target = self.max_disk_bytes * self.low_water
+        evicted = []
+        while self._disk_bytes > target and len(self._disk) > 1:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            evicted.append(key)
+        return evicted
+
+    def clear(self) -> None:
+        """Drop all entries from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._disk.clear()
+            self._disk_bytes = 0
+        if self.disk_dir:
+            for path in list(self._disk_files()):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters and current size of both tiers."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
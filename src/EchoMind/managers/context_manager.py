@@ -0,0 +1,159 @@
+import hashlib
+from collections import Counter
+from typing import List, Dict, Optional, Tuple
+from EchoMind.utils.helpers import count_tokens
+
+# Prefixes the chat UIs put in front of session messages.
+DECORATION_PREFIXES = ("👤", "🤖")
+
+
+def strip_decoration(text: Optional[str]) -> str:
+    """Remove the 👤/🤖 decoration of a chat UI message."""
+    text = (text or "").strip()
+    for prefix in DECORATION_PREFIXES:
+        if text.startswith(prefix):
+            return text[len(prefix):].strip()
+    return text
+
+
+def merge_session_history(persistent_turns: List[Dict[str, str]], session_history) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Return the session turns that are not already part of the persistent history,
+    as undecorated {'user', 'system'} dicts, and the number of duplicates dropped.
+    """
+    stored = Counter(
+        (strip_decoration(turn.get("user")), strip_decoration(turn.get("system")))
+        for turn in persistent_turns
+    )
+    new_turns, duplicates = [], 0
+    for turn in session_history or []:
+        # Each session turn is a list/tuple [user_msg, system_msg]
+        key = (strip_decoration(turn[0]), strip_decoration(turn[1]))
+        if stored[key] > 0:
+            stored[key] -= 1
+            duplicates += 1
+        else:
+            new_turns.append({"user": key[0], "system": key[1]})
+    return new_turns, duplicates
+
+
+def render_turn(turn: Dict[str, str]) -> str:
+    """Render a persistent dialogue turn the way it appears in the prompt history."""
+    return f"User: {turn.get('user', '')}\nAI: {turn.get('system', '')}\n"
+
+
+def turns_digest(turns: List[Dict[str, str]]) -> str:
+    """Fingerprint of turns, used to recognise session turns that are already summarized."""
+    return hashlib.sha1("".join(render_turn(turn) for turn in turns).encode("utf-8")).hexdigest() if turns else ""
+
+
+class ContextWindow:
+    """
+    The part of a conversation that goes into the prompt.
+
+    turns[summarized_turns:start] are older turns that still have to be folded into the
+    rolling summary, turns[start:] are kept verbatim. session_turns are the turns of the
+    current session that are not stored yet; the same applies to them with
+    summarized_session_turns and session_start. session_text is the whole session, which
+    is still used as the retrieval query.
+    """
+    def __init__(self, turns: List[Dict[str, str]], session_turns: List[Dict[str, str]], summary: str = "",
+                 summarized_turns: int = 0, start: Optional[int] = None, session_start: int = 0,
+                 summarized_session_turns: int = 0):
+        self.turns = turns
+        self.session_turns = session_turns
+        self.summary = summary
+        self.summarized_turns = summarized_turns
+        self.start = summarized_turns if start is None else start
+        self.summarized_session_turns = summarized_session_turns
+        self.session_start = max(session_start, summarized_session_turns)
+        self.session_text = ""
+
+    @property
+    def to_fold(self) -> List[Dict[str, str]]:
+        """Turns that fell out of the verbatim window and are not in the summary yet."""
+        return (self.turns[self.summarized_turns:self.start]
+                + self.session_turns[self.summarized_session_turns:self.session_start])
+
+    @property
+    def session_digest(self) -> str:
+        """Fingerprint of the session turns covered by the summary."""
+        return turns_digest(self.session_turns[:self.summarized_session_turns])
+
+    def fold(self, summary: str) -> None:
+        """Replace the summary by one that also covers to_fold."""
+        self.summary = summary
+        self.summarized_turns = self.start
+        self.summarized_session_turns = self.session_start
+
+    def render(self) -> str:
+        persistent_text = "".join(render_turn(turn) for turn in self.turns[self.start:])
+        if self.summary:
+            persistent_text = f"Summary of earlier conversation: {self.summary}\n" + persistent_text
+        return persistent_text + "\n" + "".join(render_turn(turn) for turn in self.session_turns[self.session_start:])
+
+
+class ContextWindowManager:
+    """
+    Fits the conversation history into a token budget.
+
+    The most recent turns are kept verbatim; older turns are folded into a rolling summary.
+    Folding is incremental: only turns that newly left the window are summarized, together
+    with the previous summary, and the number of summarized turns is stored next to it.
+    Session turns that do not fit are folded the same way; a digest of the ones already
+    summarized is stored so that they are not folded twice.
+    """
+    def __init__(self, token_budget: int = 2000, min_recent_turns: int = 2, model: str = "gpt-4o"):
+        """
+        Args:
+            token_budget: Maximum number of history tokens (summary + verbatim turns) in a prompt.
+            min_recent_turns: Most recent turns, stored or from the current session, always kept
+                verbatim, even above the budget.
+            model: Model whose tokenizer is used for counting.
+        """
+        self.token_budget = token_budget
+        self.min_recent_turns = min_recent_turns
+        self.model = model
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def plan(self, turns: List[Dict[str, str]], session_turns: List[Dict[str, str]], summary: str = "",
+             summarized_turns: int = 0, summarized_session_turns: int = 0,
+             session_digest: str = "") -> ContextWindow:
+        """
+        Choose which turns stay verbatim; the returned window tells which ones must be folded.
+        summarized_session_turns only counts if session_digest matches those session turns.
+        """
+        summarized_turns = min(summarized_turns, len(turns))
+        if (summarized_session_turns > len(session_turns)
+                or turns_digest(session_turns[:summarized_session_turns]) != session_digest):
+            summarized_session_turns = 0
+        remaining = self.token_budget - self.count(summary)
+
+        # Walk back from the newest turn, the current session being the most recent part of the
+        # conversation. The newest min_recent_turns stay verbatim even above the budget; once a
+        # turn does not fit, it and every older turn are folded.
+        kept = 0
+        full = False
+        session_start = len(session_turns)
+        for i in range(len(session_turns) - 1, summarized_session_turns - 1, -1):
+            cost = self.count(render_turn(session_turns[i]))
+            if kept >= self.min_recent_turns and cost > remaining:
+                full = True
+                break
+            remaining -= cost
+            kept += 1
+            session_start = i
+
+        start = len(turns)
+        for i in range(len(turns) - 1, summarized_turns - 1, -1):
+            cost = self.count(render_turn(turns[i]))
+            if full or (kept >= self.min_recent_turns and cost > remaining):
+                break
+            remaining -= cost
+            kept += 1
+            start = i
+
+        return ContextWindow(turns, session_turns, summary, summarized_turns, start, session_start,
+                             summarized_session_turns)
@@ -0,0 +1,162 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Hashable, Iterable, List, Optional
+
+import numpy as np
+
+
+@dataclass
+class SemanticQuery:
+    """A query looked up in a SemanticResponseCache; reply is set on a hit."""
+    embedding: np.ndarray
+    scope: Hashable
+    reply: Optional[str] = None
+    similarity: float = 0.0
+
+
+class SemanticResponseCache:
+    """
+    Cache of generated replies, looked up by the cosine similarity of the query embedding.
+
+    A reply is only reused within its scope, e.g. the user, the profile tuple and the IDs of
+    the retrieved chunks, so a near-identical question gets the cached answer only if it was
+    asked in the same conversation against the same content. Queries shorter than min_query_words ("why?", "and then?") depend on their
+    context too much and are never cached. Entries expire after ttl seconds; once
+    max_entries is reached the least recently used entry is replaced. A scope is forgotten
+    with its last entry.
+    """
+    def __init__(self, embeddings=None, threshold: float = 0.95, ttl: Optional[float] = 3600.0,
+                 max_entries: int = 1024, min_query_words: int = 4):
+        """
+        Args:
+            embeddings: Embeddings model (embed_query / aembed_query) for the queries. When None
+                the engine uses the embeddings of its RAG system, or OpenAIEmbeddings.
+            threshold: Minimum cosine similarity of a hit.
+            ttl: Seconds an entry stays valid; entries never expire when None.
+            max_entries: Capacity of the cache.
+            min_query_words: Shortest query, in words, that is looked up and stored.
+        """
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("threshold must be in (0, 1]")
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_query_words = min_query_words
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None  # Unit vectors, one row per slot
+        self._scope_ids = np.full(max_entries, -1, dtype=np.int64)  # -1 marks a free slot
+        self._created = np.zeros(max_entries)
+        self._last_used = np.zeros(max_entries)
+        self._replies: List[Optional[str]] = [None] * max_entries
+        self._scopes: Dict[Hashable, int] = {}
+        self._scope_keys: Dict[int, Hashable] = {}
+        self._next_scope_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def accepts(self, query: str) -> bool:
+        """Whether query is long enough to be answered from the cache."""
+        return len(query.split()) >= self.min_query_words
+
+    def _scope_id(self, scope: Hashable) -> int:
+        scope_id = self._scopes.get(scope)
+        if scope_id is None:
+            scope_id = self._scopes[scope] = self._next_scope_id
+            self._scope_keys[scope_id] = scope
+            self._next_scope_id += 1
+        return scope_id
+
+    def _release_scopes(self, scope_ids: Iterable[int]) -> None:
+        """Forget the scopes among scope_ids that have no entry left."""
+        live = set(np.unique(self._scope_ids).tolist())
+        for scope_id in set(scope_ids) - live:
+            scope = self._scope_keys.pop(scope_id, None)
+            if scope is not None:
+                del self._scopes[scope]
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now: float) -> None:
+        if self.ttl is None:
+            return
+        expired = (self._scope_ids >= 0) & (self._created < now - self.ttl)
+        count = int(expired.sum())
+        if count:
+            released = self._scope_ids[expired].tolist()
+            self._scope_ids[expired] = -1
+            for slot in np.flatnonzero(expired):
+                self._replies[slot] = None
+            self.expirations += count
+            self._release_scopes(released)
+
+    def lookup(self, embedding, scope: Hashable) -> SemanticQuery:
+        """Find the most similar cached query of scope; the returned query carries its reply on a hit."""
+        query = SemanticQuery(self._normalize(embedding), scope)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            scope_id = self._scopes.get(scope)
+            if self._vectors is not None and scope_id is not None:
+                slots = np.flatnonzero(self._scope_ids == scope_id)
+                if len(slots):
+                    similarities = self._vectors[slots] @ query.embedding
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.threshold:
+                        slot = slots[best]
+                        self._last_used[slot] = now
+                        query.reply = self._replies[slot]
+                        query.similarity = float(similarities[best])
+                        self.hits += 1
+                        return query
+            self.misses += 1
+        return query
+
+    def store(self, query: SemanticQuery, reply: str) -> None:
+        """Cache reply as the answer to a query returned by lookup."""
+        now = time.monotonic()
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(query.embedding)), dtype=np.float32)
+            free = np.flatnonzero(self._scope_ids < 0)
+            if len(free):
+                slot = free[0]
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+            evicted = int(self._scope_ids[slot])
+            self._vectors[slot] = query.embedding
+            self._scope_ids[slot] = self._scope_id(query.scope)
+            if evicted >= 0:
+                self._release_scopes([evicted])
+            self._created[slot] = now
+            self._last_used[slot] = now
+            self._replies[slot] = reply
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scope_ids[:] = -1
+            self._replies = [None] * self.max_entries
+            self._scopes.clear()
+            self._scope_keys.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters, hit rate and the number of live entries."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": int((self._scope_ids >= 0).sum()),
+                "scopes": len(self._scopes),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
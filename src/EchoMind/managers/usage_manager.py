@@ -0,0 +1,179 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Union
+
+from EchoMind.utils.tracing import current_turn
+
+DEFAULT_USAGE_PATH = "generated_data/usage/usage.json"
+
+# USD per million tokens: (input, cached input, output)
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+}
+
+GROUP_FIELDS = ("user_id", "mode", "stage", "model")
+USAGE_COUNTERS = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens")
+UNATTRIBUTED = "-"
+
+
+class UsageLedger:
+    """
+    Token and cost accounting of the engines' API calls per user, mode, stage and model.
+
+    Every completion's usage is added to in-memory totals. With a path, the totals are
+    written to a compact JSON file (one row per user/mode/stage/model) on a background
+    thread at most every flush_interval seconds, on flush() and at exit, and loaded again
+    by the next ledger on that path. Calls made outside a turn, e.g. a direct
+    predict_content_bias, are booked on the user and mode "-".
+    """
+    def __init__(self, path: Optional[str] = DEFAULT_USAGE_PATH, flush_interval: float = 30.0,
+                 prices: Optional[Dict[str, Tuple[float, float, float]]] = None):
+        """
+        Args:
+            path: File the totals are flushed to. Kept in memory only when None.
+            flush_interval: Minimum seconds between two automatic flushes.
+            prices: USD per million (input, cached input, output) tokens per model. Defaults
+                to MODEL_PRICES; calls of models without a price cost 0.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.prices = prices if prices is not None else MODEL_PRICES
+        self._totals: Dict[Tuple[str, str, str, str], List[int]] = defaultdict(lambda: [0] * len(USAGE_COUNTERS))
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        self._flushing = False
+        self._flushed = time.monotonic()
+        if path:
+            self._load()
+            atexit.register(self.flush)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                stored = json.load(f)
+            for row in stored["rows"]:
+                self._totals[tuple(row[:len(GROUP_FIELDS)])] = row[len(GROUP_FIELDS):]
+        except Exception as e:
+            print(f"Error loading usage totals from {self.path}: {e}")
+
+    def record(self, stage: str, usage, model: Optional[str] = None, user_id: Optional[str] = None,
+               mode: Optional[str] = None) -> None:
+        """
+        Add the usage object of an API response. user_id and mode default to those of the
+        turn being processed.
+        """
+        if usage is None:
+            return
+        if user_id is None or mode is None:
+            turn = current_turn()
+            user_id = user_id or turn.get("user_id")
+            mode = mode or turn.get("mode")
+        details = getattr(usage, "prompt_tokens_details", None)
+        counts = (1, getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0,
+                  getattr(details, "cached_tokens", 0) or 0)
+        key = (user_id or UNATTRIBUTED, mode or UNATTRIBUTED, stage, model or UNATTRIBUTED)
+        with self._lock:
+            totals = self._totals[key]
+            for i, count in enumerate(counts):
+                totals[i] += count
+            self._dirty = True
+            due = self.path and not self._flushing and time.monotonic() - self._flushed >= self.flush_interval
+            if due:
+                self._flushing = True
+        if due:
+            # Written on a thread of its own, so neither a worker thread nor the event loop of
+            # the async engine waits for the disk
+            threading.Thread(target=self._background_flush, name="echomind-usage-flush", daemon=True).start()
+
+    def _background_flush(self) -> None:
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def flush(self) -> None:
+        """Write the totals to path if they changed since the last flush."""
+        if not self.path:
+            return
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                rows = [list(key) + list(totals) for key, totals in self._totals.items()]
+                self._dirty = False
+                self._flushed = time.monotonic()
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                temporary = f"{self.path}.tmp"
+                with open(temporary, "w") as f:
+                    json.dump({"fields": list(GROUP_FIELDS + USAGE_COUNTERS), "rows": rows}, f,
+                              separators=(",", ":"))
+                os.replace(temporary, self.path)
+            except Exception as e:
+                print(f"Error flushing usage totals to {self.path}: {e}")
+                with self._lock:
+                    self._dirty = True
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        """USD cost of the tokens at the model's price."""
+        if model not in self.prices:
+            return 0.0
+        input_price, cached_price, output_price = self.prices[model]
+        return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+                + completion_tokens * output_price) / 1_000_000
+
+    def _entry(self) -> Dict[str, float]:
+        return {**{counter: 0 for counter in USAGE_COUNTERS}, "total_tokens": 0, "cost": 0.0}
+
+    def _add(self, entry: Dict[str, float], key: Tuple[str, str, str, str], totals: List[int]) -> None:
+        for counter, count in zip(USAGE_COUNTERS, totals):
+            entry[counter] += count
+        entry["total_tokens"] += totals[1] + totals[2]
+        entry["cost"] += self.cost(key[3], totals[1], totals[2], totals[3])
+
+    def totals(self, user_id: Optional[str] = None, mode: Optional[str] = None, stage: Optional[str] = None,
+               model: Optional[str] = None) -> Dict[str, float]:
+        """Calls, tokens and cost of the rows matching every given filter."""
+        wanted = (user_id, mode, stage, model)
+        entry = self._entry()
+        with self._lock:
+            for key, totals in self._totals.items():
+                if all(value is None or value == field for value, field in zip(wanted, key)):
+                    self._add(entry, key, totals)
+        return entry
+
+    def top(self, n: int = 10, by: str = "total_tokens",
+            group: Union[str, Tuple[str, ...]] = "user_id") -> List[Tuple[Union[str, Tuple[str, ...]], Dict[str, float]]]:
+        """
+        The n largest consumers, e.g. top(5, group="stage") or top(10, by="cost",
+        group=("user_id", "stage")). by is a counter, "total_tokens" or "cost".
+        """
+        fields = (group,) if isinstance(group, str) else tuple(group)
+        unknown = [field for field in fields if field not in GROUP_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown group fields {unknown}, expected some of {GROUP_FIELDS}")
+        if by not in USAGE_COUNTERS + ("total_tokens", "cost"):
+            raise ValueError(f"Unknown usage measure {by!r}")
+        indices = [GROUP_FIELDS.index(field) for field in fields]
+        grouped = defaultdict(self._entry)
+        with self._lock:
+            for key, totals in self._totals.items():
+                group_key = tuple(key[i] for i in indices)
+                self._add(grouped[group_key if len(group_key) > 1 else group_key[0]], key, totals)
+        return sorted(grouped.items(), key=lambda item: item[1][by], reverse=True)[:n]
+
+    def clear(self) -> None:
+        """Drop the totals; the stored file is overwritten on the next flush."""
+        with self._lock:
+            self._totals.clear()
+            self._dirty = True
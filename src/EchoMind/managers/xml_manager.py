@@ -1,6 +1,7 @@
 import os
+import threading
 import xml.etree.ElementTree as ET
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 import json
 from icecream import ic
 
@@ -20,6 +21,12 @@ class XmlManager:
             print(f"Error loading schema config: {e}")
             return {}
         
+    def _write_tree(self, tree: ET.ElementTree, path: str) -> None:
+        """Write through a temporary file so concurrent readers never see a partial XML."""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        tree.write(tmp_path)
+        os.replace(tmp_path, path)
+
     def get_user_xml_path(self, user_id: str, mode: str = "standard") -> str:
         return os.path.join("generated_data/users", f"{user_id}_{mode}.xml")
 
@@ -49,7 +56,7 @@ class XmlManager:
             ET.SubElement(pred_dialogue_bias, "Bias").text = "None"
             
             tree = ET.ElementTree(root)
-            tree.write(path)
+            self._write_tree(tree, path)
             
     def initialize_user_xml_file(self, user_id: str, profile_data: Dict[str, str], 
                           content_bias: str = "None", mode: str = "file") -> None:
@@ -79,7 +86,7 @@ class XmlManager:
             ET.SubElement(pred_dialogue_bias, "Bias").text = "None"
         
             tree = ET.ElementTree(root)
-            tree.write(path)
+            self._write_tree(tree, path)
 
     def initialize_user_xml_file_maxim_evaluation(self, user_id: str, profile_data: Dict[str, str], 
                           content_maxim_evaluation: str = "None", mental_state: str = "Neutral", 
@@ -109,7 +116,7 @@ class XmlManager:
 
             
             tree = ET.ElementTree(root)
-            tree.write(path)
+            self._write_tree(tree, path)
             
     def update_static_profile(self, user_id: str, profile_data: Dict[str, str]) -> None:
         for mode in ["standard", "file"]:
@@ -124,18 +131,26 @@ class XmlManager:
                     if element is not None:
                         element.text = profile_data.get(field, "")
                 
-                tree.write(path)
+                self._write_tree(tree, path)
 
     def append_dialogue(self, user_id: str, user_input: str, 
-                       system_response: str, mode: str = "standard") -> None:
+                       system_response: str, mode: str = "standard", mental_state: Optional[str] = None,
+                       mental_state_source: Optional[str] = None) -> None:
+        """
+        Append a turn. The mental state predicted for the user message and where it came from
+        ("llm" or "local") are kept on the turn as training labels for the local classifier.
+        """
         path = self.get_user_xml_path(user_id, mode)
         tree = ET.parse(path)
         root = tree.getroot()
         dialogue_history = root.find("./Dynamic/DialogueHistory")
         turn = ET.SubElement(dialogue_history, "Turn")
+        if mental_state:
+            turn.set("mental_state", mental_state)
+            turn.set("mental_state_source", mental_state_source or "llm")
         ET.SubElement(turn, "User").text = user_input
         ET.SubElement(turn, "System").text = system_response
-        tree.write(path)
+        self._write_tree(tree, path)
 
     def get_user_profile(self, user_id: str, mode: str = "standard") -> Dict:
         path = self.get_user_xml_path(user_id, mode)
@@ -194,7 +209,7 @@ class XmlManager:
         root = tree.getroot()
         mental_state = root.find("./Dynamic/PredictedMentalState")
         mental_state.find("State").text = new_state
-        tree.write(path)
+        self._write_tree(tree, path)
 
     def update_predicted_content_bias(self, user_id: str, bias_value: str, 
                                      mode: str = "standard") -> None:
@@ -203,7 +218,7 @@ class XmlManager:
         root = tree.getroot()
         static = root.find("./Static/ContentBiases")
         static.find("Bias").text = bias_value
-        tree.write(path)
+        self._write_tree(tree, path)
 
     def update_predicted_user_dialogue_bias(self, user_id: str, bias_value: str, 
                                           mode: str = "standard") -> None:
@@ -212,7 +227,7 @@ class XmlManager:
         root = tree.getroot()
         dynamic = root.find("./Dynamic/PredictedUserDialogueBias")
         dynamic.find("Bias").text = bias_value
-        tree.write(path)
+        self._write_tree(tree, path)
 
     def get_dialogue_history(self, user_id: str, mode: str = "standard") -> list:
         path = self.get_user_xml_path(user_id, mode)
@@ -223,6 +238,41 @@ class XmlManager:
             for turn in root.findall("./Dynamic/DialogueHistory/Turn")
         ]
 
+    def get_conversation_summary(self, user_id: str, mode: str = "standard") -> Tuple[str, int]:
+        """Return the rolling summary of older turns and how many turns it covers."""
+        path = self.get_user_xml_path(user_id, mode)
+        tree = ET.parse(path)
+        root = tree.getroot()
+        summary = root.find("./Dynamic/ConversationSummary")
+        if summary is None:
+            return "", 0
+        return summary.text or "", int(summary.get("turns", "0"))
+
+    def get_summarized_session_turns(self, user_id: str, mode: str = "standard") -> Tuple[int, str]:
+        """Return how many unstored session turns the summary covers and their digest."""
+        path = self.get_user_xml_path(user_id, mode)
+        tree = ET.parse(path)
+        root = tree.getroot()
+        summary = root.find("./Dynamic/ConversationSummary")
+        if summary is None:
+            return 0, ""
+        return int(summary.get("session_turns", "0")), summary.get("session_digest", "")
+
+    def update_conversation_summary(self, user_id: str, summary_text: str, summarized_turns: int,
+                                    mode: str = "standard", session_turns: int = 0,
+                                    session_digest: str = "") -> None:
+        path = self.get_user_xml_path(user_id, mode)
+        tree = ET.parse(path)
+        root = tree.getroot()
+        summary = root.find("./Dynamic/ConversationSummary")
+        if summary is None:
+            summary = ET.SubElement(root.find("./Dynamic"), "ConversationSummary")
+        summary.text = summary_text
+        summary.set("turns", str(summarized_turns))
+        summary.set("session_turns", str(session_turns))
+        summary.set("session_digest", session_digest)
+        self._write_tree(tree, path)
+
     def reset_dynamic(self, user_id: str, mode: str = "standard") -> None:
         path = self.get_user_xml_path(user_id, mode)
         tree = ET.parse(path)
@@ -240,7 +290,7 @@ class XmlManager:
         pred_dialogue_bias = ET.SubElement(dynamic, "PredictedUserDialogueBias")
         ET.SubElement(pred_dialogue_bias, "Bias").text = "None"
         
-        tree.write(path)
+        self._write_tree(tree, path)
         
     def update_predicted_content_maxim_evaluation(self, user_id: str, maxim_evaluation: dict, 
                                                     mode: str = "file_maxim_evaluation") -> None:
@@ -254,7 +304,7 @@ class XmlManager:
         static.text = json.dumps(maxim_evaluation)
         # static.append(maxim_elem)
         
-        tree.write(path)
+        self._write_tree(tree, path)
 
 
     def update_predicted_LLM_dialogue_maxim_evaluations(self, user_id: str, maxim_evaluation: dict, 
@@ -264,4 +314,4 @@ class XmlManager:
         root = tree.getroot()
         dynamic = root.find("./Dynamic/DialogueMaximEvaluation")
         dynamic.text = json.dumps(maxim_evaluation)
-        tree.write(path)
\ No newline at end of file
+        self._write_tree(tree, path)
\ No newline at end of file
@@ -0,0 +1,219 @@
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+CASSETTE_MODES = ("record", "replay")
+
+# Describe the body as received, not as stored; the stored body is always decoded
+_DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "set-cookie"}
+
+
+class CassetteMiss(Exception):
+    """
+    Raised in replay mode for a request the cassette has no recording of. The OpenAI client
+    reports it as an APIConnectionError whose __cause__ is the CassetteMiss.
+    """
+    def __init__(self, method: str, path: str, cassette: Path):
+        super().__init__(f"No recording of {method} {path} in {cassette}")
+        self.method = method
+        self.path = path
+        self.cassette = cassette
+
+
+def request_key(method: str, path: str, body: bytes) -> str:
+    """Key of a request: method, path and the JSON body with sorted keys, so field order does not matter."""
+    try:
+        canonical = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":"))
+    except ValueError:
+        canonical = body.decode("utf-8", errors="replace")
+    return hashlib.sha256(f"{method} {path}\n{canonical}".encode()).hexdigest()
+
+
+def _encode_body(body: bytes) -> Tuple[str, str]:
+    try:
+        return body.decode("utf-8"), "utf-8"
+    except UnicodeDecodeError:
+        return base64.b64encode(body).decode("ascii"), "base64"
+
+
+def _decode_body(entry: Dict) -> bytes:
+    body = entry["response"]["body"]
+    return base64.b64decode(body) if entry["response"].get("encoding") == "base64" else body.encode("utf-8")
+
+
+def _usage(body: bytes) -> Optional[Dict]:
+    """The usage of a JSON response, or of the last chunk of an event stream that reports one."""
+    text = body.decode("utf-8", errors="replace")
+    if text.startswith("data: "):
+        usage = None
+        for line in text.splitlines():
+            if line.startswith("data: {"):
+                usage = json.loads(line[6:]).get("usage") or usage
+        return usage
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        return None
+    return payload.get("usage") if isinstance(payload, dict) else None
+
+
+def read_cassette(path: str) -> List[Dict]:
+    """The entries of a cassette in recording order, e.g. to profile the recorded traffic."""
+    entries = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    return entries
+
+
+class CassetteTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    Records the OpenAI traffic of the engines and RAG systems to a cassette and replays it.
+
+    Pass it to ClientFactory(transport=...) and use that factory for LLMEngine and RAGSystem.
+    In "record" mode every request is sent through the wrapped transport and the
+    request/response pair is appended to the cassette, a gzipped JSON-lines file, together
+    with its latency and token usage. In "replay" mode requests are answered from the
+    cassette without network access: a request matches a recording with the same method,
+    path and JSON body, and repeated identical requests get their recordings in the order
+    they were recorded. Requests without a recording raise CassetteMiss.
+
+    Streamed responses are recorded whole and replayed as one chunk.
+    """
+    def __init__(self, path: str, mode: str = "replay", latency_scale: float = 0.0,
+                 transport: Optional[httpx.BaseTransport] = None,
+                 async_transport: Optional[httpx.AsyncBaseTransport] = None):
+        """
+        Args:
+            path: Cassette file, e.g. "traces/session.jsonl.gz". Recording appends to it.
+            mode: "record" or "replay".
+            latency_scale: In replay mode, wait this multiple of the recorded latency before
+                answering: 0 replays at full speed, 1 at the recorded speed.
+            transport: Transport the sync requests are recorded from. Defaults to httpx's.
+            async_transport: Transport the async requests are recorded from. Defaults to httpx's.
+        """
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}, expected one of {CASSETTE_MODES}")
+        self.path = Path(path)
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._transport = transport
+        self._async_transport = async_transport
+        self._lock = threading.Lock()
+        self._recordings: Dict[str, List[Dict]] = defaultdict(list)
+        self._played: Dict[str, int] = defaultdict(int)
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        if mode == "replay":
+            for entry in read_cassette(self.path):
+                self._recordings[entry["key"]].append(entry)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Recording
+
+    def _record(self, request: httpx.Request, response: httpx.Response, body: bytes, latency: float) -> httpx.Response:
+        """Append the exchange to the cassette and return a response carrying the already read body."""
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in _DROPPED_HEADERS}
+        request_body, request_encoding = _encode_body(request.content)
+        response_body, response_encoding = _encode_body(body)
+        entry = {
+            "key": request_key(request.method, request.url.path, request.content),
+            "recorded_at": time.time(),
+            "latency": latency,
+            "usage": _usage(body),
+            "request": {"method": request.method, "path": request.url.path,
+                        "body": request_body, "encoding": request_encoding},
+            "response": {"status": response.status_code, "headers": headers,
+                         "body": response_body, "encoding": response_encoding},
+        }
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            # Every append is a complete gzip member, so an interrupted recording stays readable
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+            self.recorded += 1
+        return httpx.Response(response.status_code, headers=headers, content=body)
+
+    # Replaying
+
+    def _lookup(self, request: httpx.Request) -> Tuple[httpx.Response, float]:
+        key = request_key(request.method, request.url.path, request.content)
+        with self._lock:
+            recordings = self._recordings.get(key)
+            if not recordings:
+                self.misses += 1
+                raise CassetteMiss(request.method, request.url.path, self.path)
+            # Cycle through the recordings of a repeated request
+            entry = recordings[self._played[key] % len(recordings)]
+            self._played[key] += 1
+            self.replayed += 1
+        response = httpx.Response(entry["response"]["status"], headers=entry["response"]["headers"],
+                                  content=_decode_body(entry))
+        return response, entry["latency"] * self.latency_scale
+
+    # httpx transport interface
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        if self.mode == "replay":
+            response, delay = self._lookup(request)
+            if delay:
+                time.sleep(delay)
+            return response
+        if self._transport is None:
+            self._transport = httpx.HTTPTransport()
+        started = time.monotonic()
+        response = self._transport.handle_request(request)
+        try:
+            body = response.read()
+        finally:
+            response.close()
+        return self._record(request, response, body, time.monotonic() - started)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        if self.mode == "replay":
+            response, delay = self._lookup(request)
+            if delay:
+                await asyncio.sleep(delay)
+            return response
+        if self._async_transport is None:
+            self._async_transport = httpx.AsyncHTTPTransport()
+        started = time.monotonic()
+        response = await self._async_transport.handle_async_request(request)
+        try:
+            body = await response.aread()
+        finally:
+            await response.aclose()
+        # The gzip append is file I/O; keep it off the event loop
+        return await asyncio.to_thread(self._record, request, response, body, time.monotonic() - started)
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+    async def aclose(self) -> None:
+        if self._async_transport is not None:
+            await self._async_transport.aclose()
+
+    def stats(self) -> Dict[str, int]:
+        """Requests recorded, replayed and not found in the cassette."""
+        with self._lock:
+            return {
+                "recorded": self.recorded,
+                "replayed": self.replayed,
+                "misses": self.misses,
+                "recordings": sum(len(recordings) for recordings in self._recordings.values()),
+            }
@@ -0,0 +1,133 @@
+import threading
+from typing import Dict, Optional
+
+import httpx
+import openai
+from langchain_openai import OpenAIEmbeddings
+
+
+class ClientFactory:
+    """
+    Hands out OpenAI clients and embeddings that share one keep-alive connection pool.
+
+    Every client created here sends its requests through the same httpx.Client (or
+    httpx.AsyncClient), so connections and TLS sessions are reused across the engines, the
+    RAG embeddings and the example handlers instead of each opening its own. stats()
+    reports how many requests went over a new connection and how many reused one.
+    """
+    def __init__(self, max_connections: int = 20, max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 60.0, connect_timeout: float = 10.0,
+                 transport: Optional[httpx.BaseTransport] = None):
+        """
+        Args:
+            max_connections: Upper bound of open connections per pool.
+            max_keepalive_connections: Idle connections kept open for reuse.
+            keepalive_expiry: Seconds an idle connection is kept open.
+            connect_timeout: Timeout of establishing a connection; the read timeout is set
+                per request by the resilience layer.
+            transport: Send the requests of both pools through this transport instead of the
+                network, e.g. an httpx.MockTransport for offline benchmarks. The pool limits
+                do not apply to it.
+        """
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(60.0, connect=connect_timeout)
+        self.transport = transport
+        self._http_client: Optional[httpx.Client] = None
+        self._async_http_client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+
+    def _trace(self, event: str, info: Dict) -> None:
+        # httpcore trace events: a request either opens a connection first or reuses one.
+        with self._lock:
+            if event in ("http11.send_request_headers.started", "http2.send_request_headers.started"):
+                self.requests += 1
+            elif event == "connection.connect_tcp.complete":
+                self.connections += 1
+            elif event == "connection.start_tls.complete":
+                self.tls_handshakes += 1
+
+    async def _atrace(self, event: str, info: Dict) -> None:
+        self._trace(event, info)
+
+    def _add_trace(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._trace
+
+    async def _aadd_trace(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._atrace
+
+    @property
+    def http_client(self) -> httpx.Client:
+        """The shared synchronous HTTP client, created on first use."""
+        with self._lock:
+            if self._http_client is None or self._http_client.is_closed:
+                self._http_client = openai.DefaultHttpxClient(
+                    limits=self.limits, timeout=self.timeout, transport=self.transport,
+                    event_hooks={"request": [self._add_trace]}
+                )
+            return self._http_client
+
+    @property
+    def async_http_client(self) -> httpx.AsyncClient:
+        """The shared asynchronous HTTP client, created on first use."""
+        with self._lock:
+            if self._async_http_client is None or self._async_http_client.is_closed:
+                self._async_http_client = openai.DefaultAsyncHttpxClient(
+                    limits=self.limits, timeout=self.timeout, transport=self.transport,
+                    event_hooks={"request": [self._aadd_trace]}
+                )
+            return self._async_http_client
+
+    def openai_client(self, api_key: Optional[str] = None) -> openai.OpenAI:
+        # Retries are handled by the engines' resilience layer
+        return openai.OpenAI(api_key=api_key, max_retries=0, http_client=self.http_client)
+
+    def async_openai_client(self, api_key: Optional[str] = None) -> openai.AsyncOpenAI:
+        return openai.AsyncOpenAI(api_key=api_key, max_retries=0, http_client=self.async_http_client)
+
+    def embeddings(self, **kwargs) -> OpenAIEmbeddings:
+        """OpenAIEmbeddings on the shared pool; kwargs are passed on, e.g. model."""
+        return OpenAIEmbeddings(http_client=self.http_client, http_async_client=self.async_http_client, **kwargs)
+
+    def close(self) -> None:
+        """Close the synchronous pool; clients handed out before can no longer send requests."""
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+
+    async def aclose(self) -> None:
+        """Close the asynchronous pool."""
+        with self._lock:
+            client, self._async_http_client = self._async_http_client, None
+        if client is not None:
+            await client.aclose()
+
+    def stats(self) -> Dict[str, float]:
+        """Requests sent, connections and TLS handshakes made, and the share of requests on a reused connection."""
+        with self._lock:
+            reused = max(0, self.requests - self.connections)
+            return {
+                "requests": self.requests,
+                "new_connections": self.connections,
+                "reused_connections": reused,
+                "tls_handshakes": self.tls_handshakes,
+                "reuse_rate": reused / self.requests if self.requests else 0.0,
+            }
+
+
+_client_factory = ClientFactory()
+
+def get_client_factory() -> ClientFactory:
+    """Return the factory whose connection pool is shared by every EchoMind client in this process."""
+    return _client_factory
+
+def configure_client_factory(**kwargs) -> ClientFactory:
+    """Replace the process-wide factory, e.g. with a larger pool. kwargs are those of ClientFactory."""
+    global _client_factory
+    _client_factory = ClientFactory(**kwargs)
+    return _client_factory
@@ -33,4 +33,27 @@ def setup_openai_key(config_path: Optional[Path] = None) -> str:
         "No valid OpenAI config found. "
         "Either provide an explicit config_path or place a config.json "
         "in the current working directory with an 'openai_api_key' field."
-    )
\ No newline at end of file
+    )
+
+_token_encoders = {}
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """
+    Count the tokens of text for model. Uses tiktoken when it is installed and
+    falls back to the usual ~4 characters per token estimate otherwise.
+    """
+    if not text:
+        return 0
+    if model not in _token_encoders:
+        try:
+            import tiktoken
+            try:
+                _token_encoders[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _token_encoders[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # tiktoken missing or its encoding files unavailable
+            _token_encoders[model] = None
+    encoder = _token_encoders[model]
+    if encoder is None:
+        return max(1, len(text) // 4)
+    return len(encoder.encode(text, disallowed_special=()))
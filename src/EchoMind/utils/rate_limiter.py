@@ -0,0 +1,197 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from EchoMind.utils.helpers import count_tokens
+
+# Completion size assumed for requests without max_tokens
+DEFAULT_COMPLETION_TOKENS = 256
+
+# Limits of the lowest OpenAI usage tier for gpt-4o, used unless the config or the
+# environment (ECHOMIND_REQUESTS_PER_MINUTE, ECHOMIND_TOKENS_PER_MINUTE) says otherwise.
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 30000
+
+
+def estimate_request_tokens(request: Dict) -> int:
+    """Estimate the tokens a chat completion request counts against the TPM limit."""
+    tokens = 0
+    for message in request.get("messages", []):
+        tokens += count_tokens(message.get("content") or "") + 4  # Per-message overhead
+    return tokens + request.get("max_tokens", DEFAULT_COMPLETION_TOKENS)
+
+
+class TokenBucketRateLimiter:
+    """
+    Process-wide limiter for requests per minute and tokens per minute.
+
+    Both limits are token buckets refilled continuously. Callers that would exceed a limit
+    wait until enough capacity is back instead of getting a 429 from the API. A limit of
+    None disables that dimension; the wait metrics are kept either way. Requests are admitted
+    with a token estimate, which settle() corrects once the real usage is known.
+    """
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_level = float(requests_per_minute or 0)
+        self._token_level = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.requests = 0
+        self.tokens = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._request_level = min(self.requests_per_minute,
+                                      self._request_level + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._token_level = min(self.tokens_per_minute,
+                                    self._token_level + elapsed * self.tokens_per_minute / 60)
+
+    def _try_take(self, tokens: int) -> float:
+        """Take capacity for one request if available; otherwise return the seconds to wait."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens_per_minute:
+                tokens = min(tokens, self.tokens_per_minute)  # A single huge request must still pass
+            wait = 0.0
+            if self.requests_per_minute and self._request_level < 1:
+                wait = max(wait, (1 - self._request_level) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute and self._token_level < tokens:
+                wait = max(wait, (tokens - self._token_level) * 60 / self.tokens_per_minute)
+            if wait > 0:
+                return wait
+            if self.requests_per_minute:
+                self._request_level -= 1
+            if self.tokens_per_minute:
+                self._token_level -= tokens
+            self.requests += 1
+            self.tokens += tokens
+            return 0.0
+
+    def _enter_queue(self) -> None:
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def _leave_queue(self, waited: float) -> None:
+        with self._lock:
+            self.queue_depth -= 1
+            self.waits += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """
+        Correct the token estimate a request was admitted with once its usage is known:
+        the difference is refunded to the bucket, or debited if the request was larger.
+        """
+        with self._lock:
+            if self.tokens_per_minute:
+                estimated = min(estimated, self.tokens_per_minute)
+                self._refill(time.monotonic())
+                self._token_level = min(self.tokens_per_minute, self._token_level + estimated - actual)
+            self.tokens += actual - estimated
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until a request of the given token estimate may be sent. Returns the seconds waited."""
+        wait = self._try_take(tokens)
+        if wait == 0:
+            return 0.0
+        start = time.monotonic()
+        self._enter_queue()
+        try:
+            while wait > 0:
+                time.sleep(wait)
+                wait = self._try_take(tokens)
+        finally:
+            waited = time.monotonic() - start
+            self._leave_queue(waited)
+        return waited
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """Async variant of acquire that waits without blocking the event loop."""
+        wait = self._try_take(tokens)
+        if wait == 0:
+            return 0.0
+        start = time.monotonic()
+        self._enter_queue()
+        try:
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._try_take(tokens)
+        finally:
+            waited = time.monotonic() - start
+            self._leave_queue(waited)
+        return waited
+
+    def metrics(self) -> Dict[str, float]:
+        """Queue depth and wait-time metrics."""
+        with self._lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "requests": self.requests,
+                "tokens": self.tokens,
+                "waits": self.waits,
+                "total_wait": self.total_wait,
+                "average_wait": self.total_wait / self.waits if self.waits else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+
+def _parse_limit(value, source: str, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        print(f"Ignoring {source}={value!r}, which is not an integer; using {default}")
+        return default
+
+
+def rate_limits(config: Optional[Dict] = None) -> Tuple[Optional[int], Optional[int]]:
+    """
+    The (requests_per_minute, tokens_per_minute) limits to use: the "requests_per_minute" and
+    "tokens_per_minute" keys of config, else the ECHOMIND_REQUESTS_PER_MINUTE and
+    ECHOMIND_TOKENS_PER_MINUTE environment variables, else the defaults. 0 disables a limit;
+    a value that is not an integer is reported and replaced by the default.
+    """
+    config = config or {}
+    limits = []
+    for key, default in (("requests_per_minute", DEFAULT_REQUESTS_PER_MINUTE),
+                         ("tokens_per_minute", DEFAULT_TOKENS_PER_MINUTE)):
+        value, source = config.get(key), key
+        if value is None:
+            source = f"ECHOMIND_{key.upper()}"
+            value = os.environ.get(source) or default
+        limits.append(_parse_limit(value, source, default) or None)
+    return limits[0], limits[1]
+
+
+_rate_limiter = TokenBucketRateLimiter(*rate_limits())
+
+def get_rate_limiter() -> TokenBucketRateLimiter:
+    """Return the limiter shared by every EchoMind API call in this process."""
+    return _rate_limiter
+
+def configure_rate_limiter(requests_per_minute: Optional[int] = None,
+                           tokens_per_minute: Optional[int] = None) -> TokenBucketRateLimiter:
+    """Replace the process-wide limiter, e.g. with the limits of your OpenAI usage tier."""
+    global _rate_limiter
+    _rate_limiter = TokenBucketRateLimiter(requests_per_minute, tokens_per_minute)
+    return _rate_limiter
+
+def configure_rate_limiter_from_config(config_path: Path) -> TokenBucketRateLimiter:
+    """Replace the process-wide limiter with the limits of a config.json; see rate_limits()."""
+    with open(config_path, 'r') as file:
+        config = json.load(file)
+    return configure_rate_limiter(*rate_limits(config))
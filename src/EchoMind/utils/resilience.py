@@ -0,0 +1,254 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+import openai
+
+from EchoMind.utils.cassette import CassetteMiss
+
+
+@dataclass
+class PredictionResult:
+    """
+    Outcome of a classifier call: either a value or the error that prevented it.
+    attempts and hedged describe the successful API call; cached and local results made none.
+    """
+    value: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    hedged: bool = False
+    cached: bool = False
+    local: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def value_or(self, default: str = "Unknown") -> str:
+        """The predicted value, or default when the prediction failed."""
+        return self.value if self.ok else default
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Args:
+        max_attempts: Attempts per call, the first one included.
+        base_delay: Backoff before the first retry; doubled on every further retry.
+        max_delay: Upper bound of a single backoff.
+        timeout: Per-attempt request timeout in seconds.
+        deadline: Overall time budget of a call in seconds, retries included.
+    """
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    timeout: Optional[float] = 30.0
+    deadline: Optional[float] = 60.0
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter for the given (1-based) failed attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Connection problems, timeouts, 429s and 5xx responses are worth another attempt."""
+    if isinstance(error.__cause__, CassetteMiss):
+        return False  # Replaying again finds no recording either
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+class LatencyTracker:
+    """Recent latencies per stage, used to derive the hedging delay."""
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, latency: float) -> None:
+        with self._lock:
+            self._samples[stage].append(latency)
+
+    def percentile(self, stage: str, q: float = 0.95) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples[stage])
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class ResilientCaller:
+    """
+    Runs API calls with retries, exponential backoff with jitter, per-call deadlines and
+    optional hedging. A hedged call sends a duplicate request once the first one is slower
+    than the stage's p95 latency (or a fixed hedge_delay) and uses whichever succeeds first.
+    Sync hedged calls send both requests from a thread pool of their own.
+    """
+    def __init__(self, policy: Optional[RetryPolicy] = None, hedging: bool = False,
+                 hedge_delay: Optional[float] = None, max_hedge_workers: int = 32):
+        """
+        Args:
+            policy: Retry policy; the defaults of RetryPolicy when None.
+            hedging: Hedge the calls that ask for it (the short classifier calls).
+            hedge_delay: Fixed delay before a hedge request. When None the observed p95
+                latency of the stage is used, once enough samples exist.
+            max_hedge_workers: Threads available to synchronous hedged calls. A call holds up
+                to two of them, so size it to twice the threads making hedged calls, e.g. the
+                max_workers of the LLMEngine; calls beyond that wait for a free thread.
+        """
+        self.policy = policy or RetryPolicy()
+        self.hedging = hedging
+        self.hedge_delay = hedge_delay
+        self.latencies = LatencyTracker()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._max_hedge_workers = max_hedge_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _hedge_after(self, stage: str) -> Optional[float]:
+        if not self.hedging:
+            return None
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        return self.latencies.percentile(stage)
+
+    def _timeout(self, started: float) -> Optional[float]:
+        """Timeout of the next attempt, bounded by what is left of the deadline."""
+        if self.policy.deadline is None:
+            return self.policy.timeout
+        remaining = self.policy.deadline - (time.monotonic() - started)
+        if remaining <= 0:
+            raise TimeoutError(f"Deadline of {self.policy.deadline}s exceeded")
+        return min(self.policy.timeout, remaining) if self.policy.timeout else remaining
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_hedge_workers)
+            return self._executor
+
+    def call(self, send: Callable[[Optional[float]], Any], stage: str, hedge: bool = False) -> Any:
+        """
+        Call send(timeout) until it succeeds, a non-retryable error occurs or the attempts or
+        deadline run out, in which case the last error is raised. Returns (result, attempts, hedged).
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                timeout = self._timeout(started)
+                attempt_start = time.monotonic()
+                hedge_after = self._hedge_after(stage) if hedge else None
+                if hedge_after is None:
+                    result, hedged = send(timeout), False
+                else:
+                    result, hedged = self._hedged(send, timeout, hedge_after)
+                self.latencies.record(stage, time.monotonic() - attempt_start)
+                return result, attempt, hedged
+            except Exception as e:
+                if attempt >= self.policy.max_attempts or not is_retryable(e):
+                    raise
+                time.sleep(self.policy.backoff(attempt))
+
+    def _count_hedge(self, won: bool = False) -> None:
+        with self._lock:
+            if won:
+                self.hedge_wins += 1
+            else:
+                self.hedges += 1
+
+    def _hedged(self, send, timeout, hedge_after) -> Any:
+        """
+        Send the primary request from the pool and, once it is slower than hedge_after, the
+        hedge next to it; the first one to succeed is returned. The delay counts from when the
+        primary was sent, not from when it was queued for a free thread. A blocking request
+        cannot be abandoned, so the slower one finishes on its thread.
+        """
+        pool = self._pool()
+        sent = threading.Event()
+
+        def send_primary():
+            sent.set()
+            return send(timeout)
+
+        # Every attempt runs in a copy of the caller's context, e.g. the turn it belongs to
+        attempts = [pool.submit(contextvars.copy_context().run, send_primary)]
+        sent.wait()
+        if not wait(attempts, timeout=hedge_after).done:
+            self._count_hedge()
+            attempts.append(pool.submit(contextvars.copy_context().run, send, timeout))
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for attempt in (attempt for attempt in attempts if attempt in done):
+                failure = attempt.exception()
+                if failure is None:
+                    hedged = attempt is not attempts[0]
+                    if hedged:
+                        self._count_hedge(won=True)
+                    return attempt.result(), hedged
+                # An API error leaves it to the other attempt, but e.g. TurnCancelled does not
+                if not isinstance(failure, Exception):
+                    raise failure
+                error = failure
+        raise error
+
+    async def acall(self, send: Callable[[Optional[float]], Any], stage: str, hedge: bool = False) -> Any:
+        """Async variant of call; send(timeout) returns an awaitable."""
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                timeout = self._timeout(started)
+                attempt_start = time.monotonic()
+                hedge_after = self._hedge_after(stage) if hedge else None
+                if hedge_after is None:
+                    result, hedged = await send(timeout), False
+                else:
+                    result, hedged = await self._ahedged(send, timeout, hedge_after)
+                self.latencies.record(stage, time.monotonic() - attempt_start)
+                return result, attempt, hedged
+            except Exception as e:
+                if attempt >= self.policy.max_attempts or not is_retryable(e):
+                    raise
+                await asyncio.sleep(self.policy.backoff(attempt))
+
+    async def _ahedged(self, send, timeout, hedge_after) -> Any:
+        tasks = [asyncio.ensure_future(send(timeout))]
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            self._count_hedge()
+            tasks.append(asyncio.ensure_future(send(timeout)))
+        pending = set(tasks)
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in (task for task in tasks if task in done):
+                    if task.exception() is None:
+                        hedged = task is not tasks[0]
+                        if hedged:
+                            self._count_hedge(won=True)
+                        return task.result(), hedged
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, float]:
+        """Hedge requests sent, and how many of them answered before their primary."""
+        with self._lock:
+            return {"hedges": self.hedges, "hedge_wins": self.hedge_wins}
@@ -0,0 +1,182 @@
+import contextvars
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# Attributes of the turn being processed (user_id, mode, turn), added to every span started
+# while it is set. Work submitted to the engine's pools runs in a copy of the submitting context.
+_turn_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("echomind_turn", default={})
+
+
+def current_turn() -> Dict[str, Any]:
+    """user_id, mode and turn number of the turn being processed, or an empty dict outside a turn."""
+    return _turn_context.get()
+
+
+class Span:
+    """A timed stage of a turn. duration is in seconds and set by end()."""
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def set(self, **attributes) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def add_usage(self, usage) -> "Span":
+        """Add the token counts of an API response's usage object."""
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            self.attributes.update(
+                prompt_tokens=getattr(usage, "prompt_tokens", None),
+                completion_tokens=getattr(usage, "completion_tokens", None),
+                cached_tokens=getattr(details, "cached_tokens", None),
+            )
+        return self
+
+    def end(self) -> None:
+        """Stop the timer and hand the span to the tracer's hooks. Later calls do nothing."""
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+            self.tracer.emit(self)
+
+
+class SpanHook(ABC):
+    """Receives every finished span. Subclass it to export spans, e.g. to logs or a metrics backend."""
+    @abstractmethod
+    def on_span(self, span: Span) -> None:
+        """Called once per span, on the thread that ended it. Errors are printed, not raised."""
+
+
+class HistogramRecorder(SpanHook):
+    """Keeps the recent durations and token counts per span name and reports percentiles."""
+    def __init__(self, window: int = 10000):
+        """
+        Args:
+            window: Durations kept per span name; older ones are dropped.
+        """
+        self._durations = defaultdict(lambda: deque(maxlen=window))
+        self._counts = defaultdict(int)
+        self._tokens = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def on_span(self, span: Span) -> None:
+        with self._lock:
+            self._durations[span.name].append(span.duration)
+            self._counts[span.name] += 1
+            for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                if span.attributes.get(key):
+                    self._tokens[span.name][key] += span.attributes[key]
+
+    @staticmethod
+    def _percentile(samples: List[float], q: float) -> float:
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def dump(self) -> Dict[str, Dict[str, float]]:
+        """Per span name: count, mean, p50, p95, p99 and max in milliseconds, plus token totals."""
+        report = {}
+        with self._lock:
+            for name, durations in self._durations.items():
+                samples = sorted(durations)
+                report[name] = {
+                    "count": self._counts[name],
+                    "mean_ms": 1000 * sum(samples) / len(samples),
+                    "p50_ms": 1000 * self._percentile(samples, 0.50),
+                    "p95_ms": 1000 * self._percentile(samples, 0.95),
+                    "p99_ms": 1000 * self._percentile(samples, 0.99),
+                    "max_ms": 1000 * samples[-1],
+                    **self._tokens[name],
+                }
+        return report
+
+    def report(self) -> str:
+        """dump() as a table sorted by total time."""
+        rows = sorted(self.dump().items(), key=lambda item: item[1]["mean_ms"] * item[1]["count"], reverse=True)
+        lines = [f"{'stage':<32} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'tokens':>9}"]
+        for name, stats in rows:
+            tokens = stats.get("prompt_tokens", 0) + stats.get("completion_tokens", 0)
+            lines.append(f"{name:<32} {stats['count']:>6} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+                         f"{stats['p99_ms']:>9.1f} {tokens:>9}")
+        return "\n".join(lines)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._durations.clear()
+            self._counts.clear()
+            self._tokens.clear()
+
+
+class Tracer:
+    """
+    Times the stages of the engines' turns. Finished spans go to the hooks; by default a
+    single HistogramRecorder, available as tracer.histogram.
+    """
+    def __init__(self, hooks: Optional[List[SpanHook]] = None):
+        self.hooks = list(hooks) if hooks is not None else [HistogramRecorder()]
+        self._turns = 0
+        self._lock = threading.Lock()
+
+    @property
+    def histogram(self) -> Optional[HistogramRecorder]:
+        return next((hook for hook in self.hooks if isinstance(hook, HistogramRecorder)), None)
+
+    def add_hook(self, hook: SpanHook) -> None:
+        self.hooks.append(hook)
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """Start a span that is finished with span.end(); for stages that cannot use a with block."""
+        return Span(self, name, {**_turn_context.get(), **attributes})
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Time the body of the with block. A raised exception is recorded as the error attribute."""
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            span.end()
+
+    def start_turn(self, kind: str, user_id: str, mode: str) -> Span:
+        """Start the span "turn.<kind>" of a new turn; see turn() and scope()."""
+        with self._lock:
+            self._turns += 1
+            number = self._turns
+        return Span(self, f"turn.{kind}", {"user_id": user_id, "mode": mode, "turn": number})
+
+    @contextmanager
+    def scope(self, turn: Span) -> Iterator[Span]:
+        """Add the user, mode and turn number of turn to the spans started in the with block."""
+        token = _turn_context.set({key: turn.attributes[key] for key in ("user_id", "mode", "turn")})
+        try:
+            yield turn
+        finally:
+            _turn_context.reset(token)
+
+    @contextmanager
+    def turn(self, kind: str, user_id: str, mode: str) -> Iterator[Span]:
+        """Time a whole turn; the spans started inside it carry its user, mode and turn number."""
+        span = self.start_turn(kind, user_id, mode)
+        try:
+            with self.scope(span):
+                yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            span.end()
+
+    def emit(self, span: Span) -> None:
+        for hook in self.hooks:
+            try:
+                hook.on_span(span)
+            except Exception as e:
+                print(f"Error in span hook {type(hook).__name__}: {e}")
@@ -0,0 +1,190 @@
+import asyncio
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Handle of the turn being processed. Work submitted to the engine's pools runs in a copy of
+# the submitting context, so it sees the handle of the turn that submitted it.
+_turn_handle: contextvars.ContextVar[Optional["TurnHandle"]] = contextvars.ContextVar("echomind_turn_handle",
+                                                                                     default=None)
+
+
+class TurnCancelled(BaseException):
+    """
+    Raised in a turn that a newer turn of the same user and mode replaced. Derives from
+    BaseException like asyncio.CancelledError, so except Exception handlers let it through.
+    """
+
+
+def current_handle() -> Optional["TurnHandle"]:
+    """Handle of the turn being processed, or None outside a turn."""
+    return _turn_handle.get()
+
+
+def check_cancelled(handle: Optional["TurnHandle"] = None) -> None:
+    """Raise TurnCancelled if handle (by default the turn being processed) was cancelled."""
+    handle = handle or _turn_handle.get()
+    if handle is not None:
+        handle.check()
+
+
+def _cancel(future) -> None:
+    if future.done():
+        return
+    if isinstance(future, asyncio.Future):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        loop = future.get_loop()
+        if running is loop:
+            future.cancel()
+        elif not loop.is_closed():
+            # Tasks may only be cancelled from the thread of their event loop
+            loop.call_soon_threadsafe(future.cancel)
+    else:
+        future.cancel()
+
+
+class TurnHandle:
+    """
+    A turn of one (user_id, mode) conversation that is still working on its reply.
+
+    cancel() stops the turn: the work it tracks (queued pool jobs, asyncio tasks) is
+    cancelled and its next API call or state write raises TurnCancelled. Once the reply is
+    complete the turn commits and can no longer be cancelled, so the bookkeeping of a reply
+    the user has seen is always stored.
+    """
+    def __init__(self, user_id: str, mode: str):
+        self.user_id = user_id
+        self.mode = mode
+        self.committed = False
+        self._cancelled = threading.Event()
+        self._tracked: List = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self) -> None:
+        """Raise TurnCancelled if the turn was cancelled."""
+        if self._cancelled.is_set():
+            raise self._error()
+
+    def _error(self) -> TurnCancelled:
+        return TurnCancelled(f"Turn of {self.user_id} in mode {self.mode} was replaced by a newer one")
+
+    def track(self, future):
+        """
+        Cancel future, a concurrent.futures.Future or an asyncio task, together with the turn.
+        Returns future.
+        """
+        with self._lock:
+            if not self._cancelled.is_set():
+                if not self.committed:
+                    self._tracked = [tracked for tracked in self._tracked if not tracked.done()]
+                    self._tracked.append(future)
+                return future
+        _cancel(future)
+        return future
+
+    def commit(self) -> None:
+        """
+        Mark the reply as complete; cancel() does nothing afterwards. Raises TurnCancelled if
+        the turn was cancelled first, so the reply of a replaced turn is not recorded.
+        """
+        with self._lock:
+            if self._cancelled.is_set():
+                raise self._error()
+            self.committed = True
+            self._tracked = []
+
+    def cancel(self) -> bool:
+        """Cancel the turn unless it committed. Returns whether it was cancelled."""
+        with self._lock:
+            if self.committed or self._cancelled.is_set():
+                return False
+            self._cancelled.set()
+            tracked, self._tracked = self._tracked, []
+        for future in tracked:
+            _cancel(future)
+        return True
+
+    @contextmanager
+    def scope(self) -> Iterator["TurnHandle"]:
+        """
+        Make this the turn being processed in the with block. Errors raised there because the
+        turn was cancelled, e.g. by a cancelled future or task, are raised as TurnCancelled.
+        """
+        token = _turn_handle.set(self)
+        try:
+            yield self
+        except (Exception, asyncio.CancelledError) as e:
+            if not self._cancelled.is_set():
+                raise
+            task = asyncio.current_task() if isinstance(e, asyncio.CancelledError) else None
+            if task is not None and task.cancelling():
+                # The task itself is being cancelled by its owner, not just the work it awaited
+                raise
+            raise self._error() from e
+        finally:
+            _turn_handle.reset(token)
+
+
+class TurnRegistry:
+    """
+    The turn in flight in every (user_id, mode) conversation. With cancel_previous, starting
+    a turn cancels the one still in flight in the same conversation, e.g. when an impatient
+    user sends their message again.
+    """
+    def __init__(self, cancel_previous: bool = True):
+        self.cancel_previous = cancel_previous
+        self.cancelled = 0
+        self._turns: Dict[Tuple[str, str], TurnHandle] = {}
+        self._lock = threading.Lock()
+
+    def start(self, user_id: str, mode: str) -> TurnHandle:
+        """Register a new turn of the conversation; see turn()."""
+        handle = TurnHandle(user_id, mode)
+        with self._lock:
+            previous = self._turns.get((user_id, mode))
+            self._turns[(user_id, mode)] = handle
+        if self.cancel_previous and previous is not None and previous.cancel():
+            with self._lock:
+                self.cancelled += 1
+        return handle
+
+    def finish(self, handle: TurnHandle) -> None:
+        """Forget handle once its turn is over, unless a newer turn replaced it already."""
+        with self._lock:
+            if self._turns.get((handle.user_id, handle.mode)) is handle:
+                del self._turns[(handle.user_id, handle.mode)]
+
+    @contextmanager
+    def turn(self, user_id: str, mode: str) -> Iterator[TurnHandle]:
+        """Run the with block as the turn in flight of the conversation."""
+        handle = self.start(user_id, mode)
+        try:
+            with handle.scope():
+                yield handle
+        finally:
+            self.finish(handle)
+
+    def in_flight(self, user_id: str, mode: str) -> Optional[TurnHandle]:
+        with self._lock:
+            return self._turns.get((user_id, mode))
+
+    def cancel(self, user_id: str, mode: str) -> bool:
+        """Cancel the turn in flight in the conversation, e.g. for a stop button. Returns whether there was one."""
+        handle = self.in_flight(user_id, mode)
+        if handle is None or not handle.cancel():
+            return False
+        with self._lock:
+            self.cancelled += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._turns), "cancelled": self.cancelled}
@@ -0,0 +1,145 @@
+import asyncio
+import atexit
+import contextvars
+import inspect
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from EchoMind.utils.turns import TurnCancelled
+
+
+class PostProcessingQueue:
+    """
+    Background queue for the bookkeeping that follows a reply (XML writes, evaluations).
+
+    Jobs are grouped by key, e.g. (user_id, mode). Jobs of one key run one after another in
+    submission order, so updates of the same user XML never interleave; different keys run
+    in parallel on up to max_workers threads. Pending jobs are flushed at interpreter exit.
+    """
+    def __init__(self, max_workers: int = 2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="echomind-post")
+        self._queues: Dict[Hashable, deque] = {}
+        self._condition = threading.Condition()
+        self._closed = False
+        atexit.register(self.flush)
+
+    def submit(self, key: Hashable, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Queue fn(*args, **kwargs) behind the pending jobs of key and return its future.
+        fn runs in a copy of the caller's context, so context variables such as the tracing
+        attributes of the current turn carry over.
+        """
+        future = Future()
+        job = (contextvars.copy_context(), fn, args, kwargs, future)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("PostProcessingQueue is closed")
+            queue = self._queues.get(key)
+            if queue is None:
+                self._queues[key] = deque([job])
+                self._executor.submit(self._drain, key)
+            else:
+                queue.append(job)
+        return future
+
+    def _drain(self, key: Hashable) -> None:
+        """Run the jobs of key until its queue is empty. A job stays queued while it runs."""
+        while True:
+            with self._condition:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    self._condition.notify_all()
+                    return
+                context, fn, args, kwargs, future = queue[0]
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(context.run(fn, *args, **kwargs))
+                except TurnCancelled as e:
+                    # A write of a turn that a newer one replaced, skipped on purpose
+                    future.set_exception(e)
+                except Exception as e:
+                    print(f"Error in post-processing job {getattr(fn, '__name__', fn)}: {e}")
+                    future.set_exception(e)
+            with self._condition:
+                queue.popleft()
+
+    def pending(self, key: Optional[Hashable] = None) -> int:
+        """Number of queued or running jobs, for key or for all keys."""
+        with self._condition:
+            if key is not None:
+                return len(self._queues.get(key, ()))
+            return sum(len(queue) for queue in self._queues.values())
+
+    def wait_idle(self, key: Optional[Hashable] = None, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the jobs of key (all keys when None) are done.
+        Returns False if the timeout expired first.
+        """
+        with self._condition:
+            if key is None:
+                return self._condition.wait_for(lambda: not self._queues, timeout)
+            return self._condition.wait_for(lambda: key not in self._queues, timeout)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait for all pending jobs."""
+        return self.wait_idle(None, timeout)
+
+    def close(self) -> None:
+        """Flush the queue and stop its worker threads. No jobs can be submitted afterwards."""
+        with self._condition:
+            self._closed = True
+        self.flush()
+        self._executor.shutdown(wait=True)
+        atexit.unregister(self.flush)
+
+
+class AsyncPostProcessingQueue:
+    """
+    asyncio counterpart of PostProcessingQueue: jobs are tasks on the running event loop,
+    chained per key so that the jobs of one key run in submission order.
+    Call flush() before the loop stops; there is no exit hook.
+    """
+    def __init__(self):
+        self._tails: Dict[Hashable, asyncio.Task] = {}
+
+    def submit(self, key: Hashable, fn: Callable, *args) -> asyncio.Task:
+        """Queue fn(*args) (a coroutine function or a plain function) behind the jobs of key."""
+        task = asyncio.create_task(self._run_after(self._tails.get(key), fn, args))
+        self._tails[key] = task
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return task
+
+    async def _run_after(self, previous: Optional[asyncio.Task], fn: Callable, args) -> Any:
+        if previous is not None:
+            await asyncio.wait([previous])  # Only the order matters, not the outcome
+        result = fn(*args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tails.get(key) is task:
+            del self._tails[key]
+        if not task.cancelled() and task.exception() is not None and not isinstance(task.exception(), TurnCancelled):
+            print(f"Error in post-processing job: {task.exception()}")
+
+    def pending(self, key: Optional[Hashable] = None) -> int:
+        """Number of keys with queued jobs (0 or 1 when key is given)."""
+        if key is not None:
+            return int(key in self._tails)
+        return len(self._tails)
+
+    async def wait_idle(self, key: Optional[Hashable] = None) -> None:
+        """Wait until the jobs of key (all keys when None) are done."""
+        while True:
+            tasks = list(self._tails.values()) if key is None else [self._tails[key]] if key in self._tails else []
+            if not tasks:
+                return
+            await asyncio.wait(tasks)
+
+    async def flush(self) -> None:
+        """Wait for all pending jobs."""
+        await self.wait_idle()
@@ -0,0 +1,45 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from fake_openai import FakeOpenAIBackend
+from EchoMind import LLMEngine
+from EchoMind.utils.client_factory import ClientFactory
+from EchoMind.utils.rate_limiter import TokenBucketRateLimiter
+
+SCHEMA_PATH = Path(__file__).parent.parent / "examples" / "gradio_chat_with_RAG" / "user_schema_config.json"
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A working directory with config.json and schema.json; XmlManager writes generated_data/ under it."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    (tmp_path / "config.json").write_text(json.dumps({"openai_api_key": "sk-test"}))
+    shutil.copy(SCHEMA_PATH, tmp_path / "schema.json")
+    return tmp_path
+
+
+@pytest.fixture
+def backend():
+    """Fake OpenAI backend with a short, constant latency."""
+    return FakeOpenAIBackend(latency_ms=20, latency_sigma=0, embedding_latency_ms=5, completion_tokens=30)
+
+
+@pytest.fixture
+def make_engine(workdir, backend):
+    """Build LLMEngines that talk to the fake backend, without rate limits; they are closed after the test."""
+    engines = []
+
+    def make(transport=None, **kwargs):
+        engine = LLMEngine(Path("config.json"), schema_config_path="schema.json",
+                           client_factory=ClientFactory(transport=transport or backend),
+                           rate_limiter=TokenBucketRateLimiter(), **kwargs)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.close()
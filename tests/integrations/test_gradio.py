@@ -0,0 +1,207 @@
+"""
+The pipeline behind the Gradio demos (LLMEngine + RAGSystem + XmlManager), driven the way
+their chat handlers drive it, against the fake OpenAI backend.
+"""
+import json
+import random
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from fake_openai import FakeOpenAIBackend
+from pipeline_benchmark import write_corpus
+from EchoMind import PostProcessingQueue, RAGSystem, TurnCancelled
+from EchoMind.engines.document_pipeline import BIAS_HTML_START, DocumentPipeline
+from EchoMind.engines.llm import CONTENT_BIAS_BATCH_SYSTEM_MESSAGE, NO_BIAS_LABEL, USER_TURN_SYSTEM_MESSAGE
+from EchoMind.engines.rag import RateLimitedEmbeddings
+from EchoMind.utils.client_factory import ClientFactory
+from EchoMind.utils.rate_limiter import TokenBucketRateLimiter
+
+PROFILE = {"expertise_in_AI": "novice", "expertise_in_biology": "expert", "required_response": "small explanation"}
+
+
+class BiasedSentenceBackend(FakeOpenAIBackend):
+    """Labels the sentences mentioning "always" as biased in batched bias requests."""
+    def _completion_content(self, body):
+        stage, content = super()._completion_content(body)
+        if body["messages"][0]["content"] != CONTENT_BIAS_BATCH_SYSTEM_MESSAGE:
+            return stage, content
+        numbered = dict(line.split(". ", 1) for line in body["messages"][-1]["content"].splitlines())
+        return stage, json.dumps({"labels": {number: "- Overgeneralization" if "always" in sentence else NO_BIAS_LABEL
+                                             for number, sentence in numbered.items()}})
+
+
+class TimingBackend(FakeOpenAIBackend):
+    """Records when the requests of every stage were sent and answered."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.intervals = []
+
+    def handle_request(self, request):
+        started = time.monotonic()
+        response = super().handle_request(request)
+        stage = json.loads(request.content)["messages"][0]["content"][:40] if "/chat/" in request.url.path else "embeddings"
+        with self._lock:
+            self.intervals.append((stage, started, time.monotonic()))
+        return response
+
+    def interval(self, system_message):
+        return next((start, end) for stage, start, end in self.intervals if system_message.startswith(stage))
+
+
+@pytest.fixture
+def rag(workdir, backend):
+    write_corpus(Path("docs"), 4, random.Random(0))
+    factory = ClientFactory(transport=backend)
+    rag = RAGSystem("docs", "faiss_index", rate_limiter=TokenBucketRateLimiter(), client_factory=factory)
+    # Send the chunks as text; the default tokenizes them first
+    rag.embeddings = RateLimitedEmbeddings(factory.embeddings(check_embedding_ctx_length=False), TokenBucketRateLimiter())
+    rag.build_or_update_index()
+    return rag
+
+
+def chat(engine, user_id, message, chat_history):
+    """What the RAG demo's update_chat_history does: stream the reply, then refresh the dashboard."""
+    reply = "".join(engine.stream_llm_response(user_id, message, session_history=chat_history, mode="standard"))
+    engine.wait_for_pending(user_id, mode="standard")
+    return chat_history + [[f"👤 {message}", f"🤖 {reply}"]], engine.xml_class.get_user_profile(user_id, mode="standard")
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_rag_chat_session(make_engine, backend, rag, concurrent):
+    engine = make_engine(rag_system=rag, concurrent=concurrent, post_processing=PostProcessingQueue())
+    engine.xml_class.initialize_user_xml("alice", PROFILE)
+
+    history = []
+    for message in ("How does attention work?", "And what is a gradient?", "Why does training need data?"):
+        history, profile = chat(engine, "alice", message, history)
+
+    stored = engine.xml_class.get_dialogue_history("alice")
+    assert [(turn["user"], "🤖 " + turn["system"]) for turn in stored] == [(user[2:], system) for user, system in history]
+    assert profile["content_bias"] == NO_BIAS_LABEL and profile["dialogue_bias"] == NO_BIAS_LABEL
+    assert profile["mental_state"]
+    # Every retrieved chunk was labelled once and the labels were reused by later turns
+    requests = backend.stats()["requests"]
+    assert requests["user_turn"] == 3 and requests["generation"] == 3
+    assert rag.chunk_biases and set(rag.chunk_biases.values()) == {NO_BIAS_LABEL}
+    assert requests["content_bias_batch"] <= 3 and "content_bias" not in requests
+
+
+def test_turn_fans_out_its_classifier_calls_by_default(make_engine, rag):
+    backend = TimingBackend(latency_ms=150, latency_sigma=0)
+    engine = make_engine(backend, rag_system=rag)
+    engine.xml_class.initialize_user_xml("alice", PROFILE)
+    chat(engine, "alice", "How does attention work?", [])
+
+    # The content bias of the retrieved chunks is classified while the user turn call is in flight
+    user_turn = backend.interval(USER_TURN_SYSTEM_MESSAGE)
+    content_bias = backend.interval(CONTENT_BIAS_BATCH_SYSTEM_MESSAGE)
+    assert content_bias[0] < user_turn[1] and user_turn[0] < content_bias[1]
+
+
+def test_annotated_index_needs_no_bias_calls(make_engine, backend, rag):
+    engine = make_engine(rag_system=rag)
+    engine.xml_class.initialize_user_xml("bob", PROFILE)
+    assert engine.annotate_chunk_biases() == len(rag.all_chunks())
+    assert engine.annotate_chunk_biases() == 0
+
+    batches = backend.stats()["requests"]["content_bias_batch"]
+    chat(engine, "bob", "What is a protein sequence?", [])
+    assert backend.stats()["requests"]["content_bias_batch"] == batches
+
+
+def test_new_chat_starts_from_an_empty_history(make_engine, rag):
+    engine = make_engine(rag_system=rag)
+    engine.xml_class.initialize_user_xml("carol", PROFILE)
+    history, _ = chat(engine, "carol", "What is a layer?", [])
+
+    # new_chat_standard
+    engine.xml_class.reset_dynamic("carol", mode="standard")
+    assert engine.xml_class.get_dialogue_history("carol") == []
+    chat(engine, "carol", "What is a cell?", [])
+    assert [turn["user"] for turn in engine.xml_class.get_dialogue_history("carol")] == ["What is a cell?"]
+
+
+def test_new_message_replaces_a_streaming_reply(make_engine, rag):
+    engine = make_engine(rag_system=rag)
+    engine.xml_class.initialize_user_xml("dave", PROFILE)
+    stream = engine.stream_llm_response("dave", "Explain attention in detail", session_history=[])
+    assert next(stream)
+
+    # The user sends another message while the first reply is still streaming
+    history, _ = chat(engine, "dave", "Actually, explain gradients", [])
+    with pytest.raises(TurnCancelled):
+        list(stream)
+    assert [turn["user"] for turn in engine.xml_class.get_dialogue_history("dave")] == ["Actually, explain gradients"]
+
+
+def test_file_chat_with_maxim_evaluation(make_engine):
+    engine = make_engine(post_processing=PostProcessingQueue())
+    engine.xml_class.initialize_user_xml_file_maxim_evaluation("erin", PROFILE)
+
+    # update_chat_history_content_maxim_evaluation
+    reply, info = engine.generate_llm_response_with_maxim_evaluation(
+        "erin", "Is the summary accurate?", "The file text.", "The file analysis.", session_history=[],
+        mode="file_maxim_evaluation"
+    )
+    info["evaluation"].result(timeout=10)
+    profile = engine.xml_class.get_user_profile_content_maxim_evaluation("erin")
+    assert set(json.loads(profile["llm_dialogue_evaluation"])) == {"quantity", "quality", "relevance", "manner"}
+    assert engine.xml_class.get_dialogue_history("erin", "file_maxim_evaluation")[0]["system"] == reply
+
+
+def test_document_bias_html_streams_progress(make_engine):
+    backend = BiasedSentenceBackend(latency_ms=20, latency_sigma=0.5)
+    engine = make_engine(backend, concurrent=True)
+    pipeline = DocumentPipeline(engine, max_concurrency=3, sentences_per_unit=5)
+    sentences = [f"Engineers {'always' if i % 7 == 0 else 'often'} write test number {i}." for i in range(20)]
+
+    pages = list(pipeline.stream_bias_html(" ".join(sentences)))
+
+    assert len(pages) == 5  # The pending document, then one page per unit of five sentences
+    assert pages[0].startswith(BIAS_HTML_START) and pages[0].count('color: gray;') == 20
+    assert pages[-1].count("[- Overgeneralization]") == 3 and 'color: gray;' not in pages[-1]
+    grey = [page.count('color: gray;') for page in pages]
+    assert grey == sorted(grey, reverse=True)
+
+
+def test_document_maxims_json_streams_sections_in_order(make_engine, backend):
+    engine = make_engine()
+    pipeline = DocumentPipeline(engine, max_concurrency=3, max_section_tokens=200)
+    text = "\n\n".join(f"Paragraph {i}. " + "evidence " * 120 for i in range(6))
+
+    documents = [json.loads(page) for page in pipeline.stream_maxim_json(text)]
+
+    assert [document["completed"] for document in documents] == list(range(1, len(documents) + 1))
+    final = documents[-1]
+    assert final["completed"] == final["units"] == len(documents)
+    assert [section["unit"] for section in final["sections"]] == list(range(final["units"]))
+
+
+def test_concurrent_users_do_not_share_state(make_engine, rag):
+    engine = make_engine(rag_system=rag, concurrent=True, post_processing=PostProcessingQueue())
+    users = [f"user{number}" for number in range(4)]
+    for user_id in users:
+        engine.xml_class.initialize_user_xml(user_id, PROFILE)
+    errors = []
+
+    def session(user_id):
+        try:
+            history = []
+            for turn in range(3):
+                history, _ = chat(engine, user_id, f"{user_id} question {turn}", history)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=session, args=(user_id,)) for user_id in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    for user_id in users:
+        assert [turn["user"] for turn in engine.xml_class.get_dialogue_history(user_id)] == \
+            [f"{user_id} question {turn}" for turn in range(3)]
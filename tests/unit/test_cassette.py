@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import httpx
+import openai
+import pytest
+
+from EchoMind.utils.cassette import CassetteMiss, CassetteTransport, read_cassette, request_key
+from EchoMind.utils.resilience import is_retryable
+
+PROFILE = {"expertise_in_AI": "novice", "expertise_in_biology": "expert", "required_response": "small explanation"}
+URL = "https://api.openai.com/v1/chat/completions"
+
+
+def chat_body(content):
+    return {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": content}]}
+
+
+def converse(engine, questions):
+    engine.xml_class.initialize_user_xml("u1", PROFILE)
+    replies = [engine.generate_llm_response("u1", question) for question in questions]
+    engine.wait_for_pending("u1", "standard")
+    return replies
+
+
+def test_replay_answers_a_recorded_session_without_the_backend(make_engine, backend, workdir):
+    questions = ["How does attention work?", "And what is a gradient?"]
+    recorder = CassetteTransport("traces/session.jsonl.gz", mode="record", transport=backend)
+    recorded = converse(make_engine(recorder), questions)
+    sent = backend.stats()["requests"]
+
+    # Replayed from a fresh state, so the engine sends the same requests again
+    (workdir / "generated_data" / "users" / "u1_standard.xml").unlink()
+    player = CassetteTransport("traces/session.jsonl.gz", mode="replay")
+    assert converse(make_engine(player), questions) == recorded
+
+    assert backend.stats()["requests"] == sent
+    assert player.stats()["replayed"] == recorder.stats()["recorded"] == sum(sent.values())
+    entries = read_cassette("traces/session.jsonl.gz")
+    assert all(entry["latency"] > 0 and entry["usage"]["prompt_tokens"] > 0 for entry in entries)
+
+
+def test_replay_miss_raises_cassette_miss_without_retries(make_engine, backend):
+    converse(make_engine(CassetteTransport("session.jsonl.gz", mode="record", transport=backend)),
+             ["How does attention work?"])
+    player = CassetteTransport("session.jsonl.gz", mode="replay")
+    engine = make_engine(player)
+
+    with pytest.raises(openai.APIConnectionError) as raised:
+        engine.generate_llm_response("u1", "A question that was never recorded")
+
+    assert isinstance(raised.value.__cause__, CassetteMiss) and not is_retryable(raised.value)
+    # One miss each for the user turn and the generation request, none of them retried
+    assert player.stats()["misses"] == 2
+
+
+def test_repeated_requests_replay_in_recording_order(workdir, backend):
+    recorder = CassetteTransport("session.jsonl.gz", mode="record", transport=backend)
+    with httpx.Client(transport=recorder) as client:
+        recorded = [client.post(URL, json=chat_body("hello")).json()["choices"][0]["message"]["content"]
+                    for _ in range(2)]
+
+    player = CassetteTransport("session.jsonl.gz", mode="replay")
+    with httpx.Client(transport=player) as client:
+        replayed = [client.post(URL, json=chat_body("hello")).json()["choices"][0]["message"]["content"]
+                    for _ in range(3)]
+    assert replayed == recorded + recorded[:1]
+
+
+def test_async_requests_are_recorded_and_replayed(workdir, backend):
+    async def post(transport):
+        async with httpx.AsyncClient(transport=transport) as client:
+            return (await client.post(URL, json=chat_body("hello"))).json()
+
+    recorded = asyncio.run(post(CassetteTransport("session.jsonl.gz", mode="record", async_transport=backend)))
+    assert asyncio.run(post(CassetteTransport("session.jsonl.gz", mode="replay"))) == recorded
+
+
+def test_requests_match_regardless_of_field_order():
+    body = chat_body("hello")
+    reordered = json.dumps(dict(reversed(list(body.items())))).encode()
+    assert request_key("POST", "/v1/chat/completions", json.dumps(body).encode()) == \
+        request_key("POST", "/v1/chat/completions", reordered)
+    assert request_key("POST", "/v1/embeddings", reordered) != request_key("POST", "/v1/chat/completions", reordered)
+
+
+def test_unknown_mode_is_rejected(workdir):
+    with pytest.raises(ValueError):
+        CassetteTransport("session.jsonl.gz", mode="rewind")
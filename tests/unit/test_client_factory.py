@@ -0,0 +1,114 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from EchoMind.utils.client_factory import ClientFactory
+
+COMPLETION = {
+    "id": "chatcmpl-local", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "Curious"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11},
+}
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+class OpenAIHandler(BaseHTTPRequestHandler):
+    """Answers chat completions and embeddings over keep-alive HTTP/1.1 connections."""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path.endswith("/embeddings"):
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            payload = {"object": "list", "model": body["model"], "usage": {"prompt_tokens": 1, "total_tokens": 1},
+                       "data": [{"object": "embedding", "index": i, "embedding": [0.1, 0.2, 0.3]}
+                                for i in range(len(inputs))]}
+        else:
+            payload = COMPLETION
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """A local OpenAI-compatible server the clients are pointed at."""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), OpenAIHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{httpd.server_port}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def complete(client):
+    return client.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES).choices[0].message.content
+
+
+def test_clients_of_a_factory_reuse_one_connection(server):
+    factory = ClientFactory()
+    first, second = factory.openai_client(), factory.openai_client()
+    for _ in range(3):
+        assert complete(first) == "Curious" and complete(second) == "Curious"
+
+    stats = factory.stats()
+    assert stats["requests"] == 6 and stats["new_connections"] == 1
+    assert stats["reused_connections"] == 5 and stats["reuse_rate"] == pytest.approx(5 / 6)
+    assert stats["tls_handshakes"] == 0
+    factory.close()
+
+
+def test_embeddings_share_the_pool_of_the_clients(server):
+    factory = ClientFactory()
+    complete(factory.openai_client())
+    embeddings = factory.embeddings(check_embedding_ctx_length=False)
+    assert embeddings.embed_query("hello") == [0.1, 0.2, 0.3]
+
+    assert factory.stats()["requests"] == 2 and factory.stats()["new_connections"] == 1
+    factory.close()
+
+
+def test_without_keepalive_every_request_opens_a_connection(server):
+    factory = ClientFactory(max_keepalive_connections=0)
+    client = factory.openai_client()
+    for _ in range(3):
+        complete(client)
+
+    stats = factory.stats()
+    assert stats["new_connections"] == 3 and stats["reused_connections"] == 0 and stats["reuse_rate"] == 0.0
+    factory.close()
+
+
+def test_closed_pool_is_reopened_for_new_clients(server):
+    factory = ClientFactory()
+    complete(factory.openai_client())
+    factory.close()
+
+    complete(factory.openai_client())
+    assert factory.stats()["requests"] == 2 and factory.stats()["new_connections"] == 2
+    factory.close()
+
+
+def test_async_clients_reuse_one_connection(server):
+    factory = ClientFactory()
+
+    async def main():
+        client = factory.async_openai_client()
+        for _ in range(3):
+            response = await client.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES)
+            assert response.choices[0].message.content == "Curious"
+        await factory.aclose()
+
+    asyncio.run(main())
+    assert factory.stats()["requests"] == 3 and factory.stats()["new_connections"] == 1
@@ -0,0 +1,632 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import httpx
+import pytest
+
+from fake_openai import FakeOpenAIBackend
+from EchoMind import (
+    AsyncLLMEngine, ContextWindowManager, PostProcessingQueue, ResultCache, SemanticResponseCache, TurnCancelled
+)
+from EchoMind.engines.document_pipeline import DocumentPipeline, aggregate_maxim_evaluations
+from EchoMind.engines.llm import CONTENT_BIAS_BATCH_SYSTEM_MESSAGE, NO_BIAS_LABEL
+from EchoMind.engines.mental_state import MENTAL_STATES
+from EchoMind.managers.context_manager import render_turn
+from EchoMind.utils.client_factory import ClientFactory
+from EchoMind.utils.rate_limiter import TokenBucketRateLimiter
+
+BIAS_LABEL = "- Gender bias"
+PROFILE = {"expertise_in_AI": "novice", "expertise_in_biology": "expert", "required_response": "small explanation"}
+
+
+class RecordingBackend(FakeOpenAIBackend):
+    """Keeps the stage and body of every chat request and the highest number of requests in flight."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bodies = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _completion_content(self, body):
+        stage, content = super()._completion_content(body)
+        with self._lock:
+            self.bodies.append((stage, body))
+        return stage, content
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def handle_request(self, request):
+        self._enter()
+        try:
+            return super().handle_request(request)
+        finally:
+            self._leave()
+
+    async def handle_async_request(self, request):
+        self._enter()
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self._leave()
+
+    def prompts(self, stage):
+        """Message contents of the recorded requests of stage, without the current user message."""
+        return ["\n".join(message["content"] for message in body["messages"][:-1])
+                for recorded, body in self.bodies if recorded == stage]
+
+
+class LabellingBackend(FakeOpenAIBackend):
+    """
+    Labels sentences containing "biased" as biased in batched bias requests. Leaves out the
+    labels of sentences containing "stubborn" always, and of "flaky" ones in the first request.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    def _completion_content(self, body):
+        stage, content = super()._completion_content(body)
+        if stage != "content_bias_batch":
+            return stage, content
+        numbered = dict(line.split(". ", 1) for line in body["messages"][-1]["content"].splitlines())
+        with self._lock:
+            self.batches.append(sorted(numbered.values()))
+            first = len(self.batches) == 1
+        labels = {number: BIAS_LABEL if "biased" in sentence else NO_BIAS_LABEL
+                  for number, sentence in numbered.items()
+                  if "stubborn" not in sentence and not (first and "flaky" in sentence)}
+        return stage, json.dumps({"labels": labels})
+
+
+class FailingBatchBackend(FakeOpenAIBackend):
+    """Rejects every batched bias request with a 400."""
+    def _respond(self, request):
+        body = json.loads(request.content or b"{}")
+        if body.get("messages") and body["messages"][0]["content"] == CONTENT_BIAS_BATCH_SYSTEM_MESSAGE:
+            with self._lock:
+                self.requests["content_bias_batch"] += 1
+            return httpx.Response(400, json={"error": {"message": "Invalid request", "type": "invalid_request_error"}}), 0.0
+        return super()._respond(request)
+
+
+def start_user(engine, user_id="u1", mode="standard"):
+    if mode == "file_maxim_evaluation":
+        engine.xml_class.initialize_user_xml_file_maxim_evaluation(user_id, PROFILE)
+    else:
+        engine.xml_class.initialize_user_xml(user_id, PROFILE, mode=mode)
+
+
+def user_inputs(engine, user_id="u1", mode="standard"):
+    return [turn["user"] for turn in engine.xml_class.get_dialogue_history(user_id, mode)]
+
+
+# Concurrent fan-out
+
+def test_concurrent_bias_batches_keep_sentence_order(make_engine):
+    sentences = [f"Sentence {i} is {'biased' if i % 4 == 0 else 'neutral'}." for i in range(30)]
+    labelling = LabellingBackend(latency_ms=30, latency_sigma=0.8, seed=3)
+    engine = make_engine(labelling, concurrent=True)
+
+    results = engine.predict_content_bias_batch(sentences, max_batch_size=5)
+
+    assert len(labelling.batches) == 6
+    assert [result.value for result in results] == [BIAS_LABEL if i % 4 == 0 else NO_BIAS_LABEL for i in range(30)]
+
+
+def test_concurrent_mode_fans_out_requests(make_engine):
+    sentences = [f"Sentence {i} is neutral." for i in range(20)]
+    for concurrent, expected in ((False, 1), (True, 4)):
+        backend = RecordingBackend(latency_ms=50, latency_sigma=0)
+        engine = make_engine(backend, concurrent=concurrent, max_workers=4)
+        engine.predict_content_bias_batch(sentences, max_batch_size=5)
+        assert backend.max_in_flight == expected
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_turns_are_recorded_in_order(make_engine, backend, concurrent):
+    engine = make_engine(concurrent=concurrent)
+    start_user(engine)
+    history = []
+    for number in range(3):
+        reply = engine.generate_llm_response("u1", f"question {number}", session_history=history)
+        history = history + [[f"👤 question {number}", f"🤖 {reply}"]]
+
+    assert user_inputs(engine) == ["question 0", "question 1", "question 2"]
+    profile = engine.xml_class.get_user_profile("u1")
+    assert profile["mental_state"] in MENTAL_STATES
+    assert profile["dialogue_bias"] == NO_BIAS_LABEL
+    # One user turn call (mental state and dialogue bias) and one generation per turn
+    assert backend.stats()["requests"] == {"user_turn": 3, "generation": 3}
+
+
+def test_async_engine_serves_conversations_concurrently(workdir):
+    backend = RecordingBackend(latency_ms=50, latency_sigma=0.5)
+    users = [f"u{number}" for number in range(5)]
+
+    async def main():
+        engine = AsyncLLMEngine(Path("config.json"), schema_config_path="schema.json",
+                                client_factory=ClientFactory(transport=backend),
+                                rate_limiter=TokenBucketRateLimiter())
+        for user_id in users:
+            start_user(engine, user_id)
+        replies = await asyncio.gather(*[engine.generate_llm_response(user_id, f"hello from {user_id}")
+                                         for user_id in users])
+        await engine.close()
+        return engine, replies
+
+    engine, replies = asyncio.run(main())
+    assert len(replies) == len(users) and all(replies)
+    assert backend.max_in_flight >= len(users)
+    for user_id, reply in zip(users, replies):
+        history = engine.xml_class.get_dialogue_history(user_id)
+        assert [(turn["user"], turn["system"]) for turn in history] == [(f"hello from {user_id}", reply)]
+
+
+class ThreadRecordingCache(ResultCache):
+    """ResultCache that records the threads it is read and written from."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.threads = set()
+
+    def get(self, key):
+        self.threads.add(threading.get_ident())
+        return super().get(key)
+
+    def set(self, key, value):
+        self.threads.add(threading.get_ident())
+        super().set(key, value)
+
+
+def test_async_engine_keeps_the_result_cache_off_the_event_loop(workdir, backend):
+    cache = ThreadRecordingCache(disk_dir="cache")
+
+    async def main():
+        engine = AsyncLLMEngine(Path("config.json"), schema_config_path="schema.json", result_cache=cache,
+                                client_factory=ClientFactory(transport=backend), rate_limiter=TokenBucketRateLimiter())
+        for _ in range(2):
+            await engine.predict_content_bias("Nurses are caring.")
+            await engine.predict_content_bias_batch(["First sentence.", "Second sentence."])
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    assert cache.threads and loop_thread not in cache.threads
+    assert cache.stats()["memory_hits"] == 3
+
+
+def test_async_stream_stores_the_reply_once_consumed(workdir, backend):
+    async def main():
+        engine = AsyncLLMEngine(Path("config.json"), schema_config_path="schema.json",
+                                client_factory=ClientFactory(transport=backend), rate_limiter=TokenBucketRateLimiter())
+        start_user(engine)
+        deltas, stored_while_streaming = [], None
+        async for delta in engine.stream_llm_response("u1", "How does attention work?"):
+            if not deltas:
+                stored_while_streaming = user_inputs(engine)
+            deltas.append(delta)
+        await engine.wait_for_pending("u1", "standard")
+        await engine.close()
+        return engine, deltas, stored_while_streaming
+
+    engine, deltas, stored_while_streaming = asyncio.run(main())
+    assert len(deltas) > 1 and stored_while_streaming == []
+    assert engine.xml_class.get_dialogue_history("u1")[0]["system"] == "".join(deltas).strip()
+    usage = engine.usage_ledger.totals(user_id="u1", stage="generation")
+    assert usage["calls"] == 1 and usage["prompt_tokens"] > 0 and usage["completion_tokens"] > 0
+
+
+def test_abandoned_async_stream_stores_nothing(workdir, backend):
+    async def main():
+        engine = AsyncLLMEngine(Path("config.json"), schema_config_path="schema.json",
+                                client_factory=ClientFactory(transport=backend), rate_limiter=TokenBucketRateLimiter())
+        start_user(engine)
+        stream = engine.stream_llm_response("u1", "Tell me a long story")
+        assert await stream.__anext__()
+        await stream.aclose()
+        await engine.wait_for_pending("u1", "standard")
+        await engine.close()
+        return engine
+
+    engine = asyncio.run(main())
+    assert user_inputs(engine) == []
+    assert engine.turns.stats()["in_flight"] == 0
+
+
+# Post-processing queue
+
+def test_queue_runs_jobs_of_a_key_in_submission_order():
+    queue = PostProcessingQueue()
+    order = []
+    for number in range(5):
+        queue.submit("user", lambda number=number: (time.sleep(0.01 * (5 - number)), order.append(number)))
+    assert queue.wait_idle("user", timeout=5)
+    assert order == [0, 1, 2, 3, 4]
+    assert queue.pending() == 0
+    queue.close()
+
+
+def test_queue_runs_different_keys_in_parallel():
+    queue = PostProcessingQueue(max_workers=2)
+    barrier = threading.Barrier(2, timeout=5)
+    # Both jobs only finish if they run at the same time
+    futures = [queue.submit(key, barrier.wait) for key in ("a", "b")]
+    assert sorted(future.result(timeout=5) for future in futures) == [0, 1]
+    queue.close()
+
+
+def test_queue_reports_job_errors_on_the_future():
+    queue = PostProcessingQueue()
+    failed = queue.submit("user", lambda: 1 / 0)
+    after = queue.submit("user", lambda: "next")
+    with pytest.raises(ZeroDivisionError):
+        failed.result(timeout=5)
+    assert after.result(timeout=5) == "next"
+    queue.close()
+    with pytest.raises(RuntimeError):
+        queue.submit("user", print)
+
+
+def test_bookkeeping_is_deferred_and_seen_by_the_next_turn(make_engine):
+    backend = RecordingBackend(latency_ms=20, latency_sigma=0)
+    engine = make_engine(backend, post_processing=PostProcessingQueue())
+    start_user(engine)
+    engine.generate_llm_response("u1", "what is a gradient")
+    engine.generate_llm_response("u1", "and a token")
+
+    # The second turn waited for the first turn's bookkeeping before reading the history
+    assert "User: what is a gradient" in backend.prompts("generation")[1]
+    assert engine.wait_for_pending("u1", "standard", timeout=5)
+    assert user_inputs(engine) == ["what is a gradient", "and a token"]
+
+
+def test_maxim_evaluation_is_returned_as_a_future(make_engine, backend):
+    engine = make_engine(post_processing=PostProcessingQueue())
+    start_user(engine, mode="file_maxim_evaluation")
+    reply, info = engine.generate_llm_response_with_maxim_evaluation("u1", "summarize the file", "file text")
+
+    assert reply == info["response"]
+    assert isinstance(info["evaluation"], Future)
+    evaluation = info["evaluation"].result(timeout=5)
+    assert set(evaluation) == {"quantity", "quality", "relevance", "manner"}
+    assert user_inputs(engine, mode="file_maxim_evaluation") == ["summarize the file"]
+
+
+def test_close_flushes_pending_bookkeeping(make_engine):
+    engine = make_engine(post_processing=PostProcessingQueue())
+    start_user(engine)
+    engine.generate_llm_response("u1", "first question")
+    engine.close()
+    assert user_inputs(engine) == ["first question"]
+
+
+# Result cache and semantic cache
+
+def test_result_cache_hit_miss_and_clear(make_engine, backend):
+    cache = ResultCache(disk_dir="cache")
+    engine = make_engine(result_cache=cache)
+    first = engine.predict_content_bias("Nurses are caring.")
+    second = engine.predict_content_bias("Nurses are caring.")
+
+    assert not first.cached and second.cached and second.value == first.value
+    assert backend.stats()["requests"]["content_bias"] == 1
+    assert cache.stats()["memory_hits"] == 1 and cache.stats()["misses"] == 1
+
+    # The disk tier survives a restart
+    restarted = ResultCache(disk_dir="cache")
+    assert make_engine(result_cache=restarted).predict_content_bias("Nurses are caring.").cached
+    assert restarted.stats()["disk_hits"] == 1
+
+    cache.clear()
+    assert cache.stats()["disk_bytes"] == 0
+    assert not engine.predict_content_bias("Nurses are caring.").cached
+    assert backend.stats()["requests"]["content_bias"] == 2
+
+
+def test_result_cache_trims_the_disk_tier_to_the_low_water_mark(workdir):
+    entry_bytes = len(json.dumps({"value": "x" * 100}))
+    cache = ResultCache(max_entries=1, disk_dir="cache", max_disk_bytes=10 * entry_bytes)
+    for number in range(10):
+        cache.set(f"{number:02d}key", "x" * 100)
+    assert cache.get("00key") == "x" * 100  # Now the most recently used
+
+    # The index is kept in memory: storing never walks the cache directory
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr("os.walk", lambda *args: pytest.fail("walked the cache directory"))
+        cache.set("10key", "x" * 100)
+
+        # Over the limit, the tier is trimmed to 90% of it: the two least recently used go
+        assert cache.stats()["disk_entries"] == 9 and cache.stats()["disk_bytes"] == 9 * entry_bytes
+        assert cache.get("01key") is None and cache.get("02key") is None
+        assert cache.get("00key") == "x" * 100 and cache.get("03key") == "x" * 100
+    assert not (workdir / "cache" / "01" / "01key.json").exists()
+
+    restarted = ResultCache(max_entries=1, disk_dir="cache", max_disk_bytes=10 * entry_bytes)
+    assert restarted.stats()["disk_entries"] == 9 and restarted.stats()["disk_bytes"] == 9 * entry_bytes
+
+
+def test_memory_only_result_cache_writes_no_files(workdir):
+    cache = ResultCache(max_entries=2, disk_dir=None)
+    for key in ("a", "b", "c"):
+        cache.set(key, key.upper())
+    assert cache.get("a") is None and cache.get("c") == "C"
+    assert not (workdir / "generated_data" / "cache").exists()
+
+
+def test_semantic_cache_is_scoped_to_the_conversation(make_engine, backend):
+    embeddings = ClientFactory(transport=backend).embeddings(check_embedding_ctx_length=False)
+    cache = SemanticResponseCache(embeddings, threshold=0.99)
+    engine = make_engine(semantic_cache=cache)
+    for user_id in ("u1", "u2"):
+        start_user(engine, user_id)
+    question = "what is the attention layer"
+
+    reply = engine.generate_llm_response("u1", question)
+    # Asked again later in the same conversation: answered without a generation request
+    engine.generate_llm_response("u1", "and how are the weights of the attention layer trained")
+    assert engine.generate_llm_response("u1", question) == reply
+    assert cache.stats()["hits"] == 1
+    assert backend.stats()["requests"]["generation"] == 2
+    assert user_inputs(engine)[-1] == question
+
+    # Another user, or the same user with other profile settings, misses
+    engine.generate_llm_response("u2", question)
+    engine.xml_class.update_static_profile("u1", {**PROFILE, "required_response": "detailed explanation"})
+    engine.generate_llm_response("u1", question)
+    assert cache.stats()["hits"] == 1
+    assert backend.stats()["requests"]["generation"] == 4
+
+    # Short queries depend on their context and are never looked up
+    lookups = cache.stats()["hits"] + cache.stats()["misses"]
+    engine.generate_llm_response("u1", "why?")
+    assert cache.stats()["hits"] + cache.stats()["misses"] == lookups
+
+
+def test_semantic_cache_entries_expire_with_their_scope():
+    cache = SemanticResponseCache(threshold=0.9, ttl=0.05, max_entries=2)
+    query = cache.lookup([1.0, 0.0], "scope")
+    cache.store(query, "reply")
+    assert cache.lookup([1.0, 0.01], "scope").reply == "reply"
+    assert cache.lookup([1.0, 0.01], "other scope").reply is None
+
+    time.sleep(0.06)
+    assert cache.lookup([1.0, 0.01], "scope").reply is None
+    assert cache.stats()["expirations"] == 1 and cache.stats()["scopes"] == 0
+
+
+def test_semantic_cache_evicts_the_least_recently_used_entry():
+    cache = SemanticResponseCache(threshold=0.9, ttl=None, max_entries=2)
+    for number, vector in enumerate(([1.0, 0.0], [0.0, 1.0], [1.0, 1.0])):
+        cache.store(cache.lookup(vector, f"scope {number}"), f"reply {number}")
+    assert cache.lookup([1.0, 0.0], "scope 0").reply is None
+    assert cache.lookup([1.0, 1.0], "scope 2").reply == "reply 2"
+    assert cache.stats()["evictions"] == 1 and cache.stats()["scopes"] == 2
+
+
+# Context window and summary fold
+
+def test_session_turns_already_stored_are_not_repeated(make_engine):
+    backend = RecordingBackend(latency_ms=5, latency_sigma=0)
+    engine = make_engine(backend)
+    start_user(engine)
+    history = []
+    for number in range(3):
+        reply = engine.generate_llm_response("u1", f"unique question {number}", session_history=history)
+        history = history + [[f"👤 unique question {number}", f"🤖 {reply}"]]
+
+    report = engine.history_reports[("u1", "standard")]
+    assert report["session_turns"] == 2 and report["duplicate_turns"] == 2
+    assert report["tokens_saved"] > 0
+    prompt = backend.prompts("generation")[-1]
+    assert prompt.count("unique question 0") == 1 and "👤" not in prompt
+
+
+@pytest.mark.parametrize("post_processing", [None, PostProcessingQueue])
+def test_history_over_budget_is_folded_into_the_summary(make_engine, post_processing):
+    backend = RecordingBackend(latency_ms=5, latency_sigma=0, completion_tokens=20)
+    engine = make_engine(backend, context_manager=ContextWindowManager(token_budget=80, min_recent_turns=1),
+                         post_processing=post_processing() if post_processing else None)
+    start_user(engine)
+    for number in range(6):
+        engine.generate_llm_response("u1", f"question number {number} about layers")
+    engine.wait_for_pending("u1", "standard")
+
+    summary, summarized_turns = engine.xml_class.get_conversation_summary("u1")
+    assert summary and summarized_turns > 0
+    assert backend.stats()["requests"]["summary"] >= 1
+    # Folding is incremental: every turn is summarized once
+    folded = [body["messages"][-1]["content"] for stage, body in backend.bodies if stage == "summary"]
+    for number in range(summarized_turns):
+        assert sum(f"question number {number} " in text for text in folded) == 1
+
+    engine.generate_llm_response("u1", "one more question about layers")
+    prompt = backend.prompts("generation")[-1]
+    assert "Summary of earlier conversation:" in prompt
+    assert "question number 0 " not in prompt
+
+
+def test_session_overflow_keeps_the_newest_turns_verbatim():
+    manager = ContextWindowManager(token_budget=50, min_recent_turns=2)
+    stored = [{"user": f"stored question {i} " * 3, "system": f"stored answer {i} " * 3} for i in range(2)]
+    session = [{"user": f"session question {i} " * 3, "system": f"session answer {i} " * 3} for i in range(3)]
+    assert manager.count(render_turn(session[0])) * 2 > manager.token_budget
+
+    window = manager.plan(stored, session)
+
+    # The two newest turns overflow the budget but stay; everything older is folded
+    assert window.session_turns[window.session_start:] == session[1:]
+    assert window.turns[window.start:] == []
+    assert window.to_fold == stored + session[:1]
+
+
+def test_unstored_session_turns_are_folded_once(make_engine):
+    backend = RecordingBackend(latency_ms=5, latency_sigma=0, completion_tokens=20)
+    engine = make_engine(backend, context_manager=ContextWindowManager(token_budget=80, min_recent_turns=1))
+    start_user(engine)
+    session = [[f"👤 old session question {i} with some words", f"🤖 old answer {i} with some words"]
+               for i in range(6)]
+    engine.generate_llm_response("u1", "first new question", session_history=session)
+    engine.generate_llm_response("u1", "second new question", session_history=session)
+
+    folded = [body["messages"][-1]["content"] for stage, body in backend.bodies if stage == "summary"]
+    assert folded
+    for i in range(6):
+        assert sum(f"old session question {i} " in text for text in folded) <= 1
+    assert engine.xml_class.get_summarized_session_turns("u1")[0] > 0
+
+
+# Batched content bias
+
+def test_bias_batch_retries_only_missing_labels(make_engine):
+    backend = LabellingBackend(latency_ms=5, latency_sigma=0)
+    engine = make_engine(backend)
+    sentences = ["A biased sentence.", "A flaky sentence.", "A plain sentence.", ""]
+    results = engine.predict_content_bias_batch(sentences)
+
+    assert backend.batches == [sorted(sentences[:3]), ["A flaky sentence."]]
+    assert [result.value for result in results[:3]] == [BIAS_LABEL, NO_BIAS_LABEL, NO_BIAS_LABEL]
+    assert results[1].attempts == 2 and results[0].attempts == 1
+    assert results[3].ok
+    assert "content_bias" not in backend.stats()["requests"]
+
+
+def test_bias_batch_falls_back_to_single_sentence_calls(make_engine):
+    backend = LabellingBackend(latency_ms=5, latency_sigma=0)
+    engine = make_engine(backend)
+    results = engine.predict_content_bias_batch(["A stubborn sentence.", "A plain sentence."], max_retries=2)
+
+    # The first request and two retries of the unlabelled sentence, then the fallback
+    assert backend.batches[1:] == [["A stubborn sentence."], ["A stubborn sentence."]]
+    assert backend.stats()["requests"]["content_bias"] == 1
+    assert all(result.ok for result in results)
+
+
+def test_failed_bias_batch_reports_errors_per_sentence(make_engine):
+    backend = FailingBatchBackend(latency_ms=5, latency_sigma=0)
+    engine = make_engine(backend)
+    results = engine.predict_content_bias_batch(["First sentence.", "Second sentence."])
+
+    assert [result.ok for result in results] == [False, False]
+    assert all("content_bias_batch failed" in result.error for result in results)
+    # A rejected request is neither retried nor replaced by single-sentence calls
+    assert backend.stats()["requests"] == {"content_bias_batch": 1}
+
+
+# Maxim analysis
+
+def test_maxim_aggregation_normalizes_names_and_weights_sections():
+    sections = ["short section", "a much longer section " * 10]
+    result = aggregate_maxim_evaluations(sections, [
+        {"quantity": {"score": 2, "explanation": "Too short."}, "Manner": {"score": 5, "explanation": "Clear."}},
+        {" Quantity ": {"score": 4, "explanation": "Fine."}, "manner": {"score": "3", "explanation": "Wordy."}},
+        {"error": "failed"},
+    ])
+
+    assert set(result["maxims"]) == {"Quantity", "Manner"}
+    quantity = result["maxims"]["Quantity"]
+    assert 3.5 < quantity["score"] < 4
+    assert quantity["min_score"] == 2 and quantity["explanation"] == "Too short." and quantity["worst_section"] == 0
+    assert result["maxims"]["Manner"]["worst_section"] == 1
+    assert result["failed_sections"] == [2]
+
+
+def test_maxim_sections_are_reused_after_an_edit(make_engine, backend):
+    engine = make_engine(result_cache=ResultCache(disk_dir=None))
+    start_user(engine, mode="file_maxim_evaluation")
+    pipeline = DocumentPipeline(engine, max_section_tokens=300)
+    paragraphs = [f"Paragraph {i}. " + "word " * 120 for i in range(8)]
+
+    analysis = pipeline.analyze_maxims("u1", "\n\n".join(paragraphs))
+    sections = len(analysis["sections"])
+    assert sections > 2 and analysis["recomputed"] == sections and analysis["reused"] == 0
+    assert set(analysis["maxims"]) == {"Quantity", "Quality", "Relevance", "Manner"}
+    stored = json.loads(engine.xml_class.get_user_profile_content_maxim_evaluation("u1")["content_maxim_evaluation"])
+    assert stored["Quantity"]["score"] == analysis["maxims"]["Quantity"]["score"]
+
+    paragraphs[5] = "Paragraph 5 was edited. " + "other " * 120
+    analysis = pipeline.analyze_maxims("u1", "\n\n".join(paragraphs))
+    assert analysis["recomputed"] == 1 and analysis["reused"] == sections - 1
+    assert backend.stats()["requests"]["maxim_evaluation"] == sections + 1
+
+
+# Turn cancellation
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_new_message_cancels_the_turn_in_flight(make_engine, concurrent):
+    backend = FakeOpenAIBackend(latency_ms=300, latency_sigma=0)
+    engine = make_engine(backend, concurrent=concurrent)
+    start_user(engine)
+    outcomes = {}
+
+    def send(name, message):
+        try:
+            outcomes[name] = engine.generate_llm_response("u1", message)
+        except TurnCancelled:
+            outcomes[name] = "cancelled"
+
+    first = threading.Thread(target=send, args=("first", "first message"))
+    first.start()
+    time.sleep(0.1)
+    second = threading.Thread(target=send, args=("second", "second message"))
+    second.start()
+    first.join()
+    second.join()
+
+    # The classifier calls of the first turn must not turn the cancellation into a fallback result
+    assert outcomes["first"] == "cancelled"
+    assert outcomes["second"] != "cancelled"
+    assert user_inputs(engine) == ["second message"]
+    assert engine.turns.stats() == {"in_flight": 0, "cancelled": 1}
+
+
+def test_cancelled_maxim_turn_raises_instead_of_returning_an_error(make_engine):
+    backend = FakeOpenAIBackend(latency_ms=300, latency_sigma=0)
+    engine = make_engine(backend)
+    start_user(engine, mode="file_maxim_evaluation")
+    outcomes = {}
+
+    def send():
+        try:
+            outcomes["first"] = engine.generate_llm_response_with_maxim_evaluation("u1", "first message")
+        except TurnCancelled:
+            outcomes["first"] = "cancelled"
+
+    first = threading.Thread(target=send)
+    first.start()
+    time.sleep(0.1)
+    assert engine.cancel_turn("u1", "file_maxim_evaluation")
+    first.join()
+
+    assert outcomes["first"] == "cancelled"
+    assert user_inputs(engine, mode="file_maxim_evaluation") == []
+
+
+def test_cancel_turn_stops_a_stream(make_engine, backend):
+    engine = make_engine()
+    start_user(engine)
+    stream = engine.stream_llm_response("u1", "tell me a long story")
+    assert next(stream)
+
+    assert engine.cancel_turn("u1")
+    with pytest.raises(TurnCancelled):
+        list(stream)
+    assert not engine.cancel_turn("u1")
+    assert user_inputs(engine) == []
+
+
+def test_turn_cancelled_is_not_caught_as_an_exception():
+    assert not issubclass(TurnCancelled, Exception)
+    with pytest.raises(TurnCancelled):
+        try:
+            raise TurnCancelled("replaced")
+        except Exception:
+            pytest.fail("except Exception caught TurnCancelled")
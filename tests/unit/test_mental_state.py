@@ -0,0 +1,103 @@
+from fake_openai import FakeOpenAIBackend
+from EchoMind.engines.mental_state import (
+    MENTAL_STATES, LexicalMentalStateClassifier, LocalMentalStateClassifier, NaiveBayesMentalStateClassifier,
+    normalize_state
+)
+
+PROFILE = {"expertise_in_AI": "novice", "expertise_in_biology": "expert", "required_response": "small explanation"}
+
+EXAMPLES = [
+    ("thanks, that really helps", "Satisfied"),
+    ("perfect, got it now", "Satisfied"),
+    ("why does the loss go down", "Curious"),
+    ("how does backpropagation work", "Curious"),
+    ("this is still not working again", "Frustrated"),
+    ("ugh, wrong answer again", "Frustrated"),
+] * 10
+
+
+class SystemMessageBackend(FakeOpenAIBackend):
+    """Keeps the system message of every chat request."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.system_messages = []
+
+    def _completion_content(self, body):
+        with self._lock:
+            self.system_messages.append(body["messages"][0]["content"])
+        return super()._completion_content(body)
+
+
+def test_normalize_state_maps_model_answers():
+    assert normalize_state(" curious.") == "Curious"
+    assert normalize_state("**Frustrated**") == "Frustrated"
+    assert normalize_state("Happy") is None and normalize_state(None) is None
+
+
+def test_lexicon_confidence_grows_with_agreeing_cues():
+    lexicon = LexicalMentalStateClassifier()
+    assert lexicon.predict("The weights are stored in a file.") == (None, 0.0)
+
+    state, one_cue = lexicon.predict("thanks")
+    assert state == "Satisfied" and one_cue == 0.5
+    state, three_cues = lexicon.predict("Thanks, that helps, perfect")
+    assert state == "Satisfied" and three_cues == 0.75
+
+    # Cues of other states lower the confidence
+    state, mixed = lexicon.predict("Thanks, that helps, perfect. But why?")
+    assert state == "Satisfied" and mixed < three_cues
+
+
+def test_trained_model_replaces_the_lexicon_after_min_examples():
+    model = NaiveBayesMentalStateClassifier().train(EXAMPLES)
+    assert model.examples == 60
+
+    untrained = LocalMentalStateClassifier(NaiveBayesMentalStateClassifier().train(EXAMPLES[:6]), min_examples=50)
+    assert untrained.predict("the loss is wrong again") == untrained.lexicon.predict("the loss is wrong again")
+
+    classifier = LocalMentalStateClassifier(model, min_examples=50)
+    state, confidence = classifier.predict("the loss is wrong again")
+    assert state == "Frustrated" and confidence > classifier.threshold
+    assert abs(sum(model.predict_proba("the loss is wrong again").values()) - 1) < 1e-9
+
+
+def test_saved_model_loads_and_missing_model_falls_back_to_the_lexicon(workdir):
+    LocalMentalStateClassifier(NaiveBayesMentalStateClassifier().train(EXAMPLES)).save("model.json")
+    loaded = LocalMentalStateClassifier.load("model.json", threshold=0.8)
+    assert loaded.threshold == 0.8 and loaded.model.examples == 60
+    assert loaded.predict("why does it work") == LocalMentalStateClassifier(
+        NaiveBayesMentalStateClassifier().train(EXAMPLES)).predict("why does it work")
+
+    assert LocalMentalStateClassifier.load("missing.json").model is None
+
+
+def test_confident_local_answers_skip_the_llm(make_engine):
+    backend = SystemMessageBackend(latency_ms=5, latency_sigma=0)
+    engine = make_engine(backend, mental_state_classifier=LocalMentalStateClassifier())
+
+    results = engine.analyze_user_turn("Thanks, that helps, perfect")
+
+    assert results["mental_state"].value == "Satisfied" and results["mental_state"].local
+    assert results["dialogue_bias"].ok and not results["dialogue_bias"].local
+    assert len(backend.system_messages) == 1 and '"mental_state"' not in backend.system_messages[0]
+
+
+def test_uncertain_local_answers_are_escalated_to_the_llm(make_engine):
+    backend = SystemMessageBackend(latency_ms=5, latency_sigma=0)
+    engine = make_engine(backend, mental_state_classifier=LocalMentalStateClassifier())
+
+    results = engine.analyze_user_turn("thanks")
+
+    assert not results["mental_state"].local and results["mental_state"].value in MENTAL_STATES
+    assert len(backend.system_messages) == 1 and '"mental_state"' in backend.system_messages[0]
+
+
+def test_model_trains_only_on_llm_labelled_turns(make_engine):
+    engine = make_engine(mental_state_classifier=LocalMentalStateClassifier())
+    engine.xml_class.initialize_user_xml("u1", PROFILE)
+    for user_input in ("Thanks, that helps, perfect", "What is a neuron", "How do layers work"):
+        engine.generate_llm_response("u1", user_input)
+    engine.wait_for_pending("u1", "standard")
+
+    # The first turn was labelled locally and is not a training example
+    assert LocalMentalStateClassifier.from_user_xml().model.examples == 2
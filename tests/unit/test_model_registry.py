@@ -0,0 +1,114 @@
+import json
+
+import pytest
+
+from fake_openai import FakeOpenAIBackend
+from EchoMind import ResultCache
+from EchoMind.engines.llm import NO_BIAS_LABEL
+from EchoMind.engines.model_registry import DEFAULT_ROUTING, ModelRegistry, RoutingRule
+
+
+def request(content, model="gpt-4o"):
+    return {"model": model, "messages": [{"role": "user", "content": content}]}
+
+
+class UnsureSmallModelBackend(FakeOpenAIBackend):
+    """gpt-4o-mini answers content bias requests with something that is not a label."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.models = []
+
+    def _completion_content(self, body):
+        stage, content = super()._completion_content(body)
+        with self._lock:
+            self.models.append((stage, body["model"]))
+        if stage == "content_bias" and body["model"] == "gpt-4o-mini":
+            return stage, "I am not sure."
+        return stage, content
+
+
+def test_rules_route_short_and_long_inputs():
+    registry = ModelRegistry(routing={"content_bias": RoutingRule("gpt-4o-mini", escalate_to="gpt-4o",
+                                                                  max_input_tokens=50)})
+    short = registry.route("content_bias", request("Nurses are caring."))
+    long = registry.route("content_bias", request("word " * 100))
+    assert (short.model, short.reason) == ("gpt-4o-mini", "short_input")
+    assert (long.model, long.reason) == ("gpt-4o", "long_input") and long.input_tokens > 50
+
+    # Stages without a rule keep their model; an escalated request keeps the one it was escalated to
+    assert registry.route("generation", request("hi")).reason == "default"
+    assert registry.route("content_bias", request("hi", "gpt-4o"), escalated=True).model == "gpt-4o"
+
+
+def test_escalation_only_from_a_weaker_model():
+    rule = RoutingRule("gpt-4o-mini", escalate_to="gpt-4o", max_input_tokens=50)
+    registry = ModelRegistry(routing={"content_bias": rule})
+    assert registry.escalation("content_bias", request("short")) == "gpt-4o"
+    assert registry.escalation("content_bias", request("word " * 100)) is None
+    assert registry.escalation("generation", request("short")) is None
+
+    rule.escalate_on_failure = False
+    assert registry.escalation("content_bias", request("short")) is None
+
+
+def test_default_registry_routes_only_the_user_turn():
+    registry = ModelRegistry()
+    assert registry.route("user_turn", request("hi")).model == "gpt-4o-mini"
+    assert registry.route("content_bias", request("hi")).reason == "default"
+    assert registry.model_for("summary") == "gpt-3.5-turbo" and registry.model_for("unknown") == "gpt-4o"
+
+
+def test_decisions_are_logged_with_latency_and_error(workdir):
+    registry = ModelRegistry(routing=DEFAULT_ROUTING, log_path="routing.jsonl")
+    with registry.routed("content_bias", request("short")):
+        pass
+    with pytest.raises(RuntimeError):
+        with registry.routed("content_bias", request("short")):
+            raise RuntimeError("503")
+
+    first, second = registry.decisions("content_bias")
+    assert first.latency is not None and first.error is None and second.error == "RuntimeError: 503"
+    stats = registry.stats()["content_bias/gpt-4o-mini/short_input"]
+    assert stats["calls"] == 2 and stats["errors"] == 1
+    logged = [json.loads(line) for line in (workdir / "routing.jsonl").read_text().splitlines()]
+    assert [decision["model"] for decision in logged] == ["gpt-4o-mini", "gpt-4o-mini"]
+
+
+def test_registry_loads_from_a_config_file(workdir):
+    (workdir / "models.json").write_text(json.dumps({
+        "models": {"summary": "gpt-4o-mini"},
+        "routing": {"content_bias": {"model": "gpt-4o-mini", "escalate_to": "gpt-4o", "max_input_tokens": 600}},
+    }))
+    registry = ModelRegistry.from_config("models.json")
+    assert registry.model_for("summary") == "gpt-4o-mini"
+    assert registry.routing == {"content_bias": RoutingRule("gpt-4o-mini", "gpt-4o", 600)}
+
+
+def test_unclear_answers_are_escalated_and_cached(make_engine):
+    backend = UnsureSmallModelBackend(latency_ms=5, latency_sigma=0)
+    registry = ModelRegistry(routing=DEFAULT_ROUTING)
+    engine = make_engine(backend, model_registry=registry, result_cache=ResultCache(disk_dir=None))
+
+    result = engine.predict_content_bias("Nurses are caring.")
+    assert result.value == NO_BIAS_LABEL and result.attempts == 2
+    assert backend.models == [("content_bias", "gpt-4o-mini"), ("content_bias", "gpt-4o")]
+    assert [decision.reason for decision in registry.decisions("content_bias")] == ["short_input", "escalated"]
+
+    # The escalated answer is what a repeat gets, without asking either model again
+    assert engine.predict_content_bias("Nurses are caring.").cached
+    assert len(backend.models) == 2
+
+
+def test_cached_results_are_keyed_by_the_routed_model(make_engine, backend):
+    cache = ResultCache(disk_dir=None)
+    unrouted = make_engine(model_registry=ModelRegistry(routing={}), result_cache=cache)
+    routed = make_engine(model_registry=ModelRegistry(routing=DEFAULT_ROUTING), result_cache=cache)
+
+    for engine in (unrouted, routed):
+        assert not engine.predict_content_bias("Nurses are caring.").cached
+        assert not engine.predict_content_bias_batch(["Doctors are busy."])[0].cached
+    assert backend.stats()["requests"] == {"content_bias": 2, "content_bias_batch": 2}
+
+    assert routed.predict_content_bias("Nurses are caring.").cached
+    assert routed.predict_content_bias_batch(["Doctors are busy."])[0].cached
+    assert routed.grice_maxims_cache_key("A text.") == unrouted.grice_maxims_cache_key("A text.")
@@ -0,0 +1,111 @@
+import pytest
+
+from fake_openai import FakeOpenAIBackend
+from EchoMind.engines.prompts import (
+    STANDARD_SYSTEM_PROMPT, CompiledTemplate, PromptCompiler, RenderedPrompt
+)
+from EchoMind.utils.helpers import count_tokens
+
+PROFILE = {"expertise_in_AI": "novice", "expertise_in_biology": "expert", "required_response": "small explanation"}
+PROMPT_CONFIG = {
+    "expertise_in_AI": "Match the depth of AI explanations to this level.",
+    "expertise_in_biology": "Match the depth of biology explanations to this level.",
+    "required_response": "Answer in this form.",
+}
+
+
+class RequestBackend(FakeOpenAIBackend):
+    """Keeps the messages of every generation request."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.generations = []
+
+    def _completion_content(self, body):
+        stage, content = super()._completion_content(body)
+        if stage == "generation":
+            with self._lock:
+                self.generations.append(body["messages"])
+        return stage, content
+
+
+def standard(compiler, mental_state="Curious", history="User: hi\nAI: hello\n", retrieved="Chunk one."):
+    return compiler.standard(retrieved, history, "No biases detected", "No biases detected",
+                             {**PROFILE, "mental_state": mental_state})
+
+
+def test_compiled_template_renders_like_str_format():
+    slots = {"retrieved_content": "{not a slot}", "combined_history": "User: hi", "content_bias": "none",
+             "dialogue_bias": "none", "user_adaptation": "    - adapt"}
+    template = CompiledTemplate(STANDARD_SYSTEM_PROMPT)
+    assert template.fields == ["retrieved_content", "combined_history", "content_bias", "dialogue_bias",
+                               "user_adaptation"]
+    assert template.render(**slots) == STANDARD_SYSTEM_PROMPT.format(**slots)
+
+
+def test_inline_prompt_is_one_message_with_the_adaptation_block():
+    compiler = PromptCompiler(PROMPT_CONFIG)
+    prompt = standard(compiler)
+
+    assert len(prompt.messages) == 1 and prompt.messages[0]["role"] == "system"
+    assert "    - **Mental State:** Curious" in prompt.text
+    assert "    - **Expertise In Ai:** novice\n        Match the depth of AI explanations" in prompt.text
+    assert prompt.tokens == count_tokens(prompt.text)
+
+
+def test_adaptation_block_is_memoized_per_profile():
+    compiler = PromptCompiler(PROMPT_CONFIG, max_profiles=2)
+    standard(compiler)
+    standard(compiler, history="User: more")
+    assert compiler.stats() == {"adaptation_hits": 1, "adaptation_misses": 1, "profiles": 1}
+
+    # The inline block contains the mental state, so a new state is a new entry
+    standard(compiler, mental_state="Bored")
+    standard(compiler, mental_state="Confused")
+    assert compiler.stats() == {"adaptation_hits": 1, "adaptation_misses": 3, "profiles": 2}
+
+
+def test_cache_friendly_prompt_orders_messages_from_most_to_least_stable():
+    compiler = PromptCompiler(PROMPT_CONFIG, layout="cache_friendly")
+    first = standard(compiler, mental_state="Curious", history="User: hi\nAI: hello\n", retrieved="Chunk one.")
+    second = standard(compiler, mental_state="Bored", history="User: hi\nAI: hello\nUser: and?\nAI: so.\n",
+                      retrieved="Chunk two.")
+
+    assert len(first.messages) == 4
+    # Instructions and profile are the same bytes every turn, and the history only grows
+    assert first.messages[:2] == second.messages[:2]
+    assert "Match the depth of AI explanations" in first.messages[0]["content"]
+    assert "Curious" not in first.text.split("**Current Mental State:**")[0]
+    assert second.messages[2]["content"].startswith(first.messages[2]["content"])
+    assert second.messages[3]["content"].startswith("**Current Mental State:** Bored")
+    assert "Chunk two." in second.messages[3]["content"]
+    # Without the mental state in the key, both turns share one profile entry
+    assert compiler.stats()["adaptation_hits"] == 1
+
+
+def test_unknown_layout_is_rejected():
+    with pytest.raises(ValueError):
+        PromptCompiler(PROMPT_CONFIG, layout="compact")
+
+
+def test_rendered_prompt_counts_tokens_once():
+    prompt = RenderedPrompt(["First message.", "Second message."])
+    assert prompt.text == str(prompt) == "First message.\n\nSecond message."
+    assert prompt.tokens == count_tokens(prompt.text)
+    prompt.text = "changed"
+    assert prompt.tokens == count_tokens("First message.\n\nSecond message.")
+
+
+def test_cache_friendly_turns_reuse_the_providers_prompt_cache(make_engine):
+    backend = RequestBackend(latency_ms=5, latency_sigma=0)
+    engine = make_engine(backend, prompt_layout="cache_friendly")
+    engine.xml_class.initialize_user_xml("u1", PROFILE)
+    for number in range(6):
+        engine.generate_llm_response("u1", f"question {number} " + "about neural networks " * 40)
+
+    # The history of a turn extends that of the turn before
+    first, second = backend.generations[-2:]
+    assert [message["role"] for message in second] == ["system"] * 4 + ["user"]
+    assert first[:2] == second[:2] and second[2]["content"].startswith(first[2]["content"].rstrip())
+    generation = engine.prompt_cache_stats.stats()["generation"]
+    assert generation["calls"] == 6 and generation["cached_tokens"] > 0
+    assert generation["mean_latency_cache_hit"] is not None
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from EchoMind.utils.rate_limiter import (
+    DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE, TokenBucketRateLimiter, rate_limits
+)
+
+SRC = Path(__file__).parent.parent.parent / "src"
+
+
+def test_acquire_waits_for_the_bucket_to_refill():
+    limiter = TokenBucketRateLimiter(tokens_per_minute=6000)  # 100 tokens a second
+    assert limiter.acquire(6000) == 0.0
+
+    waited = limiter.acquire(20)
+
+    assert 0.15 < waited < 0.5
+    metrics = limiter.metrics()
+    assert metrics["requests"] == 2 and metrics["tokens"] == 6020
+    assert metrics["waits"] == 1 and metrics["queue_depth"] == 0 and metrics["max_queue_depth"] == 1
+
+
+def test_requests_per_minute_limit_queues_the_next_request():
+    limiter = TokenBucketRateLimiter(requests_per_minute=600)  # 10 requests a second
+    for _ in range(600):
+        limiter.acquire()
+    assert 0.05 < limiter.acquire() < 0.3
+
+
+def test_settle_refunds_an_overestimate():
+    limiter = TokenBucketRateLimiter(tokens_per_minute=6000)
+    limiter.acquire(6000)
+    limiter.settle(6000, 100)
+
+    assert limiter.acquire(1000) == 0.0
+    assert limiter.metrics()["tokens"] == 1100
+
+
+def test_settle_debits_an_underestimate():
+    limiter = TokenBucketRateLimiter(tokens_per_minute=6000)
+    limiter.acquire(3000)
+    limiter.settle(3000, 6000)
+
+    assert limiter.acquire(30) > 0.2
+    assert limiter.metrics()["tokens"] == 6030
+
+
+def test_acquire_async_waits_without_blocking_the_loop():
+    limiter = TokenBucketRateLimiter(tokens_per_minute=6000)
+    limiter.acquire(6000)
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(None)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        ticker = asyncio.create_task(tick())
+        waited = await limiter.acquire_async(20)
+        ticker.cancel()
+        return waited
+
+    assert asyncio.run(main()) > 0.15
+    assert len(ticks) > 5
+
+
+def test_unlimited_limiter_never_waits():
+    limiter = TokenBucketRateLimiter()
+    assert all(limiter.acquire(100000) == 0.0 for _ in range(100))
+
+
+def test_rate_limits_come_from_config_then_environment(monkeypatch):
+    monkeypatch.setenv("ECHOMIND_REQUESTS_PER_MINUTE", "60")
+    monkeypatch.delenv("ECHOMIND_TOKENS_PER_MINUTE", raising=False)
+    assert rate_limits() == (60, DEFAULT_TOKENS_PER_MINUTE)
+    assert rate_limits({"requests_per_minute": 0, "tokens_per_minute": 1000}) == (None, 1000)
+
+
+@pytest.mark.parametrize("variable", ["ECHOMIND_REQUESTS_PER_MINUTE", "ECHOMIND_TOKENS_PER_MINUTE"])
+def test_invalid_limit_falls_back_to_the_default(monkeypatch, capsys, variable):
+    monkeypatch.setenv(variable, "lots")
+    assert rate_limits() == (DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE)
+    assert variable in capsys.readouterr().out
+
+    # The process-wide limiter is built at import, which must not fail
+    environment = {**os.environ, "PYTHONPATH": str(SRC)}
+    result = subprocess.run([sys.executable, "-c", "import EchoMind.utils.rate_limiter"],
+                            env=environment, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
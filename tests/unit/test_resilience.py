@@ -0,0 +1,163 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from EchoMind import TurnCancelled
+from EchoMind.utils.resilience import LatencyTracker, ResilientCaller, RetryPolicy
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+class Sender:
+    """send(timeout) whose calls sleep for the given delays in turn and then return or raise."""
+    def __init__(self, *delays, errors=None):
+        self.delays = delays
+        self.errors = errors or {}
+        self.timeouts = []
+        self._lock = threading.Lock()
+
+    def _next(self, timeout):
+        with self._lock:
+            call = len(self.timeouts)
+            self.timeouts.append(timeout)
+        return call
+
+    def __call__(self, timeout):
+        call = self._next(timeout)
+        time.sleep(self.delays[min(call, len(self.delays) - 1)])
+        if call in self.errors:
+            raise self.errors[call]
+        return f"reply {call}"
+
+    async def asend(self, timeout):
+        call = self._next(timeout)
+        await asyncio.sleep(self.delays[min(call, len(self.delays) - 1)])
+        if call in self.errors:
+            raise self.errors[call]
+        return f"reply {call}"
+
+
+def test_hedge_answers_for_a_slow_primary():
+    caller = ResilientCaller(hedging=True, hedge_delay=0.05)
+    send = Sender(1.0, 0.01)
+
+    started = time.monotonic()
+    result, attempts, hedged = caller.call(send, "mental_state", hedge=True)
+
+    assert time.monotonic() - started < 0.5
+    assert (result, attempts, hedged) == ("reply 1", 1, True)
+    assert caller.stats() == {"hedges": 1, "hedge_wins": 1}
+
+
+def test_fast_primary_sends_no_hedge():
+    caller = ResilientCaller(hedging=True, hedge_delay=0.2)
+    send = Sender(0.01)
+
+    assert caller.call(send, "mental_state", hedge=True) == ("reply 0", 1, False)
+    time.sleep(0.3)
+    assert len(send.timeouts) == 1 and caller.stats() == {"hedges": 0, "hedge_wins": 0}
+
+
+def test_primary_answers_when_the_hedge_is_slower():
+    caller = ResilientCaller(hedging=True, hedge_delay=0.05)
+    send = Sender(0.15, 1.0)
+
+    assert caller.call(send, "mental_state", hedge=True) == ("reply 0", 1, False)
+    assert caller.stats() == {"hedges": 1, "hedge_wins": 0}
+
+
+def test_hedge_answers_when_the_primary_fails():
+    caller = ResilientCaller(policy=RetryPolicy(max_attempts=1), hedging=True, hedge_delay=0.05)
+    send = Sender(0.1, 0.2, errors={0: ValueError("bad primary")})
+
+    assert caller.call(send, "mental_state", hedge=True) == ("reply 1", 1, True)
+
+
+def test_cancelled_primary_does_not_wait_for_the_hedge():
+    caller = ResilientCaller(hedging=True, hedge_delay=0.05)
+    send = Sender(0.1, 1.0, errors={0: TurnCancelled("replaced")})
+
+    started = time.monotonic()
+    with pytest.raises(TurnCancelled):
+        caller.call(send, "mental_state", hedge=True)
+    assert time.monotonic() - started < 0.5
+
+
+def test_hedged_attempts_run_in_the_callers_context():
+    turn = contextvars.ContextVar("turn", default=None)
+    seen = []
+
+    def send(timeout):
+        seen.append(turn.get())
+        time.sleep(0.1)
+        return "reply"
+
+    turn.set("u1")
+    ResilientCaller(hedging=True, hedge_delay=0.02).call(send, "mental_state", hedge=True)
+    assert seen == ["u1", "u1"]
+
+
+def test_hedging_uses_the_observed_p95_latency():
+    caller = ResilientCaller(hedging=True)
+    assert caller._hedge_after("mental_state") is None  # Too few samples yet
+    for latency in range(1, 101):
+        caller.latencies.record("mental_state", latency / 100)
+    assert caller._hedge_after("mental_state") == pytest.approx(0.96)
+    assert LatencyTracker(min_samples=1).percentile("generation") is None
+
+
+def test_async_hedge_answers_for_a_slow_primary():
+    caller = ResilientCaller(hedging=True, hedge_delay=0.05)
+    send = Sender(1.0, 0.01)
+
+    started = time.monotonic()
+    result = asyncio.run(caller.acall(send.asend, "mental_state", hedge=True))
+
+    assert time.monotonic() - started < 0.5
+    assert result == ("reply 1", 1, True)
+    assert caller.stats() == {"hedges": 1, "hedge_wins": 1}
+
+
+def test_transient_errors_are_retried():
+    caller = ResilientCaller(policy=RetryPolicy(base_delay=0.01))
+    send = Sender(0, errors={0: openai.APIConnectionError(request=REQUEST),
+                             1: openai.APITimeoutError(request=REQUEST)})
+
+    assert caller.call(send, "generation") == ("reply 2", 3, False)
+
+
+def test_other_errors_are_raised_at_once():
+    caller = ResilientCaller(policy=RetryPolicy(base_delay=0.01))
+    send = Sender(0, errors={0: ValueError("bad request")})
+
+    with pytest.raises(ValueError):
+        caller.call(send, "generation")
+    assert len(send.timeouts) == 1
+
+
+def test_last_error_is_raised_when_the_attempts_run_out():
+    caller = ResilientCaller(policy=RetryPolicy(max_attempts=2, base_delay=0.01))
+    send = Sender(0, errors={call: openai.APIConnectionError(request=REQUEST) for call in range(5)})
+
+    with pytest.raises(openai.APIConnectionError):
+        caller.call(send, "generation")
+    assert len(send.timeouts) == 2
+
+
+def test_deadline_bounds_the_attempts_and_their_timeouts():
+    policy = RetryPolicy(max_attempts=100, base_delay=0.05, max_delay=0.05, timeout=30.0, deadline=0.3)
+    send = Sender(0.05, errors={call: openai.APIConnectionError(request=REQUEST) for call in range(100)})
+
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        ResilientCaller(policy=policy).call(send, "generation")
+
+    assert time.monotonic() - started < 0.6
+    assert 1 < len(send.timeouts) < 100
+    assert all(timeout <= 0.3 for timeout in send.timeouts)
+    assert send.timeouts == sorted(send.timeouts, reverse=True)
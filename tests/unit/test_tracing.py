@@ -0,0 +1,104 @@
+import contextvars
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from EchoMind.utils.tracing import HistogramRecorder, SpanHook, Tracer, current_turn
+
+PROFILE = {"expertise_in_AI": "novice", "expertise_in_biology": "expert", "required_response": "small explanation"}
+
+
+class CollectingHook(SpanHook):
+    def __init__(self):
+        self.spans = []
+
+    def on_span(self, span):
+        self.spans.append(span)
+
+
+class FailingHook(SpanHook):
+    def on_span(self, span):
+        raise RuntimeError("exporter down")
+
+
+def test_spans_inside_a_turn_carry_its_user_mode_and_number():
+    hook = CollectingHook()
+    tracer = Tracer(hooks=[hook])
+    with tracer.turn("standard", "u1", "standard") as turn:
+        assert current_turn() == {"user_id": "u1", "mode": "standard", "turn": 1}
+        with tracer.span("retrieval", chunks=3):
+            pass
+        # Work submitted to a pool runs in a copy of the context and is attributed too
+        contextvars.copy_context().run(lambda: tracer.start_span("api.generation").end())
+    assert current_turn() == {}
+
+    retrieval, generation, ended_turn = hook.spans
+    assert ended_turn is turn and turn.name == "turn.standard" and turn.duration >= retrieval.duration
+    assert retrieval.attributes == {"user_id": "u1", "mode": "standard", "turn": 1, "chunks": 3}
+    assert generation.attributes["user_id"] == "u1"
+    with tracer.turn("file", "u2", "file"):
+        pass
+    assert hook.spans[-1].attributes["turn"] == 2
+
+
+def test_errors_are_recorded_on_the_span_and_raised():
+    hook = CollectingHook()
+    tracer = Tracer(hooks=[hook])
+    with pytest.raises(ValueError):
+        with tracer.turn("standard", "u1", "standard"):
+            with tracer.span("xml.read"):
+                raise ValueError("broken xml")
+    assert [span.attributes.get("error") for span in hook.spans] == ["ValueError", "ValueError"]
+
+
+def test_failing_hooks_do_not_break_the_turn(capsys):
+    hook = CollectingHook()
+    tracer = Tracer(hooks=[FailingHook(), hook])
+    span = tracer.start_span("retrieval")
+    span.end()
+    span.end()
+
+    assert hook.spans == [span]
+    assert "exporter down" in capsys.readouterr().out
+
+
+def test_histogram_reports_percentiles_and_token_totals():
+    tracer = Tracer()
+    usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20,
+                            prompt_tokens_details=SimpleNamespace(cached_tokens=64))
+    for milliseconds in range(1, 101):
+        span = tracer.start_span("api.generation").add_usage(usage)
+        span.start = time.perf_counter() - milliseconds / 1000
+        span.end()
+
+    stats = tracer.histogram.dump()["api.generation"]
+    assert stats["count"] == 100
+    assert stats["p50_ms"] == pytest.approx(51, abs=1) and stats["p95_ms"] == pytest.approx(96, abs=1)
+    assert stats["p99_ms"] == pytest.approx(100, abs=1) and stats["max_ms"] == pytest.approx(100, abs=1)
+    assert (stats["prompt_tokens"], stats["completion_tokens"], stats["cached_tokens"]) == (10000, 2000, 6400)
+    assert tracer.histogram.report().splitlines()[1].startswith("api.generation")
+
+    tracer.histogram.clear()
+    assert tracer.histogram.dump() == {}
+
+
+def test_histogram_window_keeps_the_recent_durations():
+    recorder = HistogramRecorder(window=10)
+    tracer = Tracer(hooks=[recorder])
+    for _ in range(20):
+        tracer.start_span("retrieval").end()
+    assert recorder.dump()["retrieval"]["count"] == 20
+    assert len(recorder._durations["retrieval"]) == 10
+
+
+def test_engine_turn_records_a_span_per_stage(make_engine):
+    engine = make_engine()
+    engine.xml_class.initialize_user_xml("u1", PROFILE)
+    engine.generate_llm_response("u1", "How does attention work?")
+    engine.wait_for_pending("u1", "standard")
+
+    stats = engine.tracer.histogram.dump()
+    assert stats["turn.standard"]["count"] == 1
+    assert stats["api.generation"]["count"] == 1 and stats["api.generation"]["prompt_tokens"] > 0
+    assert stats["api.user_turn"]["count"] == 1
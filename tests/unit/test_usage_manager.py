@@ -0,0 +1,98 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from EchoMind.managers.usage_manager import UsageLedger
+from EchoMind.utils.tracing import Tracer
+
+PROFILE = {"expertise_in_AI": "novice", "expertise_in_biology": "expert", "required_response": "small explanation"}
+
+
+def usage(prompt_tokens, completion_tokens, cached_tokens=0):
+    return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                           prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens))
+
+
+def test_totals_filter_and_price_the_rows():
+    ledger = UsageLedger(path=None)
+    ledger.record("generation", usage(1_000_000, 100_000, 400_000), "gpt-4o", "u1", "standard")
+    ledger.record("user_turn", usage(1000, 20), "gpt-4o-mini", "u1", "standard")
+    ledger.record("generation", usage(2000, 200), "gpt-4o", "u2", "file")
+    ledger.record("generation", None, "gpt-4o", "u2", "file")
+
+    u1 = ledger.totals(user_id="u1")
+    assert (u1["calls"], u1["prompt_tokens"], u1["completion_tokens"], u1["cached_tokens"]) == \
+        (2, 1_001_000, 100_020, 400_000)
+    # 600k uncached and 400k cached input tokens plus 100k output tokens of gpt-4o
+    generation = ledger.totals(user_id="u1", stage="generation")
+    assert generation["cost"] == pytest.approx(0.6 * 2.50 + 0.4 * 1.25 + 0.1 * 10.00)
+    assert ledger.totals(stage="generation")["calls"] == 2
+    assert ledger.totals(model="gpt-3.5-turbo")["calls"] == 0
+    assert ledger.cost("unpriced-model", 1000, 1000) == 0.0
+
+
+def test_top_groups_and_sorts_consumers():
+    ledger = UsageLedger(path=None)
+    for user_id, tokens in (("u1", 100), ("u2", 300), ("u3", 200)):
+        ledger.record("generation", usage(tokens, 10), "gpt-4o", user_id, "standard")
+        ledger.record("user_turn", usage(50, 5), "gpt-4o-mini", user_id, "standard")
+
+    assert [user_id for user_id, _ in ledger.top(2)] == ["u2", "u3"]
+    by_stage = dict(ledger.top(group="stage"))
+    assert by_stage["user_turn"]["calls"] == 3 and by_stage["generation"]["total_tokens"] == 630
+    assert ledger.top(1, by="cost", group=("user_id", "stage"))[0][0] == ("u2", "generation")
+    with pytest.raises(ValueError):
+        ledger.top(group="country")
+    with pytest.raises(ValueError):
+        ledger.top(by="latency")
+
+
+def test_calls_are_attributed_to_the_current_turn():
+    ledger = UsageLedger(path=None)
+    tracer = Tracer()
+    with tracer.turn("standard", "u1", "file"):
+        ledger.record("generation", usage(10, 1), "gpt-4o")
+    ledger.record("content_bias", usage(10, 1), "gpt-4o-mini")
+
+    assert ledger.totals(user_id="u1", mode="file")["calls"] == 1
+    assert ledger.totals(user_id="-", mode="-", stage="content_bias")["calls"] == 1
+
+
+def test_flush_writes_compact_rows_that_the_next_ledger_loads(workdir):
+    ledger = UsageLedger(path="usage/usage.json", flush_interval=3600)
+    ledger.record("generation", usage(100, 10, 64), "gpt-4o", "u1", "standard")
+    ledger.flush()
+
+    stored = json.loads((workdir / "usage" / "usage.json").read_text())
+    assert stored["rows"] == [["u1", "standard", "generation", "gpt-4o", 1, 100, 10, 64]]
+    modified = (workdir / "usage" / "usage.json").stat().st_mtime_ns
+    ledger.flush()  # Nothing changed since the last flush
+    assert (workdir / "usage" / "usage.json").stat().st_mtime_ns == modified
+
+    restarted = UsageLedger(path="usage/usage.json")
+    restarted.record("generation", usage(100, 10), "gpt-4o", "u1", "standard")
+    assert restarted.totals(user_id="u1")["calls"] == 2 and restarted.totals()["prompt_tokens"] == 200
+    restarted.flush()  # Not left to the exit handler, which runs in another working directory
+
+
+def test_records_are_flushed_in_the_background_once_the_interval_passed(workdir):
+    ledger = UsageLedger(path="usage.json", flush_interval=0)
+    ledger.record("generation", usage(100, 10), "gpt-4o", "u1", "standard")
+
+    deadline = time.monotonic() + 5
+    while not (workdir / "usage.json").exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert json.loads((workdir / "usage.json").read_text())["rows"][0][4:] == [1, 100, 10, 0]
+
+
+def test_engine_books_every_call_of_a_turn(make_engine):
+    engine = make_engine()
+    engine.xml_class.initialize_user_xml("u1", PROFILE)
+    engine.generate_llm_response("u1", "How does attention work?")
+    engine.wait_for_pending("u1", "standard")
+
+    stages = dict(engine.usage_ledger.top(group="stage"))
+    assert stages["generation"]["calls"] == 1 and stages["user_turn"]["calls"] == 1
+    assert engine.usage_ledger.totals(user_id="u1", mode="standard")["calls"] == 2